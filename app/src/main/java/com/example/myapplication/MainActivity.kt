@@ -10,6 +10,7 @@ import android.net.nsd.NsdServiceInfo
 import android.os.Bundle
 import android.os.Handler
 import android.os.Looper
+import android.os.SystemClock
 import android.view.View
 import android.widget.*
 import androidx.activity.enableEdgeToEdge
@@ -19,11 +20,31 @@ import androidx.core.view.WindowInsetsCompat
 import java.net.DatagramPacket
 import java.net.DatagramSocket
 import java.net.InetAddress
+import java.nio.ByteBuffer
+import java.nio.ByteOrder
 import kotlin.math.sqrt
 import kotlin.math.PI
 import kotlin.concurrent.thread
 
 class MainActivity : AppCompatActivity(), SensorEventListener {
+    companion object {
+        // 二进制数据包格式 v1（小端，共28字节），需与电脑端 BINARY_PACKET 保持一致:
+        // magic(1) version(1) flags(2) seq(4) timestamp_us(8) cc1(4) cc11(4) cc_opt(4)
+        private const val PACKET_MAGIC: Byte = 0xA5.toByte()
+        private const val PACKET_VERSION: Byte = 1
+        private const val BINARY_PACKET_SIZE = 28
+        private const val BINARY_FORMAT_NAME = "bin1"
+
+        // 原始IMU数据包格式 v2（小端），需与电脑端 IMU_HEADER / IMU_SAMPLE 保持一致:
+        // 包头(24字节): magic(1) version(1) flags(2) seq(4) timestamp_us(8) count(2) 保留(2) proximity(4)
+        // 样本(每个32字节): dt_us(4) 线性加速度x/y/z(4*3) 旋转矢量四元数x/y/z/w(4*4)
+        private const val IMU_PACKET_VERSION: Byte = 2
+        private const val IMU_HEADER_SIZE = 24
+        private const val IMU_SAMPLE_SIZE = 32
+        private const val IMU_MAX_SAMPLES = 32
+        private const val IMU_FORMAT_NAME = "imu1"
+    }
+
     private lateinit var sensorManager: SensorManager
     private var linearAccelerationSensor: Sensor? = null
     private var rotationVectorSensor: Sensor? = null
@@ -40,6 +61,15 @@ class MainActivity : AppCompatActivity(), SensorEventListener {
     private var proximityData: Float = 0.0f
     private var rotationMatrix = FloatArray(9)
     private var orientationAngles = FloatArray(3)
+
+    // 原始IMU模式：每个线性加速度事件记录一个样本(连同最新的旋转矢量四元数)，发送时成批打包，
+    // 晃动和倾斜由电脑端计算，手机端不再计算旋转矩阵和方向角
+    private var streamingImu = false
+    private val quaternion = FloatArray(4)  // w, x, y, z (SensorManager.getQuaternionFromVector的顺序)
+    private val imuTimestamps = LongArray(IMU_MAX_SAMPLES)
+    private val imuSamples = FloatArray(IMU_MAX_SAMPLES * 7)
+    private var imuSampleCount = 0
+    private var imuNextSample = 0
     
     // UI组件
     private lateinit var ipEditText: EditText
@@ -59,10 +89,15 @@ class MainActivity : AppCompatActivity(), SensorEventListener {
     private var nsdManager: NsdManager? = null
     private var discoveryListener: NsdManager.DiscoveryListener? = null
     private var resolveListener: NsdManager.ResolveListener? = null
+    // 通过mDNS TXT记录声明支持二进制格式的电脑端地址，手动输入的地址使用文本格式
+    private val binaryCapableHosts = mutableSetOf<String>()
+    // 声明支持原始IMU格式的电脑端地址
+    private val imuCapableHosts = mutableSetOf<String>()
     
     // 网络通信
     private var isSending = false
     private var datagramSocket: DatagramSocket? = null
+    private var sequenceNumber = 0
     private val handler = Handler(Looper.getMainLooper())
     private val sendDataRunnable = object : Runnable {
         override fun run() {
@@ -248,9 +283,17 @@ class MainActivity : AppCompatActivity(), SensorEventListener {
             override fun onServiceResolved(serviceInfo: NsdServiceInfo) {
                 val hostAddress = serviceInfo.host?.hostAddress
                 val port = serviceInfo.port
+                // 读取电脑端支持的数据格式，例如 "text,bin1"
+                val formats = serviceInfo.attributes["formats"]?.let { String(it) } ?: ""
                 
                 runOnUiThread {
                     if (hostAddress != null) {
+                        if (formats.split(",").contains(BINARY_FORMAT_NAME)) {
+                            binaryCapableHosts.add(hostAddress)
+                        }
+                        if (formats.split(",").contains(IMU_FORMAT_NAME)) {
+                            imuCapableHosts.add(hostAddress)
+                        }
                         val serviceEntry = "$hostAddress:$port"
                         // 避免重复添加
                         if (!ipList.contains(serviceEntry)) {
@@ -317,6 +360,12 @@ class MainActivity : AppCompatActivity(), SensorEventListener {
             Sensor.TYPE_LINEAR_ACCELERATION -> {
                 // 保存线性加速度数据
                 linearAccelData = event.values.clone()
+
+                if (streamingImu) {
+                    recordImuSample(event.timestamp)
+                    updateUI()
+                    return
+                }
                 
                 // 计算运动方向上的加速度（向量的模）
                 cc1 = sqrt(
@@ -329,6 +378,12 @@ class MainActivity : AppCompatActivity(), SensorEventListener {
             Sensor.TYPE_ROTATION_VECTOR -> {
                 // 保存旋转矢量数据
                 rotationVectorData = event.values.clone()
+
+                if (streamingImu) {
+                    SensorManager.getQuaternionFromVector(quaternion, rotationVectorData)
+                    updateUI()
+                    return
+                }
                 
                 // 从旋转矢量获取旋转矩阵
                 SensorManager.getRotationMatrixFromVector(rotationMatrix, rotationVectorData)
@@ -405,18 +460,81 @@ class MainActivity : AppCompatActivity(), SensorEventListener {
         stopButton.isEnabled = false
     }
     
+    private fun buildBinaryPacket(): ByteArray {
+        val buffer = ByteBuffer.allocate(BINARY_PACKET_SIZE).order(ByteOrder.LITTLE_ENDIAN)
+        buffer.put(PACKET_MAGIC)
+        buffer.put(PACKET_VERSION)
+        buffer.putShort(0)  // flags，保留
+        buffer.putInt(sequenceNumber++)
+        buffer.putLong(SystemClock.elapsedRealtimeNanos() / 1000)  // 发送端时间戳(微秒)
+        buffer.putFloat(cc1)
+        buffer.putFloat(cc11)
+        buffer.putFloat(cc12)
+        return buffer.array()
+    }
+
+    private fun recordImuSample(timestampNs: Long) {
+        // 环形缓冲，两次发送之间样本过多时保留最新的IMU_MAX_SAMPLES个
+        val index = imuNextSample
+        imuTimestamps[index] = timestampNs
+        val base = index * 7
+        imuSamples[base] = linearAccelData[0]
+        imuSamples[base + 1] = linearAccelData[1]
+        imuSamples[base + 2] = linearAccelData[2]
+        imuSamples[base + 3] = quaternion[1]
+        imuSamples[base + 4] = quaternion[2]
+        imuSamples[base + 5] = quaternion[3]
+        imuSamples[base + 6] = quaternion[0]
+        imuNextSample = (index + 1) % IMU_MAX_SAMPLES
+        imuSampleCount = minOf(imuSampleCount + 1, IMU_MAX_SAMPLES)
+    }
+
+    private fun buildImuPacket(): ByteArray {
+        if (imuSampleCount == 0) {
+            // 两次发送之间没有新样本时重发最新的样本，电脑端仍能得到当前姿态
+            recordImuSample(SystemClock.elapsedRealtimeNanos())
+        }
+        val count = imuSampleCount
+        val nowNs = SystemClock.elapsedRealtimeNanos()
+        val buffer = ByteBuffer.allocate(IMU_HEADER_SIZE + count * IMU_SAMPLE_SIZE).order(ByteOrder.LITTLE_ENDIAN)
+        buffer.put(PACKET_MAGIC)
+        buffer.put(IMU_PACKET_VERSION)
+        buffer.putShort(0)  // flags，保留
+        buffer.putInt(sequenceNumber++)
+        buffer.putLong(nowNs / 1000)  // 发送端时间戳(微秒)
+        buffer.putShort(count.toShort())
+        buffer.putShort(0)  // 保留
+        buffer.putFloat(proximityData)
+        // 按时间顺序写入样本
+        val first = (imuNextSample - count + IMU_MAX_SAMPLES) % IMU_MAX_SAMPLES
+        for (i in 0 until count) {
+            val index = (first + i) % IMU_MAX_SAMPLES
+            buffer.putInt(((imuTimestamps[index] - nowNs) / 1000).toInt())
+            for (j in 0 until 7) {
+                buffer.putFloat(imuSamples[index * 7 + j])
+            }
+        }
+        imuSampleCount = 0
+        return buffer.array()
+    }
+
     private fun sendData() {
+        val ip = ipEditText.text.toString()
+        streamingImu = ip in imuCapableHosts
+        // 在主线程中生成数据包，保证序号与采样顺序一致
+        val buffer = when {
+            streamingImu -> buildImuPacket()
+            ip in binaryCapableHosts -> buildBinaryPacket()
+            else -> "$cc1 $cc11 $cc12".toByteArray()
+        }
         thread {
             try {
-                val ip = ipEditText.text.toString()
                 val port = portEditText.text.toString().toIntOrNull() ?: return@thread
                 
                 if (datagramSocket == null || datagramSocket?.isClosed == true) {
                     datagramSocket = DatagramSocket()
                 }
                 
-                val message = "$cc1 $cc11 $cc12"
-                val buffer = message.toByteArray()
                 val address = InetAddress.getByName(ip)
                 val packet = DatagramPacket(buffer, buffer.size, address, port)
                 datagramSocket?.send(packet)
@@ -0,0 +1,41 @@
+"""滤波器组微基准：比较NumPy与纯Python实现在不同通道数、数据源数下的单次更新耗时
+
+用法: python benchmarks/bench_filter_bank.py [循环次数]
+"""
+import math
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import midi_controller_v0_6_1 as controller
+from midi_controller_v0_6_1 import FilterBank
+
+
+def make_bank(rows, channels, vectorize_min=None):
+    return FilterBank(rows, [0.1] * channels, [-math.inf] * channels, [127.0] * channels,
+                      ["smooth"] * channels, [True] * channels, vectorize_min=vectorize_min)
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    numpy_module = controller.import_numpy()  # 值较少时滤波器组不走NumPy，这里强制比较两种实现
+    backends = [("numpy", 0)] if numpy_module is not None else []
+    backends.append(("python", math.inf))
+    for name, vectorize_min in backends:
+        for rows, channels in ((1, 3), (1, 32), (8, 3), (8, 32)):
+            bank = make_bank(rows, channels, vectorize_min)
+            row_ids = list(range(rows))
+            values = [[float(i % 127) for i in range(channels)] for _ in row_ids]
+            if rows == 1:
+                stmt = lambda: bank.update(0, values[0])
+            else:
+                stmt = lambda: bank.update_rows(row_ids, values)
+            best = min(timeit.repeat(stmt, number=number, repeat=5))
+            print(f"{name:6s} 数据源{rows:2d} 通道{channels:2d}: 每次更新 {best / number * 1_000_000:.2f} µs")
+    print(f"默认阈值: 一次更新的值达到 {FilterBank.VECTORIZE_MIN_VALUES} 个时使用NumPy")
+
+
+if __name__ == "__main__":
+    main()
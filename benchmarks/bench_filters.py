@@ -0,0 +1,154 @@
+"""滤波方式对比：在录制的数据流或合成数据流上比较 none / smooth / oneeuro 的延迟与抖动
+
+用法:
+  python benchmarks/bench_filters.py                          # 合成数据流(已知真实信号)
+  python benchmarks/bench_filters.py --capture 抓包文件 [--channel cc11] [--source IP]
+
+延迟: 把滤波输出向后平移多少毫秒与参考信号最吻合(合成数据的参考为无噪声信号，录制数据为原始输入)
+抖动: 输出相邻两次变化之差的均方根，数值越小输出越平稳
+误差: 仅合成数据，补偿延迟前输出与真实信号之差的均方根
+"""
+import argparse
+import math
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from midi_controller_v0_6_1 import (PACKET_MAGIC, FilterBank, iter_capture, parse_binary_packet,
+                                    parse_text_packet)
+
+CHANNELS = ("cc1", "cc11")
+RANGES = {"cc1": (-math.inf, 30.0), "cc11": (0.0, 90.0)}
+
+
+def synthetic_stream(seconds, rate, noise, seed):
+    """合成的倾斜手势：慢速摆动 + 快速甩动，发送间隔带随机抖动，返回 [(时间s, 带噪声值, 真实值)]"""
+    rng = random.Random(seed)
+    stream = []
+    t = 0.0
+    while t < seconds:
+        clean = 45 + 25 * math.sin(2 * math.pi * 0.3 * t)
+        # 每2秒一次0.25秒的快速甩动
+        phase = t % 2.0
+        if phase < 0.25:
+            clean += 15 * math.sin(math.pi * phase / 0.25)
+        stream.append((t, clean + rng.gauss(0, noise), clean))
+        t += rng.uniform(0.5, 1.5) / rate
+    return stream
+
+
+def captured_stream(path, channel, source_ip):
+    """从抓包文件中取出一个数据源某个通道的数据，返回 [(时间s, 值, None)]"""
+    index = CHANNELS.index(channel)
+    stream = []
+    for recv_ns, (ip, _), packet in iter_capture(path):
+        if source_ip is None:
+            source_ip = ip
+        if ip != source_ip:
+            continue
+        try:
+            if packet and packet[0] == PACKET_MAGIC:
+                _, sender_ts, *values = parse_binary_packet(packet)
+                t = sender_ts / 1_000_000
+            else:
+                _, _, *values = parse_text_packet(packet)
+                t = recv_ns / 1_000_000_000
+        except (ValueError, UnicodeDecodeError):
+            continue
+        if values[index] is not None:
+            stream.append((t, values[index], None))
+    return stream, source_ip
+
+
+def run_filter(stream, channel, kind, alpha=0.1, min_cutoff=1.0, beta=0.05, lead=0.0):
+    low, high = RANGES[channel]
+    bank = FilterBank(1, [alpha], [low], [high], [kind], [True],
+                      min_cutoffs=[min_cutoff], betas=[beta], leads=[lead])
+    output = []
+    for t, value, _ in stream:
+        bank.update(0, [value], t)
+        output.append(bank.values(0)[0])
+    return output
+
+
+def resample(times, values, step):
+    """按零阶保持重采样到均匀时间网格(与MIDI端看到的效果一致)"""
+    grid = []
+    i = 0
+    t = times[0]
+    while t <= times[-1]:
+        while i + 1 < len(times) and times[i + 1] <= t:
+            i += 1
+        grid.append(values[i])
+        t += step
+    return grid
+
+
+def estimate_lag_ms(times, output, reference, max_lag_ms=150):
+    """返回使输出与平移后的参考信号均方误差最小的平移量(毫秒)"""
+    out = resample(times, output, 0.001)
+    ref = resample(times, reference, 0.001)
+    best_lag, best_error = 0, None
+    for lag in range(0, max_lag_ms + 1):
+        n = len(out) - lag
+        error = sum((out[i + lag] - ref[i]) ** 2 for i in range(0, n, 4)) / max(1, n // 4)
+        if best_error is None or error < best_error:
+            best_lag, best_error = lag, error
+    return best_lag
+
+
+def jitter(output):
+    """相邻两次变化之差(二阶差分)的均方根"""
+    diffs = [output[i + 1] - 2 * output[i] + output[i - 1] for i in range(1, len(output) - 1)]
+    return math.sqrt(sum(d * d for d in diffs) / max(1, len(diffs)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="滤波方式延迟/抖动对比")
+    parser.add_argument('--capture', help="抓包文件(--capture模式录制)，不指定时使用合成数据流")
+    parser.add_argument('--channel', choices=CHANNELS, default="cc11")
+    parser.add_argument('--source', help="抓包文件中的数据源IP，默认第一个")
+    parser.add_argument('--seconds', type=float, default=20.0, help="合成数据流时长(秒)")
+    parser.add_argument('--rate', type=float, default=120.0, help="合成数据流发送频率(Hz)")
+    parser.add_argument('--noise', type=float, default=0.8, help="合成数据流噪声标准差")
+    parser.add_argument('--min-cutoff', type=float, default=1.0)
+    parser.add_argument('--beta', type=float, default=0.05)
+    args = parser.parse_args()
+
+    if args.capture:
+        stream, source_ip = captured_stream(args.capture, args.channel, args.source)
+        if len(stream) < 10:
+            print("抓包文件中没有足够的数据")
+            return
+        print(f"录制数据流: {args.capture}，数据源 {source_ip}，通道 {args.channel}，{len(stream)} 个样本")
+        reference = [value for _, value, _ in stream]
+    else:
+        stream = synthetic_stream(args.seconds, args.rate, args.noise, seed=1)
+        print(f"合成数据流: {len(stream)} 个样本，约{args.rate:.0f}Hz，噪声标准差 {args.noise}")
+        reference = [clean for _, _, clean in stream]
+    times = [t - stream[0][0] for t, _, _ in stream]
+
+    configs = [
+        ("none", dict(kind="none")),
+        ("smooth aef=0.1", dict(kind="smooth", alpha=0.1)),
+        ("smooth aef=0.3", dict(kind="smooth", alpha=0.3)),
+        ("oneeuro", dict(kind="oneeuro", min_cutoff=args.min_cutoff, beta=args.beta)),
+        ("oneeuro lead=20ms", dict(kind="oneeuro", min_cutoff=args.min_cutoff, beta=args.beta, lead=0.02)),
+    ]
+    header = f"{'滤波方式':20s}{'延迟(ms)':>10s}{'抖动':>10s}"
+    if not args.capture:
+        header += f"{'误差RMS':>10s}"
+    print(header)
+    for name, config in configs:
+        output = run_filter(stream, args.channel, **config)
+        line = f"{name:20s}{estimate_lag_ms(times, output, reference):>10d}{jitter(output):>10.3f}"
+        if not args.capture:
+            error = math.sqrt(sum((o - r) ** 2 for o, r in zip(output, reference)) / len(output))
+            line += f"{error:>10.3f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""手势检测延迟基准：在合成或录制的cc1(晃动强度)数据流上逐个样本运行GestureDetector
+
+用法:
+  python benchmarks/bench_gestures.py                          # 合成数据流(已知每次晃动的峰值时间)
+  python benchmarks/bench_gestures.py --capture 抓包文件 [--source IP]
+
+检测延迟: 峰值事件所在样本的时间 - 真实峰值的时间(合成数据)；录制数据没有真实峰值，
+以峰值事件之前数值最大的样本作为峰值，反映检测器自身的前瞻延迟
+漏检/误检: 仅合成数据，每次晃动应当恰好产生一个峰值事件
+每样本耗时: update()的平均耗时，检测在接收线程中运行
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from midi_controller_v0_6_1 import (IMU_PACKET_VERSION, PACKET_MAGIC, GestureDetector, fuse_imu_batch,
+                                    iter_capture, parse_binary_packet, parse_imu_packet, parse_text_packet)
+
+
+def synthetic_stream(seconds, rate, noise, seed):
+    """合成的晃动：静止的噪声上每隔0.3-1.2秒一次宽60-200ms、强度5-25的晃动，偶尔连续晃动多次
+
+    返回 ([(时间s, 值)], [真实峰值时间s])，发送间隔带随机抖动
+    """
+    rng = random.Random(seed)
+    pulses = []
+    t = 0.5
+    while t < seconds - 1:
+        repeats = rng.choice((1, 1, 1, 3))  # 有时连续晃动
+        for _ in range(repeats):
+            width = rng.uniform(0.06, 0.2)
+            pulses.append((t, width, rng.uniform(5, 25)))
+            t += width + rng.uniform(0.02, 0.05) if repeats > 1 else width
+        t += rng.uniform(0.3, 1.2)
+
+    stream = []
+    t = 0.0
+    i = 0
+    while t < seconds:
+        while i < len(pulses) and pulses[i][0] + pulses[i][1] < t:
+            i += 1
+        value = abs(rng.gauss(0, noise))
+        if i < len(pulses) and pulses[i][0] <= t:
+            start, width, height = pulses[i]
+            value += height * math.sin(math.pi * (t - start) / width)
+        stream.append((t, value))
+        t += rng.uniform(0.5, 1.5) / rate
+    return stream, [start + width / 2 for start, width, _ in pulses]
+
+
+def captured_stream(path, source_ip):
+    """从抓包文件中取出一个数据源的cc1，返回 [(时间s, 值)]"""
+    stream = []
+    for recv_ns, (ip, _), packet in iter_capture(path):
+        if source_ip is None:
+            source_ip = ip
+        if ip != source_ip:
+            continue
+        try:
+            if packet and packet[0] == PACKET_MAGIC and len(packet) > 1 and packet[1] == IMU_PACKET_VERSION:
+                _, sender_ts, _, count = parse_imu_packet(packet)
+                value = fuse_imu_batch(packet, count)[0]
+                t = sender_ts / 1_000_000
+            elif packet and packet[0] == PACKET_MAGIC:
+                _, sender_ts, value, _, _ = parse_binary_packet(packet)
+                t = sender_ts / 1_000_000
+            else:
+                _, _, value, _, _ = parse_text_packet(packet)
+                t = recv_ns / 1_000_000_000
+        except (ValueError, UnicodeDecodeError):
+            continue
+        if value is not None:
+            stream.append((t, value))
+    return stream, source_ip
+
+
+def run_detector(stream, args):
+    """返回 ([(峰值事件的时间s, 力度)], 每样本平均耗时us)"""
+    detector = GestureDetector(min_level=args.min_level, sensitivity=args.sensitivity,
+                               refractory_ms=args.refractory_ms, full_scale=args.full_scale)
+    update = detector.update
+    peaks = []
+    start = time.perf_counter()
+    for t, value in stream:
+        events = update(value, t)
+        if events:
+            peaks.extend((t, velocity) for kind, velocity in events if kind == "peak")
+    elapsed = time.perf_counter() - start
+    return peaks, elapsed / len(stream) * 1_000_000
+
+
+def match_peaks(peaks, truth, window=0.1, early=0.05):
+    """按时间顺序把检测到的峰值与真实峰值配对(峰值事件在真实峰值前early秒到后window秒之内)，
+    返回 (延迟ms列表, 漏检数, 误检数)"""
+    latencies = []
+    used = set()
+    j = 0
+    for t, _ in peaks:
+        while j < len(truth) and truth[j] < t - window:
+            j += 1
+        # 取窗口内最近的未配对真实峰值
+        candidates = [k for k in range(j, len(truth)) if truth[k] <= t + early and k not in used]
+        if candidates:
+            k = min(candidates, key=lambda k: abs(truth[k] - t))
+            used.add(k)
+            latencies.append((t - truth[k]) * 1000)
+    return latencies, len(truth) - len(used), len(peaks) - len(used)
+
+
+def lookahead_latencies(stream, peaks):
+    """录制数据：峰值事件时间与其前面最近的局部最大样本的时间差(ms)"""
+    times = [t for t, _ in stream]
+    index = {t: i for i, t in enumerate(times)}
+    latencies = []
+    for t, _ in peaks:
+        i = index[t]
+        j = max(0, i - 1)
+        while j > 0 and stream[j - 1][1] > stream[j][1]:
+            j -= 1
+        latencies.append((t - times[j]) * 1000)
+    return latencies
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="手势检测延迟基准")
+    parser.add_argument('--capture', help="抓包文件(--capture模式录制)，不指定时使用合成数据流")
+    parser.add_argument('--source', help="抓包文件中的数据源IP，默认第一个")
+    parser.add_argument('--seconds', type=float, default=60.0, help="合成数据流时长(秒)")
+    parser.add_argument('--rate', type=float, default=100.0, help="合成数据流发送频率(Hz)")
+    parser.add_argument('--noise', type=float, default=0.5, help="合成数据流静止时的噪声标准差")
+    parser.add_argument('--min-level', type=float, default=2.0)
+    parser.add_argument('--sensitivity', type=float, default=3.0)
+    parser.add_argument('--refractory-ms', type=float, default=80.0)
+    parser.add_argument('--full-scale', type=float, default=30.0, help="力度127对应的值，默认与cc1_max一致")
+    args = parser.parse_args()
+
+    if args.capture:
+        stream, source_ip = captured_stream(args.capture, args.source)
+        if len(stream) < 10:
+            print("抓包文件中没有足够的数据")
+            return
+        print(f"录制数据流: {args.capture}，数据源 {source_ip}，{len(stream)} 个样本")
+        truth = None
+    else:
+        stream, truth = synthetic_stream(args.seconds, args.rate, args.noise, seed=1)
+        print(f"合成数据流: {len(stream)} 个样本，约{args.rate:.0f}Hz，{len(truth)} 次晃动")
+
+    peaks, cost_us = run_detector(stream, args)
+    interval_ms = (stream[-1][0] - stream[0][0]) / (len(stream) - 1) * 1000
+    print(f"检测到峰值 {len(peaks)} 次，平均数据包间隔 {interval_ms:.1f}ms，每样本耗时 {cost_us:.2f}us")
+    if truth is not None:
+        latencies, missed, false = match_peaks(peaks, truth)
+        print(f"漏检 {missed} 次，误检 {false} 次")
+    else:
+        latencies = lookahead_latencies(stream, peaks)
+    if latencies:
+        print(f"检测延迟(ms): p50={percentile(latencies, 0.5):.1f} p99={percentile(latencies, 0.99):.1f} "
+              f"max={max(latencies):.1f}")
+
+
+if __name__ == "__main__":
+    main()
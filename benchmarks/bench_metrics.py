@@ -0,0 +1,32 @@
+"""延迟统计开销微基准：测量直方图单次记录的耗时
+
+用法: python benchmarks/bench_metrics.py [循环次数]
+"""
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from midi_controller_v0_6_1 import LatencyHistogram
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    histogram = LatencyHistogram("bench")
+    start_ns = time.perf_counter_ns()
+
+    # 与热路径中的用法一致：取时间戳、换算成微秒并记录
+    def record_event():
+        histogram.record((time.perf_counter_ns() - start_ns) // 1000 & 0xFFFF)
+
+    best = min(timeit.repeat(record_event, number=number, repeat=5))
+    print(f"每次记录(含取时间戳) {best / number * 1_000_000_000:.0f} ns")
+
+    best = min(timeit.repeat(lambda: histogram.record(1234), number=number, repeat=5))
+    print(f"每次记录(仅直方图) {best / number * 1_000_000_000:.0f} ns")
+
+
+if __name__ == "__main__":
+    main()
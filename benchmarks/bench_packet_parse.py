@@ -0,0 +1,53 @@
+"""数据包解析耗时微基准：比较文本格式与二进制格式的单包解析开销，以及原始IMU格式解析加姿态计算的开销
+
+用法: python benchmarks/bench_packet_parse.py [循环次数]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from midi_controller_v0_6_1 import (BINARY_PACKET, IMU_HEADER, IMU_PACKET_VERSION, IMU_SAMPLE, PACKET_MAGIC,
+                                    PACKET_VERSION, fuse_imu_batch, parse_binary_packet, parse_imu_packet,
+                                    parse_text_packet)
+
+
+def build_imu_packet(count):
+    """生成一个包含count个样本的原始IMU数据包"""
+    samples = b"".join(IMU_SAMPLE.pack(-i * 5000, 0.3 * i, -1.2, 2.5, 0.1, 0.2, 0.05, 0.97) for i in range(count))
+    return IMU_HEADER.pack(PACKET_MAGIC, IMU_PACKET_VERSION, 0, 123456, 987654321, count, 5.0) + samples
+
+
+def parse_and_fuse_imu(packet):
+    _, _, _, count = parse_imu_packet(packet)
+    return fuse_imu_batch(packet, count)
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    # 与手机端实际发送内容一致的样本数据
+    text_packet = "12.345678 45.678901 5.0".encode('utf-8')
+    binary_packet = BINARY_PACKET.pack(PACKET_MAGIC, PACKET_VERSION, 0, 123456, 987654321, 12.345678, 45.678901, 5.0)
+
+    results = []
+    for name, func, packet in (("文本", parse_text_packet, text_packet),
+                               ("二进制", parse_binary_packet, binary_packet)):
+        # 取多轮中的最小值，降低系统调度带来的干扰
+        best = min(timeit.repeat(lambda: func(packet), number=number, repeat=5))
+        per_packet_ns = best / number * 1_000_000_000
+        results.append(per_packet_ns)
+        print(f"{name}格式: {len(packet)}字节, 每包解析 {per_packet_ns:.0f} ns")
+
+    print(f"二进制格式解析耗时为文本格式的 {results[1] / results[0] * 100:.0f}%")
+
+    # 手机端60Hz发送时，传感器200Hz约为每包4个样本
+    for count in (4, 16, 32):
+        packet = build_imu_packet(count)
+        best = min(timeit.repeat(lambda: parse_and_fuse_imu(packet), number=number // 10, repeat=5))
+        print(f"原始IMU格式({count}个样本): {len(packet)}字节, 每包解析与姿态计算 {best / (number // 10) * 1_000_000_000:.0f} ns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""处理流程基准：用独立进程模拟N台手机，控制器输出到内存MIDI端口，比较各运行方式/输出模式的性能
+
+报告每种模式的吞吐量(每秒处理的数据包)、发送节拍抖动、丢包率和控制器进程的CPU占用，
+不需要真实手机和MIDI设备，可在无界面的Linux机器上运行。
+
+用法: python benchmarks/bench_pipeline.py [--phones N] [--rate HZ] [--duration S] [--modes threads-polled,asyncio-event]
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from midi_controller_v0_6_1 import MIDISensorController
+from phone_simulator import run_phones
+
+MODES = ("threads-polled", "threads-event", "asyncio-polled", "asyncio-event")
+
+
+def make_controller(port, output_mode):
+    """创建一个不依赖外部设备的控制器"""
+    controller = MIDISensorController(port)
+    controller.port = port
+    controller.output_mode = output_mode
+    controller.null_midi = True
+    controller.mdns_enabled = False
+    controller.para_monitor_display = "false"
+    controller.metrics_interval = 0
+    controller.metrics_port = 0
+    return controller
+
+
+def run_mode(mode, args, verbose):
+    runtime, output_mode = mode.split("-")
+    log = io.StringIO()
+    redirect = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(log)
+
+    with redirect:
+        controller = make_controller(args.port, output_mode)
+        if runtime == "threads":
+            if not controller.start():
+                raise RuntimeError(f"控制器启动失败:\n{log.getvalue()}")
+            runner = None
+        else:
+            runner = threading.Thread(target=controller.run_asyncio, daemon=True)
+            runner.start()
+        time.sleep(0.3)
+
+        sent = multiprocessing.Value('q', 0)
+        phone_process = multiprocessing.Process(
+            target=run_phones,
+            args=("127.0.0.1", args.port, args.phones, args.rate, args.duration, args.format, sent))
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        phone_process.start()
+        phone_process.join()
+        # 等待积压的数据处理完
+        time.sleep(0.2)
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+
+        received = sum(source.packets for source in controller.sources)
+        midi_messages = controller.midi_output.count if controller.midi_output else 0
+        scheduler = controller.scheduler
+        total_latency = controller.metrics.total
+
+        controller.running = False
+        if runner:
+            runner.join(timeout=controller.data_timeout + 1)
+        controller.stop()
+
+    return {
+        "mode": mode,
+        "sent": sent.value,
+        "received": received,
+        "throughput": received / wall,
+        "drop": 1 - received / sent.value if sent.value else 0.0,
+        "cpu": cpu / wall * 100,
+        "midi": midi_messages,
+        "jitter_p99": scheduler.lateness.percentile(0.99) if scheduler and output_mode == "polled" else None,
+        "jitter_max": scheduler.max_lateness_ns // 1000 if scheduler and output_mode == "polled" else None,
+        "latency_p99": total_latency.percentile(0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="处理流程基准")
+    parser.add_argument("--phones", type=int, default=4, help="模拟手机数量，默认4")
+    parser.add_argument("--rate", type=float, default=120, help="每台手机的发送频率(Hz)，默认120")
+    parser.add_argument("--duration", type=float, default=5, help="每种模式的测试时长(秒)，默认5")
+    parser.add_argument("--format", choices=("text", "binary"), default="binary", help="数据包格式，默认binary")
+    parser.add_argument("--port", type=int, default=18080, help="控制器监听端口，默认18080")
+    parser.add_argument("--modes", default=",".join(MODES), help=f"要测试的模式，逗号分隔，可选: {', '.join(MODES)}")
+    parser.add_argument("--verbose", action="store_true", help="显示控制器自身的输出")
+    args = parser.parse_args()
+
+    print(f"模拟 {args.phones} 台手机，每台 {args.rate:g}Hz，{args.format}格式，每种模式 {args.duration:g} 秒\n")
+    results = [run_mode(mode, args, args.verbose) for mode in args.modes.split(",")]
+
+    print(f"{'模式':<16}{'吞吐(包/s)':>12}{'丢包率':>9}{'CPU':>8}{'MIDI消息':>10}{'节拍抖动p99/max(us)':>22}{'收包→发送p99(ms)':>18}")
+    for r in results:
+        jitter = f"{r['jitter_p99']}/{r['jitter_max']}" if r["jitter_p99"] is not None else "-"
+        print(f"{r['mode']:<16}{r['throughput']:>12.0f}{r['drop'] * 100:>8.2f}%{r['cpu']:>7.1f}%"
+              f"{r['midi']:>10}{jitter:>22}{r['latency_p99'] / 1000:>18.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""分片模式扩展性基准：用多个进程模拟大量手机高频发送，比较不同工作进程数时控制器的处理能力
+
+每台模拟手机以较高的频率发送，使接收、解析和滤波成为瓶颈；报告每种分片数下每秒处理的数据包数、
+丢包率以及相对单进程的加速比。分片数1为不分片的单进程模式。
+模拟手机本身也占用CPU，CPU核心数应多于测试的最大分片数与发送进程数之和，结果才能反映控制器的扩展性。
+需要支持SO_REUSEPORT的系统(Linux、macOS)。
+
+用法: python benchmarks/bench_sharded.py [--phones 32] [--rate 1000] [--senders 4] [--shards 1,2,4,8]
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from midi_controller_v0_6_1 import MIDISensorController
+from phone_simulator import run_phones
+
+
+def make_controller(port, shards, phones):
+    """创建一个不依赖外部设备的控制器"""
+    controller = MIDISensorController(port)
+    controller.port = port
+    controller.shards = shards
+    controller.max_sources = phones
+    controller.filter_bank = controller.build_filter_bank()
+    controller.null_midi = True
+    controller.mdns_enabled = False
+    controller.hot_reload = False
+    controller.para_monitor_display = "false"
+    controller.metrics_interval = 0
+    controller.metrics_port = 0
+    return controller
+
+
+def run_shards(shards, args, verbose):
+    log = io.StringIO()
+    redirect = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(log)
+
+    with redirect:
+        controller = make_controller(args.port, shards, args.phones)
+        if not controller.start():
+            raise RuntimeError(f"控制器启动失败:\n{log.getvalue()}")
+        time.sleep(0.3)
+
+        # 手机平均分给多个发送进程，每个进程使用不同的回环地址
+        senders = []
+        per_sender = -(-args.phones // args.senders)
+        for first in range(0, args.phones, per_sender):
+            sent = multiprocessing.Value('q', 0)
+            process = multiprocessing.Process(
+                target=run_phones,
+                args=("127.0.0.1", args.port, min(per_sender, args.phones - first), args.rate, args.duration,
+                      "binary", sent, first))
+            senders.append((process, sent))
+
+        wall_start = time.perf_counter()
+        for process, _ in senders:
+            process.start()
+        for process, _ in senders:
+            process.join()
+        # 等待积压的数据处理完，并让发送线程读取最后的结果
+        time.sleep(0.3)
+        wall = time.perf_counter() - wall_start
+
+        sent = sum(value.value for _, value in senders)
+        received = sum(source.packets for source in controller.sources)
+        controller.stop()
+
+    return {
+        "shards": shards,
+        "sent": sent,
+        "received": received,
+        "throughput": received / wall,
+        "drop": 1 - received / sent if sent else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分片模式扩展性基准")
+    parser.add_argument("--phones", type=int, default=32, help="模拟手机数量，默认32")
+    parser.add_argument("--rate", type=float, default=1000, help="每台手机的发送频率(Hz)，默认1000")
+    parser.add_argument("--senders", type=int, default=4, help="模拟手机的发送进程数，默认4")
+    parser.add_argument("--duration", type=float, default=5, help="每种分片数的测试时长(秒)，默认5")
+    parser.add_argument("--port", type=int, default=18081, help="控制器监听端口，默认18081")
+    cores = os.cpu_count() or 1
+    default_shards = ",".join(str(n) for n in (1, 2, 4, 8, 16) if n <= cores) or "1"
+    parser.add_argument("--shards", default=default_shards, help=f"要测试的分片数，逗号分隔，默认{default_shards}")
+    parser.add_argument("--verbose", action="store_true", help="显示控制器自身的输出")
+    args = parser.parse_args()
+
+    print(f"模拟 {args.phones} 台手机(分{args.senders}个进程发送)，每台 {args.rate:g}Hz，"
+          f"每种分片数 {args.duration:g} 秒，CPU核心 {cores} 个\n")
+    results = [run_shards(int(shards), args, args.verbose) for shards in args.shards.split(",")]
+
+    base = results[0]["throughput"]
+    print(f"{'分片数':<8}{'发送':>10}{'处理':>10}{'吞吐(包/s)':>12}{'丢包率':>9}{'加速比':>8}")
+    for r in results:
+        print(f"{r['shards']:<8}{r['sent']:>10}{r['received']:>10}{r['throughput']:>12.0f}"
+              f"{r['drop'] * 100:>8.2f}%{r['throughput'] / base:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
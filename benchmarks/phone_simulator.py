@@ -0,0 +1,95 @@
+"""手机模拟器：在本机模拟N台手机，以指定频率向控制器发送传感器数据包
+
+每台手机使用不同的回环地址(127.0.0.1、127.0.0.2……)发送，控制器会把它们识别为不同的数据源。
+也可以单独运行，配合真实的控制器做手动测试:
+    python benchmarks/phone_simulator.py --phones 4 --rate 120 --duration 10 --port 8080
+"""
+import argparse
+import math
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from midi_controller_v0_6_1 import BINARY_PACKET, PACKET_MAGIC, PACKET_VERSION
+
+
+def open_phone_sockets(phones, first=0):
+    """为每台模拟手机创建一个绑定到独立回环地址的socket，first为第一台手机的序号(多个模拟进程时错开地址)"""
+    socks = []
+    for index in range(first, first + phones):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        address = f"127.0.{index // 250}.{index % 250 + 1}"
+        try:
+            sock.bind((address, 0))
+        except OSError:
+            # 部分系统只支持127.0.0.1，此时所有模拟手机会被识别为同一个数据源；
+            # 序号0绑定的就是127.0.0.1，第一个会失败的是本进程中序号不为0的第一台手机
+            if index == max(first, 1):
+                print(f"警告：无法绑定{address}，所有模拟手机将共用127.0.0.1")
+            sock.bind(("127.0.0.1", 0))
+        socks.append(sock)
+    return socks
+
+
+def build_packet(packet_format, seq, elapsed, phase):
+    """生成一个模拟的传感器数据包：cc1为晃动强度，cc11为倾斜角度，cc_opt为距离传感器"""
+    cc1 = 15.0 + 15.0 * math.sin(2 * math.pi * 2.0 * elapsed + phase)
+    cc11 = 45.0 + 45.0 * math.sin(2 * math.pi * 0.25 * elapsed + phase)
+    cc_opt = 5.0 if int(elapsed + phase) % 2 else 0.0
+    if packet_format == "binary":
+        timestamp_us = time.perf_counter_ns() // 1000
+        return BINARY_PACKET.pack(PACKET_MAGIC, PACKET_VERSION, 0, seq & 0xFFFFFFFF, timestamp_us, cc1, cc11, cc_opt)
+    return f"{cc1} {cc11} {cc_opt}".encode('utf-8')
+
+
+def run_phones(host, port, phones, rate, duration, packet_format="binary", sent=None, first=0):
+    """按绝对截止时间发送，返回发送的数据包总数；sent为multiprocessing.Value时同时写入其中"""
+    socks = open_phone_sockets(phones, first)
+    period_ns = int(1_000_000_000 / rate)
+    start_ns = time.perf_counter_ns()
+    end_ns = start_ns + int(duration * 1_000_000_000)
+    deadline = start_ns
+    seq = 0
+    count = 0
+
+    while deadline < end_ns:
+        elapsed = (deadline - start_ns) / 1_000_000_000
+        for index, sock in enumerate(socks):
+            try:
+                sock.sendto(build_packet(packet_format, seq, elapsed, index * 0.7), (host, port))
+                count += 1
+            except OSError:
+                pass
+        seq += 1
+
+        deadline += period_ns
+        remaining = deadline - time.perf_counter_ns()
+        if remaining > 0:
+            time.sleep(remaining / 1_000_000_000)
+
+    for sock in socks:
+        sock.close()
+    if sent is not None:
+        sent.value = count
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟多台手机发送传感器数据")
+    parser.add_argument("--host", default="127.0.0.1", help="控制器地址，默认127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080, help="控制器端口，默认8080")
+    parser.add_argument("--phones", type=int, default=1, help="模拟手机数量，默认1")
+    parser.add_argument("--rate", type=float, default=60, help="每台手机的发送频率(Hz)，默认60")
+    parser.add_argument("--duration", type=float, default=10, help="发送时长(秒)，默认10")
+    parser.add_argument("--format", choices=("text", "binary"), default="binary", help="数据包格式，默认binary")
+    args = parser.parse_args()
+
+    count = run_phones(args.host, args.port, args.phones, args.rate, args.duration, args.format)
+    print(f"已发送 {count} 个数据包")
+
+
+if __name__ == "__main__":
+    main()
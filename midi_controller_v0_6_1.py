@@ -1,33 +1,1540 @@
+import time
+
+# 进程启动时间，用于启动耗时报告；在其余模块导入之前记录，导入耗时也计入报告
+PROCESS_START_NS = time.perf_counter_ns()
+
 import socket
+import selectors
+import argparse
 import threading
-import time
 import sys
-import mido
 import os
+import re
 import configparser
-from zeroconf import Zeroconf, ServiceInfo
+import math
+import struct
+import collections
+import heapq
+import mmap
+from array import array
+
+# mido、zeroconf和NumPy在第一次用到时才导入：启动时先打开socket开始接收，再导入mido初始化MIDI；
+# --no-mdns或通道数较少时不为用不到的zeroconf和NumPy付出导入时间。
+# asyncio只在asyncio运行时导入，http.server只在开启统计接口时导入
+mido = None
+np = None
+numpy_checked = False
+asyncio = None
+
+
+def import_asyncio():
+    """导入asyncio(只在第一次调用时导入)"""
+    global asyncio
+    if asyncio is None:
+        import asyncio as module
+        asyncio = module
+    return asyncio
+
+
+def import_mido():
+    """导入mido(只在第一次调用时导入)"""
+    global mido
+    if mido is None:
+        import mido as module
+        mido = module
+    return mido
+
+
+def import_numpy():
+    """导入NumPy，没有安装时返回None
+
+    NumPy为可选依赖，没有安装时滤波器组使用纯Python实现。
+    """
+    global np, numpy_checked
+    if not numpy_checked:
+        numpy_checked = True
+        try:
+            import numpy as module
+            np = module
+        except ImportError:
+            np = None
+    return np
+
+
+# 二进制数据包格式 v1（小端，共28字节）:
+# magic(B) version(B) flags(H) seq(I) timestamp_us(Q) cc1(f) cc11(f) cc_opt(f)
+# magic取非ASCII值，第一个字节即可与文本格式 "cc1 cc11 cc_opt" 区分
+PACKET_MAGIC = 0xA5
+PACKET_VERSION = 1
+BINARY_PACKET = struct.Struct('<BBHIQfff')
+# 原始IMU数据包格式 v2（小端），手机端不再计算晃动和倾斜，而是成批发送原始样本，由电脑端完成姿态计算:
+# 包头(24字节): magic(B) version(B) flags(H) seq(I) timestamp_us(Q) count(H) 保留(2) proximity(f)
+# 样本(每个32字节): dt_us(i, 样本时间减包头时间戳) 线性加速度x/y/z(f) 旋转矢量四元数x/y/z/w(f)
+IMU_PACKET_VERSION = 2
+IMU_HEADER = struct.Struct('<BBHIQHxxf')
+IMU_SAMPLE = struct.Struct('<i7f')
+IMU_MAX_SAMPLES = 32
+# 通过mDNS TXT记录告知手机端支持的数据格式
+SUPPORTED_FORMATS = "text,bin1"
+IMU_FORMAT = "imu1"
+
+# 原始IMU模式下由电脑端计算的量及其取值范围，shake的范围为(0, cc1_max)；proximity为距离传感器原始值，不做换算
+# pitch/roll/yaw与手机端SensorManager.getOrientation()的俯仰、横滚、方位角一致，单位为度
+IMU_QUANTITIES = ("shake", "tilt", "pitch", "roll", "yaw", "proximity")
+IMU_RANGES = {"tilt": (0.0, 90.0), "pitch": (-90.0, 90.0), "roll": (-180.0, 180.0), "yaw": (-180.0, 180.0)}
+# 一批样本达到该数量且安装了NumPy时向量化计算，样本较少时NumPy的固定开销反而更大
+IMU_VECTORIZE_MIN_SAMPLES = 16
+
+
+def parse_text_packet(data):
+    """解析文本数据包 "cc1 cc11 cc_opt"，返回 (seq, timestamp_us, cc1, cc11, cc_opt)，缺失字段为None"""
+    # data可以是bytes或指向接收缓冲区的memoryview
+    parts = str(data, 'utf-8').strip().split(' ')
+    count = len(parts)
+    cc1 = float(parts[0])
+    cc11 = float(parts[1]) if count >= 2 else None
+    cc_opt = float(parts[2]) if count >= 3 else None
+    return None, None, cc1, cc11, cc_opt
+
+
+def parse_binary_packet(data):
+    """解析二进制数据包，返回 (seq, timestamp_us, cc1, cc11, cc_opt)"""
+    if len(data) < BINARY_PACKET.size:
+        raise ValueError(f"二进制数据包长度不足: {len(data)}")
+    _, version, _, seq, timestamp_us, cc1, cc11, cc_opt = BINARY_PACKET.unpack_from(data)
+    if version != PACKET_VERSION:
+        raise ValueError(f"不支持的数据包版本: {version}")
+    return seq, timestamp_us, cc1, cc11, cc_opt
+
+
+def parse_imu_packet(data):
+    """解析原始IMU数据包，返回 (seq, timestamp_us, proximity, 样本数)，样本紧跟在包头之后"""
+    if len(data) < IMU_HEADER.size:
+        raise ValueError(f"IMU数据包长度不足: {len(data)}")
+    _, version, _, seq, timestamp_us, count, proximity = IMU_HEADER.unpack_from(data)
+    if version != IMU_PACKET_VERSION:
+        raise ValueError(f"不支持的数据包版本: {version}")
+    if not 0 < count <= IMU_MAX_SAMPLES or len(data) < IMU_HEADER.size + count * IMU_SAMPLE.size:
+        raise ValueError(f"IMU数据包样本数无效: {count}")
+    return seq, timestamp_us, proximity, count
+
+
+def fuse_imu_batch(data, count):
+    """由一批原始样本计算 (shake, tilt, pitch, roll, yaw)
+
+    shake为整批样本线性加速度模的均方根(m/s²)，两次发送之间的晃动峰值不会因为只取一个样本而漏掉；
+    姿态角取最新的样本，延迟最小。tilt为手机平面与水平面的夹角，与手机端原先计算的cc11一致。
+    """
+    numpy = import_numpy() if count >= IMU_VECTORIZE_MIN_SAMPLES else None
+    if numpy is not None:
+        # 每个样本按8个float32读取，第0列是时间偏移(int32)，不参与计算
+        samples = numpy.frombuffer(data, dtype='<f4', count=count * 8, offset=IMU_HEADER.size).reshape(count, 8)
+        accel = samples[:, 1:4].ravel()
+        shake = math.sqrt(float(numpy.dot(accel, accel)) / count)
+        x, y, z, w = samples[-1, 4:8].tolist()
+    else:
+        energy = 0.0
+        for _, ax, ay, az, x, y, z, w in IMU_SAMPLE.iter_unpack(
+                data[IMU_HEADER.size:IMU_HEADER.size + count * IMU_SAMPLE.size]):
+            energy += ax * ax + ay * ay + az * az
+        shake = math.sqrt(energy / count)
+
+    # 四元数转旋转矩阵中用到的元素，与SensorManager.getRotationMatrixFromVector()一致
+    r1 = 2 * (x * y - z * w)
+    r4 = 1 - 2 * (x * x + z * z)
+    r6 = 2 * (x * z - y * w)
+    r7 = 2 * (y * z + x * w)
+    r8 = 1 - 2 * (x * x + y * y)
+    tilt = math.degrees(math.acos(min(1.0, abs(r8))))
+    pitch = math.degrees(math.asin(max(-1.0, min(1.0, -r7))))
+    roll = math.degrees(math.atan2(-r6, r8))
+    yaw = math.degrees(math.atan2(r1, r4))
+    return shake, tilt, pitch, roll, yaw
+
+
+class DeadlineScheduler:
+    """基于绝对截止时间的节拍调度器：截止时间为起始时间加整数倍周期，处理耗时不会累积成频率漂移"""
+
+    def __init__(self, frequency, spin_ns=0, policy="skip"):
+        self.period_ns = int(1_000_000_000 / frequency)
+        self.spin_ns = max(0, int(spin_ns))  # 截止前忙等的时长，0表示只用sleep
+        self.policy = policy  # 错过tick时的处理方式: skip(跳过) / catchup(连续补发)
+        self.next_deadline = None
+
+        # 每tick的迟到统计
+        self.ticks = 0
+        self.late_ticks = 0
+        self.skipped_ticks = 0
+        self.total_lateness_ns = 0
+        self.max_lateness_ns = 0
+        self.lateness = LatencyHistogram("发送节拍迟到")
+
+    def configure(self, frequency, spin_ns, policy):
+        """修改频率、忙等时长和错过tick的策略，下一个截止时间不变，之后按新的周期计算"""
+        self.period_ns = int(1_000_000_000 / frequency)
+        self.spin_ns = max(0, int(spin_ns))
+        self.policy = policy
+
+    def reset(self):
+        """以当前时间为起点重新开始计时，并清空统计"""
+        self.next_deadline = time.perf_counter_ns() + self.period_ns
+        self.ticks = 0
+        self.late_ticks = 0
+        self.skipped_ticks = 0
+        self.total_lateness_ns = 0
+        self.max_lateness_ns = 0
+        self.lateness = LatencyHistogram("发送节拍迟到")
+
+    def resume(self):
+        """空闲等待结束后从当前时间重新开始计时，保留统计，空闲期间的tick不计为错过"""
+        self.next_deadline = time.perf_counter_ns() + self.period_ns
+
+    def wait(self):
+        """阻塞到下一个截止时间，返回本次tick的迟到时间(ns)"""
+        if self.next_deadline is None:
+            self.reset()
+
+        deadline = self.next_deadline
+        remaining = deadline - time.perf_counter_ns()
+        if remaining > 0:
+            # 先sleep到截止时间前spin_ns，再忙等剩余部分
+            sleep_ns = remaining - self.spin_ns
+            if sleep_ns > 0:
+                time.sleep(sleep_ns / 1_000_000_000)
+            if self.spin_ns:
+                while time.perf_counter_ns() < deadline:
+                    pass
+        return self.advance()
+
+    def time_until_deadline(self):
+        """距离下一个截止时间的秒数，供asyncio运行时配合asyncio.sleep使用"""
+        if self.next_deadline is None:
+            self.reset()
+        remaining = self.next_deadline - time.perf_counter_ns()
+        return remaining / 1_000_000_000 if remaining > 0 else 0.0
+
+    def advance(self):
+        """记录本次tick的迟到时间并计算下一个截止时间，返回迟到时间(ns)"""
+        deadline = self.next_deadline
+        now = time.perf_counter_ns()
+        lateness = now - deadline
+        if lateness < 0:
+            lateness = 0
+        self.ticks += 1
+        self.total_lateness_ns += lateness
+        if lateness > self.max_lateness_ns:
+            self.max_lateness_ns = lateness
+        self.lateness.record(lateness // 1000)
+
+        # 计算下一个截止时间
+        next_deadline = deadline + self.period_ns
+        if now >= next_deadline:
+            # 已经错过了至少一个完整周期
+            self.late_ticks += 1
+            if self.policy == "skip":
+                # 跳过错过的tick，对齐到下一个未来的节拍点
+                missed = (now - deadline) // self.period_ns
+                self.skipped_ticks += missed
+                next_deadline = deadline + (missed + 1) * self.period_ns
+            # catchup: 保持原节拍点，接下来的tick会不等待地连续执行直到追上
+        self.next_deadline = next_deadline
+        return lateness
+
+    def format_stats(self):
+        """返回迟到统计的可读文本"""
+        if not self.ticks:
+            return "调度统计: 尚无tick"
+        mean_us = self.total_lateness_ns / self.ticks / 1000
+        max_us = self.max_lateness_ns / 1000
+        return (f"调度统计: tick={self.ticks}, 平均迟到={mean_us:.1f}us, p99迟到={self.lateness.percentile(0.99)}us, "
+                f"最大迟到={max_us:.1f}us, 错过周期={self.late_ticks}, 跳过tick={self.skipped_ticks}")
+
+
+class LatencyHistogram:
+    """固定分桶的延迟直方图，单位为微秒"""
+
+    BUCKETS = 256  # 对数分桶：每个2倍区间再均分为8个子桶，相对误差约12.5%
+
+    __slots__ = ("name", "counts", "count", "total", "max")
+
+    def __init__(self, name):
+        self.name = name
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value_us):
+        """记录一个样本(微秒，整数)"""
+        if value_us < 16:
+            index = value_us if value_us > 0 else 0
+        else:
+            bits = value_us.bit_length()
+            index = ((bits - 3) << 3) + ((value_us >> (bits - 4)) & 7)
+            if index >= self.BUCKETS:
+                index = self.BUCKETS - 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value_us
+        if value_us > self.max:
+            self.max = value_us
+
+    @staticmethod
+    def bucket_upper(index):
+        """返回分桶的上界(微秒)"""
+        if index < 16:
+            return index
+        bits = (index >> 3) + 3
+        return ((8 + (index & 7)) << (bits - 4)) + (1 << (bits - 4)) - 1
+
+    def percentile(self, fraction):
+        """返回近似分位数(微秒)，不超过实际最大值"""
+        if not self.count:
+            return 0
+        target = max(1, int(self.count * fraction + 0.999999))
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative >= target:
+                return min(self.bucket_upper(index), self.max)
+        return self.max
+
+    def format(self):
+        """返回 p50/p99/max 的可读文本"""
+        if not self.count:
+            return f"{self.name}: 无样本"
+        return (f"{self.name}: n={self.count}, p50={self.percentile(0.5) / 1000:.2f}ms, "
+                f"p99={self.percentile(0.99) / 1000:.2f}ms, max={self.max / 1000:.2f}ms")
+
+
+class PipelineMetrics:
+    """端到端延迟统计：网络、滤波、等待发送三个阶段以及收包到发送的总延迟"""
+
+    def __init__(self):
+        # 手机与电脑时钟不同步，网络阶段记录的是单向延迟相对最小值的变化量
+        self.network = LatencyHistogram("网络单向延迟变化")
+        self.filter = LatencyHistogram("收包→滤波完成")
+        self.output = LatencyHistogram("滤波完成→MIDI发送")
+        self.total = LatencyHistogram("收包→MIDI发送")
+
+    def format_summary(self, sources, output_mode):
+        """返回所有直方图和各数据源丢包/乱序计数的文本"""
+        lines = [f"延迟统计({output_mode}模式):"]
+        for histogram in (self.network, self.filter, self.output, self.total):
+            lines.append("  " + histogram.format())
+        for source in sources:
+            if source.packets and source.jitter is not None:
+                lines.append(f"  数据源 {source.name}: 收包={source.packets}")
+                lines.append(f"    {source.jitter.format_stats()}")
+            elif source.packets:
+                lines.append(f"  数据源 {source.name}: 收包={source.packets}, 丢失={source.lost_packets}, "
+                             f"乱序={source.reordered_packets}, 重复={source.duplicate_packets}")
+        return "\n".join(lines)
+
+
+class JitterBuffer:
+    """单个数据源的自适应抖动缓冲：按发送端序号重排数据包，按发送端时间戳以稳定的节奏播放"""
+
+    RESET_GAP = 1000  # 序号跳变超过该值时视为手机端重新开始发送，清空缓冲
+    DRIFT_SHIFT = 12  # 每个数据包把时钟偏移向观测值移动1/4096
+
+    __slots__ = ("target_ns", "max_ns", "heap", "last_ext", "next_seq", "offset_ns", "jitter_ns", "prev_transit_ns",
+                 "skipped", "played", "late", "lost", "duplicates", "reordered", "max_depth")
+
+    def __init__(self, target_ms, max_ms):
+        self.target_ns = int(target_ms * 1_000_000)
+        self.max_ns = max(self.target_ns, int(max_ms * 1_000_000))
+        self.reset()
+        self.played = 0
+        self.late = 0  # 到达时它的序号已被跳过，被丢弃
+        self.lost = 0  # 被跳过且之后一直没有到达
+        self.duplicates = 0
+        self.reordered = 0  # 乱序到达但在播放前被重新排好
+        self.max_depth = 0
+
+    def reset(self):
+        self.heap = []  # (展开后的序号, 发送端时间戳(us), 各通道值, 接收时间(ns))
+        self.last_ext = None  # 已收到的最大序号(展开为不回绕的整数)
+        self.next_seq = None  # 下一个应播放的序号
+        self.skipped = set()  # 播放时被跳过的序号，迟到时从丢失改计为迟到
+        self.offset_ns = None
+        self.jitter_ns = 0
+        self.prev_transit_ns = None
+
+    def delay_ns(self):
+        """当前的缓冲延迟"""
+        return min(self.max_ns, max(self.target_ns, 3 * self.jitter_ns))
+
+    def push(self, seq, sender_ts, values, now_ns):
+        """放入一个数据包，被丢弃时返回False"""
+        ext = seq
+        if self.last_ext is not None:
+            # 序号为32位无符号整数，按模运算展开
+            delta = (seq - self.last_ext) & 0xFFFFFFFF
+            if delta >= 0x80000000:
+                delta -= 0x100000000
+            if abs(delta) > self.RESET_GAP:
+                self.reset()
+            else:
+                ext = self.last_ext + delta
+
+        transit_ns = now_ns - sender_ts * 1000
+        if self.offset_ns is None or transit_ns < self.offset_ns:
+            self.offset_ns = transit_ns
+        else:
+            self.offset_ns += (transit_ns - self.offset_ns) >> self.DRIFT_SHIFT
+        if self.prev_transit_ns is not None:
+            self.jitter_ns += (abs(transit_ns - self.prev_transit_ns) - self.jitter_ns) >> 4
+        self.prev_transit_ns = transit_ns
+
+        if self.next_seq is not None and ext < self.next_seq:
+            # 每个序号只计一次：被跳过的改计为迟到，已播放过的是重复
+            if ext in self.skipped:
+                self.skipped.discard(ext)
+                self.lost -= 1
+                self.late += 1
+            else:
+                self.duplicates += 1
+            return False
+        if any(item[0] == ext for item in self.heap):
+            self.duplicates += 1
+            return False
+        if self.last_ext is not None and ext < self.last_ext:
+            self.reordered += 1
+        else:
+            self.last_ext = ext
+        heapq.heappush(self.heap, (ext, sender_ts, values, now_ns))
+        self.max_depth = max(self.max_depth, len(self.heap))
+        return True
+
+    def next_due_ns(self):
+        """最早的数据包的播放时间，缓冲为空时返回None"""
+        if not self.heap:
+            return None
+        return self.heap[0][1] * 1000 + self.offset_ns + self.delay_ns()
+
+    def pop_due(self, now_ns):
+        """按序号顺序取出播放时间已到的数据包，返回 [(发送端时间戳, 各通道值, 接收时间), ...]"""
+        due = []
+        delay_ns = self.offset_ns + self.delay_ns() if self.heap else 0
+        while self.heap and self.heap[0][1] * 1000 + delay_ns <= now_ns:
+            ext, sender_ts, values, recv_ns = heapq.heappop(self.heap)
+            if self.next_seq is not None and ext > self.next_seq:
+                self.lost += ext - self.next_seq
+                self.skipped.update(range(self.next_seq, ext))
+            self.next_seq = ext + 1
+            self.played += 1
+            due.append((sender_ts, values, recv_ns))
+        if len(self.skipped) > self.RESET_GAP:
+            # 序号相差超过RESET_GAP的数据包不会再被接受，保持计为丢失
+            self.skipped = {ext for ext in self.skipped if ext >= self.next_seq - self.RESET_GAP}
+        return due
+
+    def format_stats(self):
+        return (f"抖动缓冲: 播放={self.played}, 迟到丢弃={self.late}, 丢失={self.lost}, 重复={self.duplicates}, "
+                f"重排={self.reordered}, 最大缓冲={self.max_depth}个, 当前延迟={self.delay_ns() / 1_000_000:.1f}ms")
+
+
+class CaptureRing:
+    """预分配、内存映射的环形抓包文件，写满后覆盖最早的记录，写入不会因磁盘IO阻塞接收线程"""
+
+    MAGIC = b'PMCR'
+    VERSION = 1
+    # 文件布局: 文件头(64字节) + 数据区(capacity字节)，数据区中每条记录为 记录头 + 原始数据报
+    DATA_OFFSET = 64
+    # magic, version, capacity, head(最早记录的位置), tail(下一次写入的位置), used(是否有数据)
+    FILE_HEADER = struct.Struct('<4sIQQQI')
+    # 接收时间(perf_counter_ns), IPv4地址, 端口, 数据长度；长度为WRAP表示回到数据区开头继续读取
+    RECORD_HEADER = struct.Struct('<Q4sHH')
+    WRAP = 0xFFFF
+
+    def __init__(self, path, capacity):
+        self.path = path
+        self.capacity = capacity
+        self.head = 0
+        self.tail = 0
+        self.used = False
+        self.records = 0
+        self.dropped = 0
+        self.packed_addrs = {}  # IP字符串 -> 4字节地址，避免每个数据包都调用inet_aton
+
+        # 预先分配整个文件
+        with open(path, 'wb') as f:
+            f.truncate(self.DATA_OFFSET + capacity)
+        self.file = open(path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), self.DATA_OFFSET + capacity)
+        self.write_header()
+
+    def write_header(self):
+        self.FILE_HEADER.pack_into(self.map, 0, self.MAGIC, self.VERSION, self.capacity,
+                                   self.head, self.tail, 1 if self.used else 0)
+
+    def reclaim(self, start, end):
+        """释放起始位置落在[start, end)内的最早记录，为新记录腾出空间"""
+        while self.used and start <= self.head < end:
+            head = self.head
+            if head + self.RECORD_HEADER.size > self.capacity:
+                self.head = 0
+            else:
+                length = self.RECORD_HEADER.unpack_from(self.map, self.DATA_OFFSET + head)[3]
+                self.head = 0 if length == self.WRAP else head + self.RECORD_HEADER.size + length
+            if self.head == self.tail:
+                self.used = False
+
+    def write(self, now_ns, addr, packet):
+        """追加一条记录，空间不足时覆盖最早的记录"""
+        length = len(packet)
+        need = self.RECORD_HEADER.size + length
+        if need > self.capacity // 2:
+            self.dropped += 1
+            return
+
+        packed_addr = self.packed_addrs.get(addr[0])
+        if packed_addr is None:
+            packed_addr = self.packed_addrs[addr[0]] = socket.inet_aton(addr[0])
+
+        if self.tail + need > self.capacity:
+            # 数据区末尾放不下，写入回绕标记后从头开始
+            self.reclaim(self.tail, self.capacity)
+            if self.capacity - self.tail >= self.RECORD_HEADER.size:
+                self.RECORD_HEADER.pack_into(self.map, self.DATA_OFFSET + self.tail, 0, b'\0\0\0\0', 0, self.WRAP)
+            if not self.used:
+                self.head = 0
+            self.tail = 0
+        self.reclaim(self.tail, self.tail + need)
+        if not self.used:
+            self.head = self.tail
+
+        offset = self.DATA_OFFSET + self.tail
+        self.RECORD_HEADER.pack_into(self.map, offset, now_ns, packed_addr, addr[1], length)
+        self.map[offset + self.RECORD_HEADER.size:offset + need] = packet
+        self.tail += need
+        self.used = True
+        self.records += 1
+        self.write_header()
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+
+def iter_capture(path):
+    """按时间顺序读取抓包文件，逐条返回 (接收时间ns, (IP, 端口), 原始数据)"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, capacity, head, tail, used = CaptureRing.FILE_HEADER.unpack_from(data, 0)
+    if magic != CaptureRing.MAGIC or version != CaptureRing.VERSION:
+        raise ValueError(f"不是有效的抓包文件: {path}")
+    if not used:
+        return
+
+    record_header = CaptureRing.RECORD_HEADER
+    position = head
+    while True:
+        if position + record_header.size > capacity:
+            position = 0
+            continue
+        now_ns, packed_addr, port, length = record_header.unpack_from(data, CaptureRing.DATA_OFFSET + position)
+        if length == CaptureRing.WRAP:
+            position = 0
+            continue
+        start = CaptureRing.DATA_OFFSET + position + record_header.size
+        yield now_ns, (socket.inet_ntoa(packed_addr), port), data[start:start + length]
+        position += record_header.size + length
+        if position == tail:
+            break
+
+
+class ShardTable:
+    """分片模式下工作进程与MIDI发送进程之间共享的滤波结果表(multiprocessing.shared_memory)"""
+
+    # 每个分片占用rows条记录，只由该工作进程写入。写入前后版本号各加1(写入中为奇数)，
+    # 读取方只采用版本号为偶数且读取前后不变的内容，不需要跨进程的锁
+    VERSION = struct.Struct('<Q')
+    # IPv4地址, 收包数, 收包时间(perf_counter_ns), 滤波完成时间(perf_counter_ns), 各通道滤波结果
+    BODY = struct.Struct('<4sIqq3d')
+    RECORD_SIZE = VERSION.size + BODY.size
+
+    def __init__(self, shards, rows, name=None, shard=None):
+        from multiprocessing import shared_memory
+        self.shards = shards
+        self.rows = rows
+        self.slots = shards * rows
+        self.shard = shard  # 工作进程中为本进程的分片序号
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=self.slots * self.RECORD_SIZE)
+            self.memory.buf[:self.slots * self.RECORD_SIZE] = bytes(self.slots * self.RECORD_SIZE)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.name = self.memory.name
+        self.buf = self.memory.buf
+        self.versions = [0] * self.slots  # 写入方：各记录当前的版本号；读取方：各记录上次读到的版本号
+        self.packed_addrs = {}  # IP字符串 -> 4字节地址
+
+    def publish(self, row, address, packets, frame):
+        """工作进程：发布一个数据源最新的滤波结果"""
+        slot = self.shard * self.rows + row
+        offset = slot * self.RECORD_SIZE
+        packed = self.packed_addrs.get(address)
+        if packed is None:
+            packed = self.packed_addrs[address] = socket.inet_aton(address)
+        version = self.versions[slot]
+        self.VERSION.pack_into(self.buf, offset, version + 1)
+        values, packet_ns, filtered_ns = frame
+        self.BODY.pack_into(self.buf, offset + self.VERSION.size, packed, packets & 0xFFFFFFFF,
+                            packet_ns, filtered_ns, *values)
+        self.VERSION.pack_into(self.buf, offset, version + 2)
+        self.versions[slot] = version + 2
+
+    def read(self, slot):
+        """发送进程：读取一条自上次读取后更新过的记录，返回 (IP地址, 收包数, SensorFrame)，没有更新时返回None"""
+        offset = slot * self.RECORD_SIZE
+        known = self.versions[slot]
+        for _ in range(4):
+            version, = self.VERSION.unpack_from(self.buf, offset)
+            if version == known:
+                return None
+            if version & 1:
+                # 工作进程正在写入，稍后重试
+                continue
+            packed, packets, packet_ns, filtered_ns, *values = self.BODY.unpack_from(self.buf,
+                                                                                   offset + self.VERSION.size)
+            if self.VERSION.unpack_from(self.buf, offset)[0] == version:
+                self.versions[slot] = version
+                return socket.inet_ntoa(packed), packets, SensorFrame(tuple(values), packet_ns, filtered_ns)
+        return None
+
+    def close(self, unlink=False):
+        self.buf = None
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+class MemoryMidiOutput:
+    """内存中的MIDI输出端口：不连接任何设备，只记录最近的消息及发送时间，用于无MIDI设备的测试与基准"""
+
+    def __init__(self, max_messages=10000):
+        self.messages = collections.deque(maxlen=max_messages)  # (perf_counter_ns, 消息)
+        self.count = 0
+
+    def send(self, msg):
+        self.count += 1
+        self.messages.append((time.perf_counter_ns(), msg))
+
+    def close(self):
+        pass
+
+
+class MidiStreamRecorder:
+    """MIDI输出包装：把每条消息连同时间(毫秒)以十六进制写入文本文件，便于比较两次回放的结果"""
+
+    def __init__(self, path, clock, output=None):
+        self.file = open(path, 'w', encoding='utf-8') if path else None
+        self.clock = clock  # 返回相对时间(ns)
+        self.output = output  # 不为None时消息同时转发给真实的MIDI端口
+        self.messages = 0
+
+    def send(self, msg):
+        self.messages += 1
+        if self.file:
+            self.file.write(f"{self.clock() / 1_000_000:.3f} {msg.hex()}\n")
+        if self.output:
+            self.output.send(msg)
+
+    def send_group(self, key, messages):
+        if self.output is None or not hasattr(self.output, "send_group"):
+            for msg in messages:
+                self.send(msg)
+            return
+        self.messages += len(messages)
+        if self.file:
+            for msg in messages:
+                self.file.write(f"{self.clock() / 1_000_000:.3f} {msg.hex()}\n")
+        self.output.send_group(key, messages)
+
+    def send_events(self, messages):
+        if self.output is None or not hasattr(self.output, "send_events"):
+            for msg in messages:
+                self.send(msg)
+            return
+        self.messages += len(messages)
+        if self.file:
+            for msg in messages:
+                self.file.write(f"{self.clock() / 1_000_000:.3f} {msg.hex()}\n")
+        self.output.send_events(messages)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+        if self.output:
+            self.output.close()
+            self.output = None
+
+
+class MidiPortWriter:
+    """一个MIDI输出端口的写线程：端口发送变慢或阻塞时不影响其他端口"""
+
+    SLOW_SEND_NS = 5_000_000  # 单条消息发送超过该时间计为一次慢发送
+
+    def __init__(self, name, port, channel=None, cc_map=None, queue_size=64, rate=0, clock=time.perf_counter_ns):
+        self.name = name
+        self.port = port
+        self.channel = channel  # 不为None时所有消息改用该通道(0-15)
+        self.cc_map = cc_map or {}  # 控制器号的重映射表
+        self.queue_size = queue_size
+        self.budget = RateBudget(rate)  # 额度不足时CC组留在队列中继续被新值覆盖，事件消息不受限制
+        self.clock = clock  # 令牌桶使用的时钟(ns)
+        # 一组是一个CC一次输出的全部消息(14位CC的MSB/LSB、NRPN的参数号和数据)，尚未发出时新值覆盖旧值并移到队尾
+        self.pending = collections.OrderedDict()  # (通道, 控制器号) -> {控制器号: 消息}
+        # 音符等事件消息不能覆盖也不能丢弃(否则可能留下没有松开的音符)，按顺序先于CC发送
+        self.events = collections.deque()
+        self.cond = threading.Condition()
+        self.running = False
+        self.thread = None
+
+        # 背压统计
+        self.sent = 0  # 已发送的消息数
+        self.replaced = 0  # 尚未发送就被新值覆盖的消息数
+        self.dropped = 0  # 队列已满时丢弃的消息组数
+        self.max_depth = 0  # 队列中同时等待的消息组数的最大值
+        self.slow_sends = 0
+        self.errors = 0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=f"midi-{self.name}", daemon=True)
+        self.thread.start()
+
+    def send_group(self, key, messages):
+        """把一组消息放入队列，由写线程发送；队列已满时返回被丢弃的组的键，否则返回None"""
+        dropped = None
+        with self.cond:
+            group = self.pending.get(key)
+            if group is None:
+                if len(self.pending) >= self.queue_size:
+                    dropped = self.pending.popitem(last=False)[0]
+                    self.dropped += 1
+                group = self.pending[key] = {}
+                self.max_depth = max(self.max_depth, len(self.pending))
+            else:
+                self.pending.move_to_end(key)
+            for msg in messages:
+                if msg.control in group:
+                    self.replaced += 1
+                group[msg.control] = msg
+            self.cond.notify()
+        return dropped
+
+    def send_events(self, messages):
+        """把事件消息按顺序放入事件队列，事件不受queue_size限制，不会被丢弃"""
+        with self.cond:
+            self.events.extend(messages)
+            self.cond.notify()
+
+    def set_rate(self, rate):
+        with self.cond:
+            self.budget.set_rate(rate)
+            self.cond.notify()
+
+    def remap(self, msg):
+        channel = msg.channel if self.channel is None else self.channel
+        if msg.type != 'control_change':
+            return msg.copy(channel=channel) if channel != msg.channel else msg
+        control = self.cc_map.get(msg.control, msg.control)
+        if channel != msg.channel or control != msg.control:
+            return msg.copy(channel=channel, control=control)
+        return msg
+
+    def run(self):
+        send = self.port.send
+        while True:
+            with self.cond:
+                while self.running and not self.pending and not self.events:
+                    self.cond.wait()
+                if not self.running:
+                    break
+                if self.events:
+                    messages = list(self.events)
+                    self.events.clear()
+                else:
+                    key, group = next(iter(self.pending.items()))
+                    now_ns = self.clock()
+                    if not self.budget.take(now_ns, len(group)):
+                        # 额度用完：等到令牌足够时再发送，期间同一CC的新值继续覆盖旧值
+                        self.cond.wait((self.budget.next_token_ns(now_ns, len(group)) - now_ns) / 1_000_000_000)
+                        continue
+                    del self.pending[key]
+                    messages = group.values()
+
+            for msg in messages:
+                start_ns = time.perf_counter_ns()
+                try:
+                    send(self.remap(msg))
+                except Exception as e:
+                    if not self.errors:
+                        print(f"MIDI端口 {self.name} 发送错误: {e}")
+                    self.errors += 1
+                    continue
+                if time.perf_counter_ns() - start_ns > self.SLOW_SEND_NS:
+                    self.slow_sends += 1
+                self.sent += 1
+
+    def close(self, timeout=1.0):
+        """停止写线程并关闭端口；端口阻塞导致线程没有按时结束时不关闭端口，避免主线程也被阻塞"""
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                print(f"MIDI端口 {self.name} 发送阻塞，未能关闭")
+                return
+        try:
+            self.port.close()
+        except Exception:
+            pass
+
+    def format_stats(self):
+        return (f"  {self.name}: 发送{self.sent}条, 被新值覆盖{self.replaced}条, 队列满丢弃{self.dropped}组, "
+                f"最大排队{self.max_depth}组, 速率上限推迟{self.budget.deferred}次, 慢发送{self.slow_sends}次, "
+                f"发送错误{self.errors}次")
+
+
+# [MIDIOutput.名称]节中配置的一个输出端口
+# rate为该端口的每秒消息数上限，None表示使用[Output]中的max_messages_per_second
+OutputPortConfig = collections.namedtuple('OutputPortConfig',
+                                          ('name', 'port', 'channel', 'cc_map', 'queue_size', 'rate'))
+
+
+def parse_cc_map(text):
+    """解析控制器号重映射，格式为 "原控制器:新控制器, ..."，例如 "1:7, 11:74"
+
+    0-31的控制器同时映射对应的14位LSB控制器(+32)，除非另外指定。
+    """
+    cc_map = {}
+    for item in text.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        src, dst = (int(part) for part in item.split(":"))
+        if not (0 <= src <= 127 and 0 <= dst <= 127):
+            raise ValueError(f"控制器号超出0-127范围: {item}")
+        cc_map[src] = dst
+    for src, dst in list(cc_map.items()):
+        if src < 32 and dst < 32:
+            cc_map.setdefault(src + 32, dst + 32)
+    return cc_map
+
+
+class MidiFanout:
+    """把同一份MIDI输出分发到多个MidiPortWriter，可以像单个MIDI端口一样使用"""
+
+    def __init__(self, writers, rates=None):
+        self.writers = writers
+        self.rates = rates or [None] * len(writers)  # 各端口单独设置的速率上限
+
+    @property
+    def count(self):
+        return sum(writer.sent for writer in self.writers)
+
+    def start(self):
+        for writer in self.writers:
+            writer.start()
+
+    def send(self, msg):
+        if msg.type == 'control_change':
+            self.send_group((msg.channel, msg.control), (msg,))
+        else:
+            self.send_events((msg,))
+
+    def send_group(self, key, messages):
+        """放入各端口的队列，返回因队列已满被丢弃的组的键的集合"""
+        dropped = set()
+        for writer in self.writers:
+            dropped_key = writer.send_group(key, messages)
+            if dropped_key is not None:
+                dropped.add(dropped_key)
+        return dropped
+
+    def output_channels(self, channel):
+        """数据源通道在各端口上实际使用的通道: ((端口序号, 通道), ...)"""
+        return tuple((i, channel if writer.channel is None else writer.channel)
+                     for i, writer in enumerate(self.writers))
+
+    def send_events(self, messages):
+        for writer in self.writers:
+            writer.send_events(messages)
+
+    def set_rate(self, rate):
+        """修改没有单独设置速率上限的端口的上限"""
+        for writer, port_rate in zip(self.writers, self.rates):
+            writer.set_rate(rate if port_rate is None else port_rate)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+    def format_stats(self):
+        return "\n".join(writer.format_stats() for writer in self.writers)
+
+
+class RateBudget:
+    """令牌桶：限制一个MIDI端口每秒发送的消息数(rate为0时不限制)"""
+
+    MIN_BURST = 4  # 一次输出最多的消息数(NRPN的99/98/6/38)
+
+    __slots__ = ("rate", "capacity", "tokens", "last_ns", "sent", "deferred")
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst if burst else max(self.MIN_BURST, rate // 20)
+        self.tokens = float(self.capacity)
+        self.last_ns = None
+        self.sent = 0
+        self.deferred = 0  # 因额度不足被推迟的次数
+
+    def take(self, now_ns, count=1):
+        """尝试一次取count个令牌(成对发送的消息不会被拆开)，成功返回True"""
+        if self.rate <= 0:
+            self.sent += count
+            return True
+        # 时间倒退(如切换到回放的虚拟时钟)时不补充令牌
+        if self.last_ns is not None and now_ns > self.last_ns:
+            self.tokens = min(self.capacity, self.tokens + (now_ns - self.last_ns) * self.rate / 1_000_000_000)
+        self.last_ns = now_ns
+        if self.tokens >= count:
+            self.tokens -= count
+            self.sent += count
+            return True
+        self.deferred += 1
+        return False
+
+    def set_rate(self, rate, burst=None):
+        """修改速率上限，保留已发送/推迟的统计"""
+        self.rate = rate
+        self.capacity = burst if burst else max(self.MIN_BURST, rate // 20)
+        self.tokens = min(self.tokens, float(self.capacity))
+
+    def next_token_ns(self, now_ns, count=1):
+        """返回count个令牌可用的时间点"""
+        count = min(count, self.capacity)
+        return now_ns + int((count - self.tokens) * 1_000_000_000 / self.rate) + 1
+
+
+# 传感器通道，顺序与数据包中的字段顺序一致
+SENSOR_CHANNELS = ("cc1", "cc11", "cc_opt")
+
+# 每个映射的输出方式: cc7(普通7位CC), cc14(MSB/LSB成对的14位CC，LSB使用控制器号+32), nrpn(14位NRPN)
+CC_MODES = ("cc7", "cc14", "nrpn")
+# NRPN使用的控制器：参数号MSB/LSB(99/98)与数据MSB/LSB(6/38)
+NRPN_CONTROLS = (99, 98, 6, 38)
+
+
+class ResponseCurve:
+    """编译成查找表的响应曲线：把[low, high]范围内的传感器值映射到0-full的MIDI值"""
+
+    KINDS = ("linear", "exp", "log", "s", "piecewise")
+    # 非线性曲线的输入细分数，保证曲线陡峭处也能取到相邻的输出值
+    MIN_STEPS = 4096
+
+    __slots__ = ("kind", "low", "scale", "top", "table")
+
+    def __init__(self, kind, low, high, full, amount=3.0, points=None):
+        self.kind = kind
+        self.low = low
+        # 线性曲线的细分数与输出精度相同，查表结果与直接计算round(map_value(...))完全一致
+        steps = full if kind == "linear" else max(full, self.MIN_STEPS)
+        self.top = steps
+        self.scale = steps / (high - low)
+        shape = self.shape_function(kind, low, high, amount, points)
+        self.table = array('H', (max(0, min(full, round(shape(i / steps) * full))) for i in range(steps + 1)))
+
+    @staticmethod
+    def shape_function(kind, low, high, amount, points):
+        """返回把归一化输入(0-1)映射到归一化输出(0-1)的函数"""
+        if kind == "exp":
+            k = amount
+            return lambda t: (math.exp(k * t) - 1) / (math.exp(k) - 1)
+        if kind == "log":
+            k = amount
+            return lambda t: math.log(1 + (math.exp(k) - 1) * t) / k
+        if kind == "s":
+            k = amount
+            edge = 1 / (1 + math.exp(k / 2))
+            return lambda t: (1 / (1 + math.exp(-k * (t - 0.5))) - edge) / (1 - 2 * edge)
+        if kind == "piecewise":
+            xs = [x for x, _ in points]
+            ys = [y / 127 for _, y in points]
+
+            def piecewise(t):
+                x = low + t * (high - low)
+                if x <= xs[0]:
+                    return ys[0]
+                for i in range(1, len(xs)):
+                    if x <= xs[i]:
+                        return ys[i - 1] + (ys[i] - ys[i - 1]) * (x - xs[i - 1]) / (xs[i] - xs[i - 1])
+                return ys[-1]
+            return piecewise
+        return lambda t: t
+
+    def lookup(self, value):
+        """查表得到MIDI值"""
+        index = round((value - self.low) * self.scale)
+        if index <= 0:
+            return self.table[0]
+        if index >= self.top:
+            return self.table[self.top]
+        return self.table[index]
+
+
+class FilterBank:
+    """所有数据源、所有传感器通道共用的滤波器组：状态按 [数据源, 通道] 存放在连续数组中，按批计算"""
+
+    KINDS = ("none", "smooth", "oneeuro")
+    NONE, SMOOTH, ONEEURO = range(3)
+    # 一次更新的值(数据源数 x 通道数)达到该数量时使用NumPy；单个数据源3个通道时NumPy的固定开销比逐通道计算大
+    VECTORIZE_MIN_VALUES = 24
+    # 没有有效时间戳(两个数据包时间相同或时间倒退)时假定的数据包间隔(秒)
+    DEFAULT_DT = 1 / 60
+
+    def __init__(self, rows, alphas, lows, highs, kinds, enabled,
+                 min_cutoffs=None, betas=None, d_cutoffs=None, leads=None, vectorize_min=None):
+        self.rows = rows
+        self.channels = channels = len(alphas)
+        kinds = [self.KINDS.index(kind) for kind in kinds]
+        min_cutoffs = min_cutoffs or [1.0] * channels
+        betas = betas or [0.0] * channels
+        d_cutoffs = d_cutoffs or [1.0] * channels
+        leads = leads or [0.0] * channels
+        self.adaptive = self.ONEEURO in kinds
+        self.vectorize_min = FilterBank.VECTORIZE_MIN_VALUES if vectorize_min is None else vectorize_min
+        # 所有数据源一起更新能达到阈值时才把状态放在NumPy数组中，每次更新再按批次大小选择实现
+        self.vectorized = rows * channels >= self.vectorize_min and import_numpy() is not None
+        # 逐通道计算使用的参数
+        self.alpha = array('d', alphas)
+        self.low = array('d', lows)
+        self.high = array('d', highs)
+        self.kind = list(kinds)
+        self.enabled = list(enabled)
+        self.min_cutoff = array('d', min_cutoffs)
+        self.beta = array('d', betas)
+        self.d_cutoff = array('d', d_cutoffs)
+        self.lead = array('d', leads)
+        if self.vectorized:
+            self.np_alpha = np.array(alphas, dtype=np.float64)
+            self.np_low = np.array(lows, dtype=np.float64)
+            self.np_high = np.array(highs, dtype=np.float64)
+            self.np_kind = np.array(kinds)
+            self.np_enabled = np.array(enabled, dtype=bool)
+            self.np_min_cutoff = np.array(min_cutoffs, dtype=np.float64)
+            self.np_beta = np.array(betas, dtype=np.float64)
+            self.np_d_cutoff = np.array(d_cutoffs, dtype=np.float64)
+            self.np_lead = np.array(leads, dtype=np.float64)
+            self.state = np.zeros((rows, channels))  # 滤波输出
+            self.last_raw = np.zeros((rows, channels))  # 上一个(限幅后的)原始值
+            self.estimate = np.zeros((rows, channels))  # oneeuro: 滤波后的值(不含预测)
+            self.deriv = np.zeros((rows, channels))  # oneeuro: 滤波后的速度(每秒)
+            self.last_time = np.full(rows, -1.0)  # 每个数据源上一个数据包的时间(秒)，小于0表示还没有数据
+            # 逐通道计算通过一维内存视图读写同一份状态，下标运算得到的是Python浮点数
+            self.flat = [memoryview(getattr(self, name)).cast('B').cast('d')
+                         for name in ("state", "last_raw", "estimate", "deriv", "last_time")]
+        else:
+            self.state = array('d', bytes(8 * rows * channels))
+            self.last_raw = array('d', bytes(8 * rows * channels))
+            self.estimate = array('d', bytes(8 * rows * channels))
+            self.deriv = array('d', bytes(8 * rows * channels))
+            self.last_time = array('d', [-1.0] * rows)
+            self.flat = [self.state, self.last_raw, self.estimate, self.deriv, self.last_time]
+
+    @staticmethod
+    def cutoff_alpha(dt, cutoff):
+        """截止频率cutoff(Hz)、采样间隔dt(秒)对应的一阶低通平滑系数"""
+        return 1.0 / (1.0 + 1.0 / (2 * math.pi * cutoff * dt))
+
+    def use_numpy(self, rows):
+        """一次更新rows个数据源时是否使用NumPy"""
+        return self.vectorized and rows * self.channels >= self.vectorize_min
+
+    def update(self, row, values, t=0.0):
+        """用一个数据包的各通道值更新一个数据源，缺失的通道(None)保持原状态；t为数据包时间(秒)"""
+        if not self.use_numpy(1):
+            self.update_python(row, values, t)
+            return
+        self.update_rows([row], [values], [t])
+
+    def update_rows(self, rows, values, times=None):
+        """一次更新多个数据源，rows为行号列表，values为对应的各通道值列表，times为对应的数据包时间(秒)"""
+        if not self.use_numpy(len(rows)):
+            for i, row in enumerate(rows):
+                self.update_python(row, values[i], times[i] if times else 0.0)
+            return
+        x = np.array(values, dtype=np.float64)  # None会被转换为NaN
+        mask = self.np_enabled & ~np.isnan(x)
+        np.clip(x, self.np_low, self.np_high, out=x)
+        state = self.state[rows]
+        last_raw = self.last_raw[rows]
+        alpha = self.np_alpha
+        kind = self.np_kind
+        filtered = np.where(kind == self.SMOOTH, alpha * last_raw + (1 - alpha) * state, x)
+
+        if self.adaptive:
+            t = np.array(times if times else [0.0] * len(rows), dtype=np.float64)
+            last_time = self.last_time[rows]
+            primed = (last_time >= 0)[:, None]
+            dt = t - last_time
+            dt = np.where(dt > 0, dt, self.DEFAULT_DT)[:, None]
+            estimate = self.estimate[rows]
+            deriv = self.deriv[rows]
+            a_d = 1.0 / (1.0 + 1.0 / (2 * np.pi * self.np_d_cutoff * dt))
+            new_deriv = np.where(primed, a_d * (x - estimate) / dt + (1 - a_d) * deriv, 0.0)
+            cutoff = self.np_min_cutoff + self.np_beta * np.abs(new_deriv)
+            a = 1.0 / (1.0 + 1.0 / (2 * np.pi * cutoff * dt))
+            new_estimate = np.where(primed, a * x + (1 - a) * estimate, x)
+            adaptive = mask & (kind == self.ONEEURO)
+            self.estimate[rows] = np.where(adaptive, new_estimate, estimate)
+            self.deriv[rows] = np.where(adaptive, new_deriv, deriv)
+            predicted = np.clip(new_estimate + new_deriv * self.np_lead, self.np_low, self.np_high)
+            filtered = np.where(kind == self.ONEEURO, predicted, filtered)
+            self.last_time[rows] = t
+
+        self.state[rows] = np.where(mask, filtered, state)
+        self.last_raw[rows] = np.where(mask, x, last_raw)
+
+    def update_python(self, row, values, t=0.0):
+        """逐通道实现：没有NumPy或一次更新的值较少时使用"""
+        base = row * self.channels
+        state, last_raw, estimates, derivs, last_times = self.flat
+        if self.adaptive:
+            last_time = last_times[row]
+            primed = last_time >= 0
+            dt = t - last_time
+            if dt <= 0:
+                dt = self.DEFAULT_DT
+            last_times[row] = t
+        for channel, value in enumerate(values):
+            if value is None or not self.enabled[channel]:
+                continue
+            value = min(max(value, self.low[channel]), self.high[channel])
+            index = base + channel
+            kind = self.kind[channel]
+            if kind == self.SMOOTH:
+                alpha = self.alpha[channel]
+                state[index] = alpha * last_raw[index] + (1 - alpha) * state[index]
+            elif kind == self.ONEEURO:
+                if primed:
+                    estimate = estimates[index]
+                    a_d = self.cutoff_alpha(dt, self.d_cutoff[channel])
+                    deriv = a_d * (value - estimate) / dt + (1 - a_d) * derivs[index]
+                    a = self.cutoff_alpha(dt, self.min_cutoff[channel] + self.beta[channel] * abs(deriv))
+                    estimate = a * value + (1 - a) * estimate
+                else:
+                    estimate = value
+                    deriv = 0.0
+                estimates[index] = estimate
+                derivs[index] = deriv
+                predicted = estimate + deriv * self.lead[channel]
+                state[index] = min(max(predicted, self.low[channel]), self.high[channel])
+            else:
+                state[index] = value
+            last_raw[index] = value
+
+    def copy_state_from(self, other):
+        """配置热更新时从旧的滤波器组复制滤波状态，使输出不因重新加载而跳变
+
+        滤波方式改为oneeuro的通道以当前输出作为初始估计值。
+        """
+        rows = min(self.rows, other.rows)
+        count = rows * self.channels
+        for name in ("state", "last_raw", "estimate", "deriv"):
+            source = getattr(other, name)
+            flat = source.ravel()[:count] if other.vectorized else source[:count]
+            target = getattr(self, name)
+            if self.vectorized:
+                target.ravel()[:count] = flat
+            else:
+                target[:count] = array('d', flat)
+        for row in range(rows):
+            self.last_time[row] = other.last_time[row]
+        state, _, estimates, derivs, _ = self.flat
+        for channel in range(self.channels):
+            if self.kind[channel] == self.ONEEURO and other.kind[channel] != self.ONEEURO:
+                for index in range(channel, count, self.channels):
+                    estimates[index] = state[index]
+                    derivs[index] = 0.0
+
+    def values(self, row):
+        """返回一个数据源各通道当前的滤波输出(Python列表)"""
+        if not self.vectorized:
+            base = row * self.channels
+            return self.state[base:base + self.channels].tolist()
+        return self.state[row].tolist()
+
+
+class GestureDetector:
+    """cc1原始数据上逐个样本的手势检测，update()返回 ("peak", 力度) / ("release", 0) / ("sustain", 1或0) 事件列表或None"""
+
+    __slots__ = ("min_level", "sensitivity", "release_ratio", "refractory", "sustain", "adapt", "full_scale",
+                 "mean", "dev", "last_t", "prev", "active", "rising", "threshold", "valley",
+                 "onset_t", "last_peak_t", "peak", "peaked", "sustaining", "peaks")
+
+    def __init__(self, min_level=2.0, sensitivity=3.0, release_ratio=0.5, refractory_ms=80.0, sustain_ms=300.0,
+                 adapt_s=2.0, full_scale=30.0):
+        self.min_level = min_level
+        self.sensitivity = sensitivity
+        self.release_ratio = release_ratio
+        self.refractory = refractory_ms / 1000
+        self.sustain = sustain_ms / 1000
+        self.adapt = adapt_s
+        self.full_scale = full_scale
+        self.mean = 0.0  # 基线均值
+        self.dev = 0.0  # 基线平均偏差
+        self.last_t = None
+        self.prev = 0.0
+        self.active = False  # 处于一次手势中(高于结束阈值)
+        self.rising = False  # 正在上升，等待峰值
+        self.threshold = 0.0  # 本次手势起始时的阈值
+        self.valley = 0.0  # 峰值之后的最低值
+        self.peak = 0.0  # 本次上升的最大值
+        self.onset_t = 0.0
+        self.last_peak_t = -math.inf
+        self.peaked = False  # 本次手势已发出峰值事件，结束时需要发出release
+        self.sustaining = False
+        self.peaks = 0
+
+    def velocity(self, peak):
+        """把峰值从起始阈值到满量程的范围映射为力度1-127"""
+        span = self.full_scale - self.threshold
+        ratio = (peak - self.threshold) / span if span > 0 else 1.0
+        return 1 + int(126 * min(1.0, max(0.0, ratio)))
+
+    def peak_drop(self, peak):
+        """确认峰值需要从最大值回落的幅度：2倍基线平均偏差(噪声)，且至少为峰值高于基线部分的5%"""
+        return max(2 * self.dev, 0.05 * (peak - self.mean))
+
+    def update(self, value, t):
+        if value is None:
+            return None
+        dt = t - self.last_t if self.last_t is not None else 0.0
+        self.last_t = t
+        prev = self.prev
+        self.prev = value
+        events = None
+        mean = self.mean
+
+        if not self.active:
+            threshold = max(self.min_level, self.mean + self.sensitivity * self.dev)
+            if value > threshold and t - self.last_peak_t >= self.refractory:
+                self.active = True
+                self.rising = True
+                self.peak = value
+                self.threshold = threshold
+                self.onset_t = t
+            elif dt > 0:
+                # 只在没有手势时更新基线，避免晃动本身抬高阈值
+                a = 1.0 - math.exp(-dt / self.adapt)
+                diff = value - self.mean
+                self.mean += a * diff
+                self.dev += a * (abs(diff) - self.dev)
+            return None
+
+        if value < max(self.min_level, self.threshold) * self.release_ratio:
+            # 手势结束
+            self.active = False
+            self.rising = False
+            if self.peaked:
+                events = [("release", 0)]
+            if self.sustaining:
+                events = (events or []) + [("sustain", 0)]
+            self.peaked = False
+            self.sustaining = False
+            return events
+
+        if self.rising:
+            peak = self.peak
+            if value > peak:
+                self.peak = value
+            elif peak - value > self.peak_drop(peak):
+                # 已从最大值回落：确认峰值
+                self.rising = False
+                self.valley = value
+                self.last_peak_t = t
+                self.peaks += 1
+                events = [("release", 0)] if self.peaked else []
+                events.append(("peak", self.velocity(peak)))
+                self.peaked = True
+        else:
+            self.valley = min(self.valley, value)
+            # 连续晃动：从谷底回升足够多时重新开始等待峰值
+            if t - self.last_peak_t >= self.refractory and \
+                    value - self.valley > self.threshold - mean and value > prev:
+                self.rising = True
+                self.peak = value
+
+        if not self.sustaining and t - self.onset_t >= self.sustain:
+            self.sustaining = True
+            events = (events or []) + [("sustain", 1)]
+        return events
+
+
+# 一个数据包滤波完成后的不可变状态：各通道滤波输出、收包时间、滤波完成时间
+# 接收线程每处理完一个数据包就创建一个新的SensorFrame，用一次引用赋值替换SensorSource.frame，
+# 发送线程每次只读取一次frame，因此看到的各通道数值总是来自同一个数据包，无需加锁
+SensorFrame = collections.namedtuple('SensorFrame', ('values', 'packet_ns', 'filtered_ns'))
+
+
+class ConsoleMonitor:
+    """参数监控显示：接收线程只保存每个数据源最新的数据，由独立线程按固定帧率原地重绘"""
+
+    def __init__(self, controller, mode, fps):
+        self.controller = controller
+        self.mode = mode  # text / graphic
+        self.interval = 1.0 / fps
+        self.version = 0  # 接收线程每保存一次数据加1，没有变化时不重绘
+        self.ansi = sys.stdout.isatty()  # 终端中用ANSI光标控制原地刷新，否则(如重定向到文件)每帧输出一次
+        self.drawn_lines = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.ansi and os.name == 'nt':
+            os.system('')  # 在Windows 10及以上的控制台中开启ANSI转义序列支持
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=2.0)
+        self.thread = None
+
+    def run(self):
+        drawn_version = -1
+        while not self.stop_event.wait(self.interval):
+            version = self.version
+            if version == drawn_version:
+                continue
+            drawn_version = version
+            try:
+                self.draw(self.render())
+            except Exception as e:
+                print(f"参数监控显示错误: {e}")
+
+    def render(self):
+        """生成一帧的所有行"""
+        sources = self.controller.sources
+        lines = []
+        for source in sources:
+            values = source.monitor_values
+            if values is None:
+                continue
+            label = f"[{source.name}] " if len(sources) > 1 else ""
+            if source.is_data_timeout:
+                lines.append(f"{label}数据超时")
+            else:
+                lines.append(label + self.format_values(values))
+        return lines
+
+    def format_values(self, values):
+        """把一个数据包的数值格式化为一行文本或图形"""
+        controller = self.controller
+        cc1, cc11, cc_opt = values[:3]
+        if self.mode == "graphic":
+            # 图形化显示模式
+            cc1_val = min(max(int(cc1), 0), 120) if controller.cc1_enabled and cc1 is not None else 0
+            cc11_val = min(max(int(cc11), 0), 120) if controller.cc11_enabled and cc11 is not None else 0
+            if cc1_val > cc11_val:
+                return " " * cc11_val + "||" + " " * (cc1_val - cc11_val) + "@"
+            return " " * cc1_val + "@" + " " * (cc11_val - cc1_val) + "||"
+
+        # 文本显示模式（默认）
+        display_parts = []
+        if controller.cc1_enabled and cc1 is not None:
+            display_parts.append(f"cc1={cc1:.1f}")
+        if controller.cc11_enabled and cc11 is not None:
+            display_parts.append(f"cc11={cc11:.1f}")
+        if controller.cc_opt_enabled and cc_opt is not None:
+            display_parts.append(f"cc_opt={cc_opt:.1f}")
+        return "接收到数据: " + ", ".join(display_parts)
+
+    def draw(self, lines):
+        """一次写出整帧；终端中先把光标移回上一帧的开头，逐行清除后重写"""
+        if not lines:
+            return
+        if self.ansi:
+            parts = [f"\x1b[{self.drawn_lines}F"] if self.drawn_lines else []
+            parts.extend(f"\x1b[2K{line}\n" for line in lines)
+            # 数据源减少时清掉上一帧多出来的行
+            for _ in range(self.drawn_lines - len(lines)):
+                parts.append("\x1b[2K\n")
+            self.drawn_lines = max(self.drawn_lines, len(lines))
+            sys.stdout.write("".join(parts))
+        else:
+            sys.stdout.write("\n".join(lines) + "\n")
+        sys.stdout.flush()
+
+
+class SensorSource:
+    """单个手机数据源：独立的滤波状态、超时状态和MIDI通道/CC映射"""
+
+    __slots__ = (
+        "name", "address", "row", "channel", "cc1_mapping", "cc11_mapping", "cc_opt_mapping", "cc_modes",
+        "data_timeout", "is_data_timeout", "timeout_reported", "last_packet_ns", "latency_packet_ns",
+        "frame", "min_offset_us", "packets", "lost_packets", "reordered_packets", "duplicate_packets", "missing_seqs",
+        "gesture", "gesture_events", "gesture_velocity", "gesture_sustain",
+        "cc_sent", "cc_direction", "cc_target", "cc_target_ns", "cc_last_send_ns",
+        "packet_format", "allowed_format", "last_seq", "last_sender_ts", "pending_sample", "monitor_values", "jitter",
+    )
+
+    def __init__(self, name, address=None, row=0, channel=0, cc1_mapping=1, cc11_mapping=11, cc_opt_mapping=3,
+                 data_timeout=1.0, allowed_format="auto", cc_modes=("cc7", "cc7", "cc7")):
+        self.name = name
+        self.address = address  # 发送端IP地址，None表示尚未绑定
+        self.row = row  # 在FilterBank中的行号
+        self.channel = channel  # MIDI通道(0-15)
+        self.cc1_mapping = cc1_mapping
+        self.cc11_mapping = cc11_mapping
+        self.cc_opt_mapping = cc_opt_mapping
+        self.cc_modes = list(cc_modes)  # 每个映射的输出方式，见CC_MODES
+
+        self.data_timeout = data_timeout  # 超时阈值(秒)
+        self.is_data_timeout = True  # 尚未收到数据时视为超时
+        self.timeout_reported = False  # 收到过数据后又超时，已打印超时提示
+        self.last_packet_ns = 0  # 收到最近一个数据包的时间
+        self.frame = None  # 最近一个数据包的SensorFrame，只由接收线程整体替换
+        self.latency_packet_ns = 0  # 已统计过发送延迟的数据包的接收时间
+
+        # 丢包/乱序统计，依赖二进制格式携带的序号；开启抖动缓冲时由JitterBuffer统计
+        self.min_offset_us = None  # 接收时间与发送端时间戳之差的最小值
+        self.packets = 0
+        self.lost_packets = 0
+        self.reordered_packets = 0
+        self.duplicate_packets = 0
+        self.missing_seqs = set()  # 已计为丢失的序号，之后到达时改计为乱序
+
+        # 手势检测：detector在接收线程中运行，检测到的事件放入gesture_events，由发送线程取出发送
+        self.gesture = None  # GestureDetector，开启手势检测后收到第一个数据包时创建
+        self.gesture_events = collections.deque()
+        self.gesture_velocity = 0  # 发送线程：当前按下的音符的力度，0表示没有按下
+        self.gesture_sustain = False  # 发送线程：是否已发送持续晃动的CC
+
+        # 数据格式协商：allowed_format限制可接受的格式，packet_format为当前实际使用的格式
+        self.allowed_format = allowed_format  # auto / text / binary
+        self.packet_format = None
+        self.last_seq = None  # 二进制格式携带的序号
+        self.last_sender_ts = None  # 二进制格式携带的发送端时间戳(微秒)
+        self.pending_sample = None  # 本轮接收中尚未处理的最新数据
+        self.monitor_values = None  # 参数监控显示用的最新数据，由监控线程读取
+        self.jitter = None  # 开启抖动缓冲后收到第一个带序号的数据包时创建的JitterBuffer
+
+        self.reset_output()
+
+    def reset_output(self):
+        """清空上一次发送的MIDI值、目标值与各CC最近一次发送时间"""
+        self.cc_sent = [None, None, None]  # 最近一次发送的值
+        self.cc_direction = [0, 0, 0]  # 最近一次变化的方向，用于回差判断
+        self.cc_target = [None, None, None]  # 当前目标值
+        self.cc_target_ns = [0, 0, 0]  # 目标值最近一次变化的时间
+        self.cc_last_send_ns = [0, 0, 0]
+
+
+def create_datagram_protocol(controller):
+    """创建asyncio运行时的UDP接收协议，收到的数据包交给控制器处理(类在导入asyncio之后才能定义)"""
+
+    class SensorDatagramProtocol(import_asyncio().DatagramProtocol):
+        def datagram_received(self, data, addr):
+            controller.listen_wakeups += 1
+            try:
+                sample = controller.decode_packet(data, addr, time.perf_counter_ns())
+                if sample:
+                    controller.handle_samples((sample,))
+                elif controller.jitter_buffer_ms:
+                    controller.async_play_jitter_buffers()
+            except Exception as e:
+                print(f"接收数据错误: {e}")
+
+        def error_received(self, exc):
+            # Windows上对端不可达时UDP也会报告错误，忽略即可
+            pass
+
+    return SensorDatagramProtocol()
+
 
 class MIDISensorController:
-    def __init__(self, port=8081):
+    def __init__(self, port=8081, settings_only=False):
         self.port = port
+        # settings_only: 热更新时只读取和校验set.ini，不打印配置，也不创建滤波器组、查找表等运行时状态
+        self.verbose = not settings_only
         self.sock = None
+        self.selector = None
+        self.wakeup_recv = None  # stop()通过wakeup_send写入数据来立即唤醒监听线程
+        self.wakeup_send = None
+        self.drain_latest_only = True  # 每次唤醒只处理每个数据源最新的数据包
+        self.max_drain_packets = 256  # 每次唤醒最多连续读取的数据包数量
+        # 抖动缓冲：带序号的(二进制格式)数据包先按序号重排，再按发送端时间戳以稳定的节奏播放，0表示不使用
+        self.jitter_buffer_ms = 0
+        self.jitter_buffer_max_ms = 60  # 网络抖动较大时缓冲延迟自动增大的上限
+        self.jitter_timer = None  # asyncio运行时播放下一个数据包的定时器
+        # 分片模式：shards个工作进程各自用SO_REUSEPORT监听同一端口并完成解析和滤波，
+        # 滤波结果通过共享内存交给本进程发送MIDI；1表示不分片，0表示使用全部CPU核心
+        self.shards = 1
+        self.shard_table = None  # ShardTable，工作进程中用于发布结果，本进程中用于读取
+        self.shard_workers = []
+        self.shard_stop = None
+        self.capture = None  # 抓包模式下的环形抓包文件
+        self.capture_path = None
+        self.capture_size_mb = 64
+        self.replay_clock_ns = 0  # 回放时的虚拟时间(相对抓包开始的ns)
         self.running = False
-        self.cc1_value = 0.0  # 维护的cc1数据变量
-        self.cc11_value = 0.0  # 接收到的cc11数据
-        self.cc_opt_value = 0.0  # 接收到的cc_opt数据
-        self.last_cc1 = 0.0  # 上一个cc1值
-        self.temp_cc1 = 0.0  # 临时cc1变量
-        self.peak_flag = False  # 标记变量
-        self.last_st = 0.0  # 上一个预测值
-        self.new_st = 0.0  # 当前预测值
-        self.last_cc11 = 0.0  # 上一个cc11值
-        self.last_st_cc11 = 0.0  # 上一个cc11预测值
-        self.new_st_cc11 = 0.0  # 当前cc11预测值
         self.aef = 0.1  # 全局平滑指数（向后兼容）
         self.aef_cc1 = 0.1  # CC1平滑指数
         self.aef_cc11 = 0.1  # CC11平滑指数
         self.cc1_max = 30  # cc1最大值
         self.send_frequency = 60  # 发送频率，默认60Hz
+        self.spin_us = 0  # 截止时间前忙等的微秒数，0表示仅使用sleep
+        self.missed_tick_policy = "skip"  # 错过tick时的处理方式: skip / catchup
+        self.scheduler = None
+
+        # 输出模式: polled(按send_frequency轮询发送) / event(收到数据后立即发送)
+        self.output_mode = "polled"
+        self.min_cc_interval_ms = 5.0  # event模式下同一CC两条消息的最小间隔(毫秒)
+        self.data_cond = threading.Condition()
+        self.data_pending = False
+        # 空闲模式：所有数据源都超时后发送线程阻塞等待，收到数据包后立即恢复
+        self.idle_mode = True
+        self.idle = False  # 发送线程(或协程)正在空闲等待
+        self.idle_entries = 0
+        self.listen_wakeups = 0  # 接收线程从等待中被唤醒的次数(asyncio运行时为收到的数据报数)
+        self.send_wakeups = 0  # 发送线程每轮循环计一次
+        self.wakeup_origin_ns = time.perf_counter_ns()
+        self.wakeup_snapshot = (self.wakeup_origin_ns, 0, 0)  # 计算每秒唤醒次数的起点
+
+        # 输出合并：变化量阈值、回差、稳定后补发、保活重发与端口消息速率上限
+        self.min_delta = 1  # 与上次发送值相差至少min_delta才立即发送
+        self.hysteresis = 1  # 变化方向反转时额外需要的差值，抑制在两个值之间来回跳动
+        self.settle_ms = 50  # 目标值保持不变超过该时间后，即使差值低于阈值也发送，保证终值到达
+        self.keepalive_ms = 1000  # 值不变时的重发间隔(毫秒)，0表示不重发
+        self.max_messages_per_second = 1000  # 每个MIDI端口每秒最多发送的消息数，0表示不限制
+        self.output_budget = None  # 当前MIDI端口的RateBudget
+        self.cc_suppressed = 0  # 低于阈值被暂缓的次数
+        self.cc_keepalives = 0  # 保活重发的消息数
+        self.hires_step = 16  # 14位/NRPN输出时min_delta与hysteresis的单位(14位值)
+        self.emit_offset = 0  # 速率受限时轮流优先的数据源
+        self.emit_deferred = 0  # 上一轮开始时端口速率上限推迟的累计次数
+        self.async_data_event = None  # asyncio运行时中代替data_cond的事件
+        self.async_loop = None  # asyncio运行时的事件循环，其他线程通过它设置async_data_event
+
+        # 端到端延迟统计
+        self.metrics = PipelineMetrics()
+        self.metrics_enabled = True
+        self.metrics_interval = 0  # 控制台定期打印统计的间隔(秒)，0表示不打印
+        self.metrics_port = 0  # 本地纯文本统计接口的端口，0表示不开启
+        self.metrics_stop = threading.Event()
+        self.metrics_thread = None
+        self.metrics_server = None
 
         # MIDI CC控制器开关状态，默认都为开启
         self.cc1_enabled = True
@@ -38,24 +1545,84 @@ class MIDISensorController:
         self.cc1_mapping = 1
         self.cc11_mapping = 11
         self.cc_opt_mapping = 3
-
-        # 读取传感器处理方式
-        self.cc1_smooth = "smooth"
-        self.cc11_smooth = None
-        self.cc_opt_smooth = None
+        self.cc_modes = ["cc7", "cc7", "cc7"]  # cc1/cc11/cc_opt的输出方式
+        # 原始IMU模式：向手机声明支持imu1格式，手机成批发送原始加速度和旋转矢量，由电脑端计算各通道的值
+        self.imu_streaming = True
+        self.imu_channels = ["shake", "tilt", "proximity"]  # cc1/cc11/cc_opt在原始IMU模式下对应的量
+        self.nrpn_selected = {}  # (端口序号, 端口上的MIDI通道) -> 当前已选中的NRPN参数号，相同时不再重复发送99/98
+        # 手势检测：在cc1原始数据上检测晃动的峰值和持续晃动，发送音符或单次CC
+        self.gestures_enabled = False
+        self.gesture_output = "note"  # note(音符) / cc(单次CC)
+        self.gesture_note = 60
+        self.gesture_cc = 20
+        self.gesture_sustain_cc = 64  # 持续晃动时发送的CC，0表示不发送
+        self.gesture_params = {"min_level": 2.0, "sensitivity": 3.0, "release_ratio": 0.5,
+                               "refractory_ms": 80.0, "sustain_ms": 300.0, "adapt_s": 2.0}
+        self.gesture_events_sent = 0
+
+        # 读取传感器处理方式: none(不处理) / smooth(指数平滑) / oneeuro(自适应滤波)
+        self.cc1_filter = "smooth"
+        self.cc11_filter = "none"
+        # [Sensors]中按通道覆盖的平滑指数和限幅范围
+        self.sensor_alphas = {}
+        self.sensor_ranges = {}
+        # oneeuro滤波参数: 通道名 -> {min_cutoff, beta, d_cutoff, lead_ms}
+        self.oneeuro_params = {}
+        # 一次滤波更新的值(数据源数 x 通道数)达到该数量且安装了NumPy时使用向量化计算
+        self.vectorize_min_values = FilterBank.VECTORIZE_MIN_VALUES
+        self.filter_bank = None
+
+        # [Curves]中每个通道的响应曲线设置: 通道名 -> (曲线类型, 弯曲程度, 分段点)
+        self.curve_settings = {}
+        # 编译好的查找表，每个通道一组 (7位曲线, 14位曲线)；配置变化时整体替换，发送线程不会看到一半新一半旧的表
+        self.curves = None
 
         # 参数监控显示模式，默认为text
         self.para_monitor_display = "text"
+        self.monitor_fps = 20  # 参数监控的刷新帧率
+        self.monitor = None  # 运行中的ConsoleMonitor
 
         self.midi_output = None
         self.send_thread = None
         self.listen_thread = None
-        self.last_data_time = time.time()  # 记录上次接收数据的时间
         self.data_timeout = 1.0  # 超时阈值为1秒
-        self.is_data_timeout = False  # 是否超时状态
+
+        # 数据源表：按发送端IP区分不同手机，每个数据源有独立的状态
+        # sources列表只在监听线程中以整体替换的方式更新，发送线程遍历时无需加锁
+        self.sources = []
+        self.source_by_addr = {}  # IP -> SensorSource，被忽略的IP映射为False
+        self.configured_sources = []  # 从set.ini的[Source.*]节读取的数据源
+        self.unknown_sources = "auto"  # 未配置IP的处理方式: auto(自动创建数据源) / ignore(忽略)
+        self.max_sources = 16  # 数据源数量上限
         self.zeroconf = None
         self.service_info = None
+        self.mdns_enabled = True  # 是否注册mDNS服务
+        self.mdns_timeout = 3.0  # mDNS注册超过该时间(秒)仍未完成时给出提示，注册本身不阻塞启动
+        self.mdns_thread = None
+        self.null_midi = False  # 为True时不打开真实MIDI端口，输出到内存中的MemoryMidiOutput
+        # 无人值守启动：按名称或正则表达式选择MIDI端口，headless时不等待任何键盘输入
+        self.midi_port = ""
+        self.output_ports = []  # [MIDIOutput.*]中配置的多个输出端口，为空时只使用一个端口
+        self.headless = False
+        self.startup_marks = []  # [(阶段, 距进程启动的纳秒数)]
+        # 配置热更新：监视set.ini的修改时间，变化后在后台重新读取并校验
+        self.hot_reload = True
+        self.reload_interval = 1.0  # 检查set.ini是否修改的间隔(秒)
+        self.reload_thread = None
+        self.reload_stop = threading.Event()
+        self.pending_config = None  # 已校验、等待发送线程在两个tick之间应用的新配置
+        self.pending_receiver_config = None  # 等待接收线程换上的新配置(接收线程读取的设置和新的滤波器组)
+        self.config_errors = []
+
         self.load_settings()  # 加载配置文件
+        if settings_only:
+            return
+        self.filter_bank = self.build_filter_bank()
+        self.curves = self.build_curves()
+        self.output_budget = RateBudget(self.max_messages_per_second)
+        # 需要重启才能生效的设置在启动时的取值，热更新时用来提示哪些修改未生效
+        self.restart_settings = self.get_restart_settings()
+        self.mark_startup("读取配置")
 
     def get_resource_path(self, relative_path):
         """获取资源文件的绝对路径，支持开发环境和打包环境"""
@@ -72,6 +1639,17 @@ class MIDISensorController:
 
         return os.path.join(base_path, relative_path)
 
+    def mark_startup(self, stage):
+        """记录启动阶段完成的时间，返回距进程启动的纳秒数(可能在后台线程中调用)"""
+        elapsed_ns = time.perf_counter_ns() - PROCESS_START_NS
+        self.startup_marks.append((stage, elapsed_ns))
+        return elapsed_ns
+
+    def format_startup_report(self):
+        """启动耗时报告: 各阶段完成时距进程启动的毫秒数"""
+        stages = ", ".join(f"{stage} {elapsed_ns / 1_000_000:.1f}ms" for stage, elapsed_ns in self.startup_marks)
+        return f"启动耗时(距进程启动): {stages}"
+
     def get_local_ip(self):
         """获取本机在局域网中的IP地址"""
         try:
@@ -87,9 +1665,27 @@ class MIDISensorController:
             # 如果无法获取，返回默认值
             return "127.0.0.1"
 
+    def start_mdns(self):
+        """在后台线程中注册mDNS服务，不阻塞监听和MIDI初始化"""
+        if not self.mdns_enabled or self.mdns_thread is not None:
+            return
+        self.mdns_thread = threading.Thread(target=self.register_mdns_service, daemon=True)
+        self.mdns_thread.start()
+        threading.Thread(target=self.watch_mdns_registration, daemon=True).start()
+
+    def watch_mdns_registration(self):
+        """注册超过mdns_timeout仍未完成时提示手动输入地址，注册继续在后台进行"""
+        self.mdns_thread.join(self.mdns_timeout)
+        if self.mdns_thread.is_alive():
+            print(f"mDNS服务注册超过{self.mdns_timeout:g}秒仍未完成，将继续在后台注册；"
+                  f"手机端也可以手动输入 {self.get_local_ip()}:{self.port}")
+
     def register_mdns_service(self):
         """注册mDNS服务"""
+        if not self.mdns_enabled:
+            return False
         try:
+            from zeroconf import Zeroconf, ServiceInfo
             self.zeroconf = Zeroconf()
             local_ip = self.get_local_ip()
 
@@ -99,13 +1695,16 @@ class MIDISensorController:
                 "MIDISensorController._midi._tcp.local.",
                 addresses=[socket.inet_aton(local_ip)],
                 port=self.port,
-                properties={'description': 'MIDI Sensor Controller'},
+                properties={'description': 'MIDI Sensor Controller',
+                            'formats': SUPPORTED_FORMATS + (f",{IMU_FORMAT}" if self.imu_streaming else "")},
                 server="MIDISensorController.local.",
             )
 
             # 注册服务
             self.zeroconf.register_service(self.service_info)
-            print(f"已注册mDNS服务: MIDISensorController._midi._tcp.local.")
+            elapsed_ns = self.mark_startup("mDNS注册")
+            print(f"已注册mDNS服务: MIDISensorController._midi._tcp.local. "
+                  f"(启动后{elapsed_ns / 1_000_000:.0f}ms)")
             #print(f"本机IP地址: {local_ip}")
             return True
         except Exception as e:
@@ -114,6 +1713,10 @@ class MIDISensorController:
 
     def unregister_mdns_service(self):
         """注销mDNS服务"""
+        # 等待仍在后台进行的注册结束，避免注销与注册同时进行
+        if self.mdns_thread is not None:
+            self.mdns_thread.join(self.mdns_timeout)
+            self.mdns_thread = None
         if self.zeroconf and self.service_info:
             try:
                 # 注销服务
@@ -128,20 +1731,24 @@ class MIDISensorController:
                 self.service_info = None
 
     def load_settings(self):
-        """从同目录下的set.ini文件加载设置"""
+        """从同目录下的set.ini文件加载设置
+
+        发现的无效配置记录在config_errors中，热更新时据此拒绝整份配置。
+        """
+        self.config_errors = []
         try:
             # 获取配置文件路径
             settings_file = self.get_resource_path("set.ini")
 
             # 打印调试信息
-            print(f"正在查找配置文件: {settings_file}")
+            self.log(f"正在查找配置文件: {settings_file}")
 
             # 检查文件是否存在
             if not os.path.exists(settings_file):
-                print("配置文件set.ini不存在，使用默认设置")
+                self.log("配置文件set.ini不存在，使用默认设置")
                 return
 
-            print(f"找到配置文件: {settings_file}")
+            self.log(f"找到配置文件: {settings_file}")
 
             # 使用configparser读取INI格式配置文件
             config = configparser.ConfigParser()
@@ -152,38 +1759,93 @@ class MIDISensorController:
                 # 读取全局aef（向后兼容）
                 if config.has_option('MIDIController', 'aef'):
                     self.aef = config.getfloat('MIDIController', 'aef')
-                    print(f"已加载 aef = {self.aef}")
+                    self.log(f"已加载 aef = {self.aef}")
 
                 # 读取CC1专用aef
                 if config.has_option('MIDIController', 'aef_cc1'):
                     self.aef_cc1 = config.getfloat('MIDIController', 'aef_cc1')
-                    print(f"已加载 aef_cc1 = {self.aef_cc1}")
+                    self.log(f"已加载 aef_cc1 = {self.aef_cc1}")
                 else:
                     # 如果没有单独设置，使用全局aef值
                     self.aef_cc1 = self.aef
-                    print(f"使用全局aef值作为aef_cc1: {self.aef_cc1}")
+                    self.log(f"使用全局aef值作为aef_cc1: {self.aef_cc1}")
 
                 # 读取CC11专用aef
                 if config.has_option('MIDIController', 'aef_cc11'):
                     self.aef_cc11 = config.getfloat('MIDIController', 'aef_cc11')
-                    print(f"已加载 aef_cc11 = {self.aef_cc11}")
+                    self.log(f"已加载 aef_cc11 = {self.aef_cc11}")
                 else:
                     # 如果没有单独设置，使用全局aef值
                     self.aef_cc11 = self.aef
-                    print(f"使用全局aef值作为aef_cc11: {self.aef_cc11}")
+                    self.log(f"使用全局aef值作为aef_cc11: {self.aef_cc11}")
 
                 if config.has_option('MIDIController', 'cc1_max'):
                     self.cc1_max = config.getfloat('MIDIController', 'cc1_max')
-                    print(f"已加载 cc1_max = {self.cc1_max}")
+                    self.log(f"已加载 cc1_max = {self.cc1_max}")
 
                 if config.has_option('MIDIController', 'send_frequency'):
                     self.send_frequency = config.getfloat('MIDIController', 'send_frequency')
-                    print(f"已加载 send_frequency = {self.send_frequency}")
+                    self.log(f"已加载 send_frequency = {self.send_frequency}")
+
+                if config.has_option('MIDIController', 'spin_us'):
+                    self.spin_us = config.getint('MIDIController', 'spin_us')
+                    self.log(f"已加载 spin_us = {self.spin_us}")
+
+                if config.has_option('MIDIController', 'missed_tick_policy'):
+                    policy = config.get('MIDIController', 'missed_tick_policy').lower()
+                    if policy in ("skip", "catchup"):
+                        self.missed_tick_policy = policy
+                        self.log(f"已加载 missed_tick_policy = {self.missed_tick_policy}")
+                    else:
+                        self.report_config_error(f"无效的missed_tick_policy: {policy}，使用默认值 {self.missed_tick_policy}")
+
+                if config.has_option('MIDIController', 'output_mode'):
+                    mode = config.get('MIDIController', 'output_mode').lower()
+                    if mode in ("polled", "event"):
+                        self.output_mode = mode
+                        self.log(f"已加载 output_mode = {self.output_mode}")
+                    else:
+                        self.report_config_error(f"无效的output_mode: {mode}，使用默认值 {self.output_mode}")
+
+                if config.has_option('MIDIController', 'idle_mode'):
+                    self.idle_mode = config.getboolean('MIDIController', 'idle_mode')
+                    self.log(f"已加载 idle_mode = {self.idle_mode}")
+
+                if config.has_option('MIDIController', 'drain_latest_only'):
+                    self.drain_latest_only = config.getboolean('MIDIController', 'drain_latest_only')
+                    self.log(f"已加载 drain_latest_only = {self.drain_latest_only}")
+
+                if config.has_option('MIDIController', 'jitter_buffer_ms'):
+                    self.jitter_buffer_ms = max(0.0, config.getfloat('MIDIController', 'jitter_buffer_ms'))
+                    self.log(f"已加载 jitter_buffer_ms = {self.jitter_buffer_ms}")
+                if config.has_option('MIDIController', 'jitter_buffer_max_ms'):
+                    self.jitter_buffer_max_ms = max(0.0, config.getfloat('MIDIController', 'jitter_buffer_max_ms'))
+
+                if config.has_option('MIDIController', 'shards'):
+                    self.shards = max(0, config.getint('MIDIController', 'shards'))
+
+                if config.has_option('MIDIController', 'min_cc_interval_ms'):
+                    self.min_cc_interval_ms = config.getfloat('MIDIController', 'min_cc_interval_ms')
+                    self.log(f"已加载 min_cc_interval_ms = {self.min_cc_interval_ms}")
+
+                # 读取配置热更新选项
+                if config.has_option('MIDIController', 'hot_reload'):
+                    self.hot_reload = config.getboolean('MIDIController', 'hot_reload')
+                if config.has_option('MIDIController', 'reload_interval'):
+                    self.reload_interval = max(0.1, config.getfloat('MIDIController', 'reload_interval'))
+
+                # 读取无人值守启动选项
+                if config.has_option('MIDIController', 'midi_port'):
+                    self.midi_port = config.get('MIDIController', 'midi_port').strip()
+                if config.has_option('MIDIController', 'headless'):
+                    self.headless = config.getboolean('MIDIController', 'headless')
+                if config.has_option('MIDIController', 'mdns_timeout'):
+                    self.mdns_timeout = max(0.0, config.getfloat('MIDIController', 'mdns_timeout'))
 
                 # 读取监听端口号配置项
                 if config.has_option('MIDIController', 'listen_port'):
                     self.port = config.getint('MIDIController', 'listen_port')
-                    print(f"已加载 listen_port = {self.port}")
+                    self.log(f"已加载 listen_port = {self.port}")
 
                 # 读取MIDI CC控制器开关状态
                 if config.has_option('MIDIController', 'cc1_enabled'):
@@ -192,21 +1854,59 @@ class MIDISensorController:
                     self.cc11_enabled = config.getboolean('MIDIController', 'cc11_enabled')
                 if config.has_option('MIDIController', 'cc_opt_enabled'):
                     self.cc_opt_enabled = config.getboolean('MIDIController', 'cc_opt_enabled')
-            print(f"MIDI CC控制器状态: cc1={self.cc1_enabled}, cc11={self.cc11_enabled}, cc_opt={self.cc_opt_enabled}")
+            self.log(f"MIDI CC控制器状态: cc1={self.cc1_enabled}, cc11={self.cc11_enabled}, cc_opt={self.cc_opt_enabled}")
+
+            # 读取输出合并配置
+            if config.has_section('Output'):
+                for option in ('min_delta', 'hysteresis', 'settle_ms', 'keepalive_ms', 'max_messages_per_second',
+                               'hires_step'):
+                    if config.has_option('Output', option):
+                        value = config.getint('Output', option)
+                        if value < 0 or (option in ('min_delta', 'hires_step') and value < 1):
+                            self.report_config_error(f"无效的{option}: {value}，使用默认值 {getattr(self, option)}")
+                            continue
+                        setattr(self, option, value)
+                        self.log(f"已加载 {option} = {value}")
 
             if config.has_section('Sensors'):
-                if config.has_option('Sensors', 'cc1'):
-                    self.cc1_smooth = config.get('Sensors', 'cc1').lower() == 'smooth'
-                if config.has_option('Sensors', 'cc11'):
-                    self.cc11_smooth = config.get('Sensors', 'cc11').lower() == 'smooth'
+                for channel in ('cc1', 'cc11'):
+                    if config.has_option('Sensors', channel):
+                        kind = config.get('Sensors', channel).lower()
+                        if kind in FilterBank.KINDS:
+                            setattr(self, f'{channel}_filter', kind)
+                        else:
+                            self.report_config_error(f"无效的{channel}处理方式: {kind}，使用 {getattr(self, f'{channel}_filter')}")
+                    params = {}
+                    for option in ('min_cutoff', 'beta', 'd_cutoff', 'lead_ms'):
+                        if config.has_option('Sensors', f'{channel}_{option}'):
+                            params[option] = config.getfloat('Sensors', f'{channel}_{option}')
+                    if params:
+                        self.oneeuro_params[channel] = params
+                        self.log(f"已加载 {channel} oneeuro参数 = {params}")
                 if config.has_option('Sensors', 'cc_opt'):
-                    print("cc_opt由手机距离传感器控制，只有0/1两个值，不支持平滑计算-_-")
-            print(f"传感器处理方式: cc1={'smooth' if self.cc1_smooth else 'none'}, cc11={'smooth' if self.cc11_smooth else 'none'}")
+                    self.log("cc_opt由手机距离传感器控制，只有0/1两个值，不支持平滑计算-_-")
+                for channel in SENSOR_CHANNELS:
+                    if config.has_option('Sensors', f'{channel}_alpha'):
+                        self.sensor_alphas[channel] = config.getfloat('Sensors', f'{channel}_alpha')
+                        self.log(f"已加载 {channel}_alpha = {self.sensor_alphas[channel]}")
+                    if config.has_option('Sensors', f'{channel}_range'):
+                        try:
+                            low, high = (float(v) for v in config.get('Sensors', f'{channel}_range').split(','))
+                            self.sensor_ranges[channel] = (low, high)
+                            self.log(f"已加载 {channel}_range = {low}, {high}")
+                        except ValueError:
+                            self.report_config_error(f"无效的{channel}_range，格式应为 最小值,最大值")
+                if config.has_option('Sensors', 'vectorize_min_values'):
+                    self.vectorize_min_values = max(1, config.getint('Sensors', 'vectorize_min_values'))
+                    self.log(f"已加载 vectorize_min_values = {self.vectorize_min_values}")
+            self.log(f"传感器处理方式: cc1={self.cc1_filter}, cc11={self.cc11_filter}")
 
             # 读取参数监控显示模式
             if config.has_option('Display', 'para_monitor_display'):
                 self.para_monitor_display = config.get('Display', 'para_monitor_display').lower()
-            print(f"\n参数监控显示方式：{self.para_monitor_display}")
+            if config.has_option('Display', 'monitor_fps'):
+                self.monitor_fps = max(1, config.getint('Display', 'monitor_fps'))
+            self.log(f"\n参数监控显示方式：{self.para_monitor_display}，刷新帧率：{self.monitor_fps}")
 
             # 读取MIDI CC映射
             if config.has_section('MIDIMapping'):
@@ -218,35 +1918,554 @@ class MIDISensorController:
 
                 if config.has_option('MIDIMapping', 'cc_opt'):
                     self.cc_opt_mapping = config.getint('MIDIMapping', 'cc_opt')
+
+                # 读取每个映射的输出方式(7位CC / 14位CC / NRPN)
+                self.cc_modes = self.load_cc_modes(config, 'MIDIMapping', self.cc_modes,
+                                                   (self.cc1_mapping, self.cc11_mapping, self.cc_opt_mapping))
             
-                # 检查映射是否冲突
-                mappings = [('cc1', self.cc1_mapping), ('cc11', self.cc11_mapping), ('cc_opt', self.cc_opt_mapping)]
-                conflict_found = False
-                for i in range(len(mappings)):
-                    for j in range(i+1, len(mappings)):
-                        if mappings[i][1] == mappings[j][1]:
-                            conflict_found = True
-                            break
-                    if conflict_found:
-                        break
-                
-                if conflict_found:
-                    print("错误：检测到MIDI映射冲突，请检查配置文件")
-                    print("将使用默认映射")
+                # 检查控制器号范围和映射是否冲突
+                mappings = (self.cc1_mapping, self.cc11_mapping, self.cc_opt_mapping)
+                out_of_range = any(mode != "nrpn" and not 0 <= mapping < 128
+                                   for mapping, mode in zip(mappings, self.cc_modes))
+                if out_of_range or self.has_mapping_conflict(*mappings, self.cc_modes):
+                    if out_of_range:
+                        self.report_config_error("错误：MIDI控制器号必须在0-127之间，请检查配置文件")
+                    else:
+                        self.report_config_error("错误：检测到MIDI映射冲突，请检查配置文件")
+                    self.log("将使用默认映射")
                     self.cc1_mapping = 1
                     self.cc11_mapping = 11
                     self.cc_opt_mapping = 3
-            print(f"MIDI CC控制器映射: cc1={self.cc1_mapping}, cc11={self.cc11_mapping}, cc_opt={self.cc_opt_mapping}\n")
+                    self.cc_modes = ["cc7", "cc7", "cc7"]
+            self.log(f"MIDI CC控制器映射: cc1={self.cc1_mapping}, cc11={self.cc11_mapping}, cc_opt={self.cc_opt_mapping}")
+            self.log(f"MIDI输出方式: cc1={self.cc_modes[0]}, cc11={self.cc_modes[1]}, cc_opt={self.cc_modes[2]}\n")
+
+            # 读取原始IMU模式配置
+            if config.has_section('IMU'):
+                if config.has_option('IMU', 'enabled'):
+                    self.imu_streaming = config.getboolean('IMU', 'enabled')
+                for index, channel in enumerate(SENSOR_CHANNELS):
+                    if config.has_option('IMU', channel):
+                        quantity = config.get('IMU', channel).strip().lower()
+                        if quantity in IMU_QUANTITIES:
+                            self.imu_channels[index] = quantity
+                        else:
+                            self.report_config_error(f"无效的IMU {channel}: {quantity}，使用 {self.imu_channels[index]}")
+                self.log(f"原始IMU模式: enabled={self.imu_streaming}, cc1={self.imu_channels[0]}, "
+                         f"cc11={self.imu_channels[1]}, cc_opt={self.imu_channels[2]}")
+
+            # 读取手势检测配置
+            if config.has_section('Gestures'):
+                self.load_gesture_settings(config)
+
+            # 读取响应曲线配置
+            if config.has_section('Curves'):
+                self.curve_settings = self.load_curve_settings(config)
+
+            # 读取多手机数据源配置
+            self.load_sources(config)
+
+            # 读取多端口输出配置
+            self.load_output_ports(config)
+
+            # 读取延迟统计配置
+            if config.has_section('Metrics'):
+                if config.has_option('Metrics', 'enabled'):
+                    self.metrics_enabled = config.getboolean('Metrics', 'enabled')
+                if config.has_option('Metrics', 'report_interval'):
+                    self.metrics_interval = config.getfloat('Metrics', 'report_interval')
+                if config.has_option('Metrics', 'http_port'):
+                    self.metrics_port = config.getint('Metrics', 'http_port')
+                self.log(f"延迟统计: enabled={self.metrics_enabled}, report_interval={self.metrics_interval}, "
+                         f"http_port={self.metrics_port}")
+
+        except Exception as e:
+            self.report_config_error(f"读取配置文件出错: {e}，使用默认设置")
+
+    def load_gesture_settings(self, config):
+        """读取[Gestures]段，无效的值保留原有设置"""
+        if config.has_option('Gestures', 'enabled'):
+            self.gestures_enabled = config.getboolean('Gestures', 'enabled')
+        if config.has_option('Gestures', 'output'):
+            output = config.get('Gestures', 'output').strip().lower()
+            if output in ("note", "cc"):
+                self.gesture_output = output
+            else:
+                self.report_config_error(f"无效的手势输出方式: {output}，使用 {self.gesture_output}")
+        for key, attr in (("note", "gesture_note"), ("cc", "gesture_cc"), ("sustain_cc", "gesture_sustain_cc")):
+            if config.has_option('Gestures', key):
+                value = config.getint('Gestures', key)
+                if 0 <= value < 128:
+                    setattr(self, attr, value)
+                else:
+                    self.report_config_error(f"错误：[Gestures] {key}必须在0-127之间，使用 {getattr(self, attr)}")
+        for key in self.gesture_params:
+            if config.has_option('Gestures', key):
+                value = config.getfloat('Gestures', key)
+                if value > 0 or (key == "refractory_ms" and value == 0):
+                    self.gesture_params[key] = value
+                else:
+                    self.report_config_error(f"错误：[Gestures] {key}必须大于0，使用 {self.gesture_params[key]}")
+        target = f"音符{self.gesture_note}" if self.gesture_output == "note" else f"CC{self.gesture_cc}"
+        params = ", ".join(f"{key}={value:g}" for key, value in self.gesture_params.items())
+        self.log(f"手势检测: enabled={self.gestures_enabled}, 输出{target}, sustain_cc={self.gesture_sustain_cc}, {params}")
+
+    def build_filter_bank(self):
+        """根据当前设置创建滤波器组，未在[Sensors]中单独设置的通道沿用原有参数"""
+        inf = float('inf')
+        alphas = [self.aef_cc1, self.aef_cc11, self.aef]
+        ranges = [(-inf, self.cc1_max), (0.0, 90.0), (-inf, inf)]
+        for index, channel in enumerate(SENSOR_CHANNELS):
+            alphas[index] = self.sensor_alphas.get(channel, alphas[index])
+            ranges[index] = self.sensor_ranges.get(channel, ranges[index])
+        # cc_opt只有0/1两个值，不做平滑
+        kinds = [self.cc1_filter, self.cc11_filter, "none"]
+        enabled = [self.cc1_enabled, self.cc11_enabled, self.cc_opt_enabled]
+        # oneeuro默认参数：静止时1Hz截止频率，速度每增加20单位/秒截止频率提高1Hz，不做预测
+        params = [self.oneeuro_params.get(channel, {}) for channel in SENSOR_CHANNELS]
+        rows = max(self.max_sources, len(self.sources))
+        return FilterBank(rows, alphas, [r[0] for r in ranges], [r[1] for r in ranges], kinds, enabled,
+                          min_cutoffs=[p.get('min_cutoff', 1.0) for p in params],
+                          betas=[p.get('beta', 0.05) for p in params],
+                          d_cutoffs=[p.get('d_cutoff', 1.0) for p in params],
+                          leads=[p.get('lead_ms', 0.0) / 1000 for p in params],
+                          vectorize_min=self.vectorize_min_values)
+
+    def load_curve_settings(self, config):
+        """读取[Curves]节，返回 通道名 -> (曲线类型, 弯曲程度, 分段点)，无效的设置使用线性曲线"""
+        settings = {}
+        for channel in SENSOR_CHANNELS:
+            if not config.has_option('Curves', channel):
+                continue
+            kind = config.get('Curves', channel).lower()
+            amount = config.getfloat('Curves', f'{channel}_amount', fallback=3.0)
+            points = None
+            if kind not in ResponseCurve.KINDS:
+                self.report_config_error(f"无效的{channel}响应曲线: {kind}，使用linear")
+                continue
+            if kind in ("exp", "log", "s") and amount <= 0:
+                self.report_config_error(f"无效的{channel}_amount: {amount}，必须大于0，使用linear")
+                continue
+            if kind == "piecewise":
+                try:
+                    points = [tuple(float(v) for v in point.split(':'))
+                              for point in config.get('Curves', f'{channel}_points').split(',')]
+                    if len(points) < 2 or any(len(p) != 2 for p in points) or \
+                            any(points[i][0] >= points[i + 1][0] for i in range(len(points) - 1)):
+                        raise ValueError
+                except (ValueError, configparser.NoOptionError):
+                    self.report_config_error(f"无效的{channel}_points，格式应为 输入值:输出值,... 且输入值递增，使用linear")
+                    continue
+            settings[channel] = (kind, amount, points)
+            self.log(f"已加载 {channel} 响应曲线 = {kind}")
+        return settings
+
+    def channel_ranges(self):
+        """各通道映射到MIDI值时的输入范围，与原先的线性映射一致: cc1为0-cc1_max，cc11和cc_opt为0-90"""
+        return (0, self.cc1_max), (0, 90), (0, 90)
+
+    def build_curves(self):
+        """根据当前设置编译所有通道的查找表，返回 ([7位曲线, 14位曲线], ...)
+
+        14位查找表只为有数据源使用cc14/nrpn输出的通道编译，其余为None，用到时由hires_curve()编译。
+        """
+        curves = []
+        for index in range(len(SENSOR_CHANNELS)):
+            hires = self.cc_modes[index] != "cc7" or any(source.cc_modes[index] != "cc7" for source in self.sources)
+            curves.append([self.make_curve(index, 127), self.make_curve(index, 16383) if hires else None])
+        return tuple(curves)
+
+    def make_curve(self, index, full):
+        """按当前设置编译一个通道映射到0-full的查找表"""
+        low, high = self.channel_ranges()[index]
+        kind, amount, points = self.curve_settings.get(SENSOR_CHANNELS[index], ("linear", 3.0, None))
+        return ResponseCurve(kind, low, high, full, amount, points)
+
+    def hires_curve(self, curves, index):
+        """取14位查找表，尚未编译时(数据源运行中改用cc14/nrpn)现在编译"""
+        curve = curves[index][1]
+        if curve is None:
+            curve = curves[index][1] = self.make_curve(index, 16383)
+        return curve
+
+    def imu_values(self, data, count, proximity):
+        """原始IMU模式：计算一批样本的各个量，并按imu_channels换算到cc1/cc11/cc_opt的输入范围"""
+        shake, tilt, pitch, roll, yaw = fuse_imu_batch(data, count)
+        quantities = {"shake": shake, "tilt": tilt, "pitch": pitch, "roll": roll, "yaw": yaw, "proximity": proximity}
+        values = []
+        for quantity, (low, high) in zip(self.imu_channels, self.channel_ranges()):
+            value = quantities[quantity]
+            if quantity != "proximity":
+                # 线性换算到通道的输入范围，例如cc11使用pitch时-90..90度对应0..90
+                q_low, q_high = IMU_RANGES.get(quantity, (0.0, self.cc1_max))
+                if (q_low, q_high) != (low, high):
+                    value = low + (value - q_low) * (high - low) / (q_high - q_low)
+            values.append(value)
+        return values
+
+    def load_cc_modes(self, config, section, fallback, mappings):
+        """读取cc1_mode/cc11_mode/cc_opt_mode，无效的设置保留fallback中的值"""
+        modes = list(fallback)
+        for index, channel in enumerate(SENSOR_CHANNELS):
+            option = f'{channel}_mode'
+            if not config.has_option(section, option):
+                continue
+            mode = config.get(section, option).lower()
+            if mode not in CC_MODES:
+                self.report_config_error(f"无效的{option}: {mode}，使用 {modes[index]}")
+            elif mode == "cc14" and not 0 <= mappings[index] < 32:
+                self.report_config_error(f"错误：{option}=cc14 要求控制器号在0-31之间(LSB使用控制器号+32)，使用 {modes[index]}")
+            elif mode == "nrpn" and not 0 <= mappings[index] < 16384:
+                self.report_config_error(f"错误：{option}=nrpn 要求参数号在0-16383之间，使用 {modes[index]}")
+            else:
+                modes[index] = mode
+        return modes
+
+    def has_mapping_conflict(self, cc1_mapping, cc11_mapping, cc_opt_mapping, modes=("cc7", "cc7", "cc7")):
+        """检查三个CC映射之间是否存在冲突
+
+        14位CC同时占用控制器号和控制器号+32；NRPN映射之间只比较参数号，
+        但任何NRPN映射都会占用NRPN_CONTROLS中的控制器。
+        """
+        used = set()
+        uses_nrpn = False
+        for mapping, mode in zip((cc1_mapping, cc11_mapping, cc_opt_mapping), modes):
+            if mode == "nrpn":
+                keys = [("nrpn", mapping)]
+                uses_nrpn = True
+            elif mode == "cc14":
+                keys = [("cc", mapping), ("cc", mapping + 32)]
+            else:
+                keys = [("cc", mapping)]
+            for key in keys:
+                if key in used:
+                    return True
+                used.add(key)
+        return uses_nrpn and any(("cc", control) in used for control in NRPN_CONTROLS)
+
+    def load_sources(self, config):
+        """读取[Sources]和[Source.*]节，为每台手机建立独立的数据源"""
+        if config.has_section('Sources'):
+            if config.has_option('Sources', 'unknown_sources'):
+                policy = config.get('Sources', 'unknown_sources').lower()
+                if policy in ("auto", "ignore"):
+                    self.unknown_sources = policy
+                else:
+                    self.report_config_error(f"无效的unknown_sources: {policy}，使用默认值 {self.unknown_sources}")
+            if config.has_option('Sources', 'max_sources'):
+                self.max_sources = config.getint('Sources', 'max_sources')
+
+        self.configured_sources = []
+        # 没有设置channel的数据源依次使用其他数据源没有占用的通道，避免两台手机的CC互相覆盖
+        used_channels = {config.getint(section, 'channel') - 1 for section in config.sections()
+                         if section.startswith('Source.') and config.has_option(section, 'channel')}
+        for section in config.sections():
+            if not section.startswith('Source.'):
+                continue
+            name = section[len('Source.'):]
+            if not config.has_option(section, 'address'):
+                self.report_config_error(f"错误：数据源 {name} 缺少address配置，已忽略")
+                continue
+            if config.has_option(section, 'channel'):
+                channel = config.getint(section, 'channel') - 1
+            else:
+                channel = next((ch for ch in range(16) if ch not in used_channels), 15)
+                used_channels.add(channel)
+
+            source = SensorSource(
+                name,
+                address=config.get(section, 'address').strip(),
+                row=len(self.configured_sources),
+                channel=channel,
+                cc1_mapping=config.getint(section, 'cc1', fallback=self.cc1_mapping),
+                cc11_mapping=config.getint(section, 'cc11', fallback=self.cc11_mapping),
+                cc_opt_mapping=config.getint(section, 'cc_opt', fallback=self.cc_opt_mapping),
+                data_timeout=config.getfloat(section, 'timeout', fallback=self.data_timeout),
+                allowed_format=config.get(section, 'format', fallback='auto').lower(),
+            )
+            source.cc_modes = self.load_cc_modes(config, section, self.cc_modes,
+                                                 (source.cc1_mapping, source.cc11_mapping, source.cc_opt_mapping))
+            if source.allowed_format not in ("auto", "text", "binary"):
+                self.report_config_error(f"错误：数据源 {name} 的数据格式 {source.allowed_format} 无效，使用auto")
+                source.allowed_format = "auto"
+            if not 0 <= source.channel <= 15:
+                self.report_config_error(f"错误：数据源 {name} 的MIDI通道超出1-16范围，使用通道1")
+                source.channel = 0
+            if self.has_mapping_conflict(source.cc1_mapping, source.cc11_mapping, source.cc_opt_mapping,
+                                         source.cc_modes):
+                self.report_config_error(f"错误：数据源 {name} 的MIDI映射冲突，将使用全局映射")
+                source.cc1_mapping = self.cc1_mapping
+                source.cc11_mapping = self.cc11_mapping
+                source.cc_opt_mapping = self.cc_opt_mapping
+                source.cc_modes = list(self.cc_modes)
+            self.configured_sources.append(source)
+            self.log(f"已加载数据源 {name}: 地址={source.address}, 通道={source.channel + 1}, "
+                     f"cc1={source.cc1_mapping}, cc11={source.cc11_mapping}, cc_opt={source.cc_opt_mapping}")
+
+        self.sources = list(self.configured_sources)
+        self.source_by_addr = {source.address: source for source in self.configured_sources}
+
+    def load_output_ports(self, config):
+        """读取[MIDIOutput.*]节，每个节是一个同时输出的MIDI端口"""
+        self.output_ports = []
+        for section in config.sections():
+            if not section.startswith('MIDIOutput.'):
+                continue
+            name = section[len('MIDIOutput.'):]
+            if not config.get(section, 'port', fallback='').strip():
+                self.report_config_error(f"错误：MIDI输出 {name} 缺少port配置，已忽略")
+                continue
+            try:
+                channel = config.get(section, 'channel', fallback='').strip()
+                channel = int(channel) - 1 if channel else None
+                if channel is not None and not 0 <= channel <= 15:
+                    raise ValueError("MIDI通道超出1-16范围")
+                output = OutputPortConfig(
+                    name,
+                    port=config.get(section, 'port').strip(),
+                    channel=channel,
+                    cc_map=parse_cc_map(config.get(section, 'cc_map', fallback='')),
+                    queue_size=max(1, config.getint(section, 'queue_size', fallback=64)),
+                    rate=(max(0, config.getint(section, 'max_messages_per_second'))
+                          if config.has_option(section, 'max_messages_per_second') else None),
+                )
+            except ValueError as e:
+                self.report_config_error(f"错误：MIDI输出 {name} 的配置无效({e})，已忽略")
+                continue
+            self.output_ports.append(output)
+            self.log(f"已加载MIDI输出 {name}: 端口={output.port}, "
+                     f"通道={'不变' if channel is None else channel + 1}, cc_map={output.cc_map or '无'}")
+
+    def log(self, message=""):
+        """打印读取配置时的提示；热更新校验新配置时不打印，错误记录在config_errors中"""
+        if self.verbose:
+            print(message)
+
+    def report_config_error(self, message):
+        """打印并记录一条配置错误"""
+        self.log(message)
+        self.config_errors.append(message)
+
+    def add_unknown_source(self, ip):
+        """为未在配置中出现的发送端创建数据源，忽略时返回None"""
+        if self.unknown_sources == "ignore" or len(self.sources) >= self.filter_bank.rows:
+            self.source_by_addr[ip] = False
+            print(f"忽略来自 {ip} 的数据（未配置的数据源或已达到数据源上限）")
+            return None
 
+        # 选择一个尚未被占用的MIDI通道，第一台手机使用通道1，与单手机时的行为一致
+        used_channels = {source.channel for source in self.sources}
+        channel = next((ch for ch in range(16) if ch not in used_channels), 15)
+        source = SensorSource(ip, address=ip, row=len(self.sources), channel=channel,
+                              cc1_mapping=self.cc1_mapping, cc11_mapping=self.cc11_mapping,
+                              cc_opt_mapping=self.cc_opt_mapping, data_timeout=self.data_timeout,
+                              cc_modes=self.cc_modes)
+
+        # 整体替换列表，发送线程看到的始终是完整的列表
+        self.sources = self.sources + [source]
+        self.source_by_addr[ip] = source
+        print(f"发现新的数据源 {ip}，使用MIDI通道 {channel + 1}")
+        return source
+
+    # 热更新时直接替换的设置；其余设置(端口、输出模式、数据源地址等)需要重启
+    RELOADABLE_SETTINGS = (
+        "aef", "aef_cc1", "aef_cc11", "cc1_max", "send_frequency", "spin_us", "missed_tick_policy",
+        "drain_latest_only", "min_cc_interval_ms", "cc1_enabled", "cc11_enabled", "cc_opt_enabled",
+        "cc1_mapping", "cc11_mapping", "cc_opt_mapping", "cc_modes", "cc1_filter", "cc11_filter",
+        "sensor_alphas", "sensor_ranges", "oneeuro_params", "curve_settings", "min_delta", "hysteresis",
+        "settle_ms", "keepalive_ms", "max_messages_per_second", "hires_step", "unknown_sources", "data_timeout",
+        "imu_channels", "vectorize_min_values",
+    )
+    # 接收线程读取的设置：由接收线程在处理下一个数据包前一起换上，不会用一半新一半旧的配置处理数据包
+    RECEIVER_SETTINGS = (
+        "cc1_max", "imu_channels", "drain_latest_only", "unknown_sources", "cc1_mapping", "cc11_mapping",
+        "cc_opt_mapping", "cc_modes",
+    )
+    # 分片模式下由工作进程使用的设置(解析、滤波)，工作进程不会热更新，修改后需要重启
+    SHARD_WORKER_SETTINGS = (
+        "aef", "aef_cc1", "aef_cc11", "cc1_max", "cc1_filter", "cc11_filter", "sensor_alphas", "sensor_ranges",
+        "oneeuro_params", "drain_latest_only", "imu_channels", "unknown_sources", "vectorize_min_values",
+    )
+
+    def get_restart_settings(self):
+        """返回需要重启才能生效的设置的当前取值"""
+        return {
+            "listen_port": self.port,
+            "output_mode": self.output_mode,
+            "idle_mode": self.idle_mode,
+            "para_monitor_display": self.para_monitor_display,
+            "monitor_fps": self.monitor_fps,
+            "max_sources": self.max_sources,
+            "[Metrics]": (self.metrics_enabled, self.metrics_interval, self.metrics_port),
+            "[Source.*]地址": sorted((source.name, source.address) for source in self.configured_sources),
+            "hot_reload": (self.hot_reload, self.reload_interval),
+            "midi_port": self.midi_port,
+            "jitter_buffer_ms": (self.jitter_buffer_ms, self.jitter_buffer_max_ms),
+            "shards": self.shards,
+            "[IMU] enabled": self.imu_streaming,
+            "[Gestures]": (self.gestures_enabled, self.gesture_output, self.gesture_note, self.gesture_cc,
+                           self.gesture_sustain_cc, tuple(self.gesture_params.items())),
+            "[MIDIOutput.*]": self.output_ports,
+        }
+
+    def start_config_watcher(self):
+        """启动set.ini修改监视线程"""
+        if not self.hot_reload or self.reload_thread is not None:
+            return
+        self.reload_stop.clear()
+        self.reload_thread = threading.Thread(target=self.watch_settings, daemon=True)
+        self.reload_thread.start()
+
+    def stop_config_watcher(self):
+        self.reload_stop.set()
+        if self.reload_thread and self.reload_thread.is_alive():
+            self.reload_thread.join(timeout=2.0)
+        self.reload_thread = None
+
+    def load_reload_candidate(self):
+        """读取并校验修改后的set.ini，返回交给发送线程应用的新配置，有错误时返回None"""
+        try:
+            candidate = MIDISensorController(self.port, settings_only=True)
         except Exception as e:
-            print(f"读取配置文件出错: {e}，使用默认设置")
+            print(f"重新加载配置失败: {e}，保留当前配置")
+            return None
+        if candidate.config_errors:
+            for message in candidate.config_errors:
+                print(message)
+            print(f"新配置中有{len(candidate.config_errors)}处错误，保留当前配置")
+            return None
+
+        restart_settings = candidate.get_restart_settings()
+        changed = [name for name, value in restart_settings.items() if value != self.restart_settings[name]]
+        if self.shard_table is not None:
+            # 工作进程仍使用启动时的解析和滤波设置，发送端保持一致
+            for name in self.SHARD_WORKER_SETTINGS:
+                if getattr(candidate, name) != getattr(self, name):
+                    changed.append(name)
+                    setattr(candidate, name, getattr(self, name))
+        # 查找表在本线程中编译，发送线程应用时只需替换引用
+        candidate.curves = candidate.build_curves()
+        if changed:
+            print(f"以下设置需要重启后才能生效: {', '.join(changed)}")
+        return candidate
+
+    def watch_settings(self):
+        """轮询set.ini的修改时间；文件变化后在本线程中完成读取和校验，校验通过才交给发送线程应用"""
+        path = self.get_resource_path("set.ini")
+
+        def file_stamp():
+            try:
+                stat = os.stat(path)
+                return stat.st_mtime_ns, stat.st_size
+            except OSError:
+                return None
+
+        stamp = file_stamp()
+        while not self.reload_stop.wait(self.reload_interval):
+            current = file_stamp()
+            if current == stamp or current is None:
+                continue
+            stamp = current
+            print("\n检测到set.ini已修改，重新加载配置...")
+            candidate = self.load_reload_candidate()
+            if candidate is None:
+                continue
+            self.pending_config = candidate
+            # event模式或空闲时发送线程(协程)可能正在等待新数据，唤醒它尽快应用
+            if self.output_mode == "event" or self.idle:
+                self.wake_sender()
+
+    def apply_pending_config(self, allow_spin=True):
+        """在发送线程(或asyncio事件循环)中两个tick之间应用已校验的新配置，没有新配置时返回False
+
+        发送相关的设置在这里一次性替换，接收线程读取的设置和新的滤波器组交给接收线程在处理下一个数据包前换上。
+        映射发生变化的数据源会重新发送全部CC。
+        asyncio运行时不能忙等，allow_spin为False时忽略spin_us。
+        """
+        candidate = self.pending_config
+        self.pending_config = None
+        if candidate is None:
+            return False
+
+        for name in self.RELOADABLE_SETTINGS:
+            if name not in self.RECEIVER_SETTINGS:
+                setattr(self, name, getattr(candidate, name))
+        self.curves = candidate.curves
+        self.apply_rate_limit()
+        if self.scheduler:
+            spin_ns = self.spin_us * 1000 if allow_spin else 0
+            self.scheduler.configure(self.send_frequency, spin_ns, self.missed_tick_policy)
+
+        # 更新已有数据源的通道、映射和超时设置；配置文件中的数据源按名称对应，其余使用全局设置
+        configured = {source.name: source for source in candidate.configured_sources}
+        for source in self.sources:
+            new = configured.get(source.name) if source in self.configured_sources else None
+            if new is not None:
+                settings = (new.channel, new.cc1_mapping, new.cc11_mapping, new.cc_opt_mapping, new.cc_modes)
+                source.data_timeout = new.data_timeout
+            else:
+                settings = (source.channel, candidate.cc1_mapping, candidate.cc11_mapping, candidate.cc_opt_mapping,
+                            candidate.cc_modes)
+                source.data_timeout = self.data_timeout
+            if settings != (source.channel, source.cc1_mapping, source.cc11_mapping, source.cc_opt_mapping,
+                            source.cc_modes):
+                (source.channel, source.cc1_mapping, source.cc11_mapping, source.cc_opt_mapping,
+                 modes) = settings
+                source.cc_modes = list(modes)
+                source.reset_output()
+        self.nrpn_selected = {}
+
+        if self.shard_table is None:
+            self.pending_receiver_config = candidate
+        else:
+            # 分片模式下本进程不接收数据包，数据源由发送线程从共享内存中读取
+            self.apply_receiver_settings(candidate)
+        print("新配置已生效")
+        return True
+
+    def apply_receiver_settings(self, candidate):
+        """换上新配置中接收线程读取的设置"""
+        for name in self.RECEIVER_SETTINGS:
+            setattr(self, name, getattr(candidate, name))
+
+    def swap_receiver_config(self):
+        """接收线程：处理数据包之前一起换上接收线程读取的设置和新的滤波器组，沿用原有的滤波状态，避免输出跳变"""
+        candidate = self.pending_receiver_config
+        self.pending_receiver_config = None
+        self.apply_receiver_settings(candidate)
+        filter_bank = self.build_filter_bank()
+        filter_bank.copy_state_from(self.filter_bank)
+        self.filter_bank = filter_bank
+
+    def wait_for_enter(self):
+        """出错时等待用户确认，headless模式下直接返回"""
+        if not self.headless:
+            input("\n按Enter键继续...")
+
+    @staticmethod
+    def match_port(name, available_ports):
+        """按名称选择端口：先精确匹配，再作为正则表达式(不区分大小写)搜索，都不匹配时返回None"""
+        if name in available_ports:
+            return name
+        try:
+            pattern = re.compile(name, re.IGNORECASE)
+        except re.error as e:
+            print(f"'{name}' 不是有效的正则表达式: {e}")
+            return None
+        for port in available_ports:
+            if pattern.search(port):
+                return port
+        return None
 
     def list_and_select_port(self):
         """
         列出所有可用的MIDI输出端口并让用户选择
+
+        设置了midi_port时按名称或正则表达式直接选择；headless模式下不等待键盘输入，
+        没有设置midi_port时使用第一个端口。
         """
         # 获取所有可用的MIDI输出端口
-        available_ports = mido.get_output_names()
+        available_ports = import_mido().get_output_names()
         
         # 自动过滤掉"Microsoft GS Wavetable Synth"端口
         filtered_ports = [port for port in available_ports if "Microsoft GS Wavetable Synth" not in port]
@@ -259,9 +2478,18 @@ class MIDISensorController:
             print("2. 检查设备驱动程序是否已正确安装")
             print("3. 尝试重新插拔MIDI设备")
             print("4. 以管理员权限运行此程序")
-            input("\n按Enter键继续...")
+            self.wait_for_enter()
             return None
 
+        # 按配置或命令行指定的端口选择，被过滤的端口也可以指定
+        if self.midi_port:
+            port = self.match_port(self.midi_port, filtered_ports) or self.match_port(self.midi_port, available_ports)
+            if port is None:
+                print(f"错误：没有与 '{self.midi_port}' 匹配的MIDI输出端口，可用端口: {', '.join(available_ports)}")
+                return None
+            print(f"按midi_port选择端口: {port}")
+            return port
+
         # 特殊情况：只有Microsoft GS Wavetable Synth端口
         if not filtered_ports and available_ports:
             synth_ports = [port for port in available_ports if "Microsoft GS Wavetable Synth" in port]
@@ -280,6 +2508,10 @@ class MIDISensorController:
             print(f"\n只有一个可用端口，自动选择: {filtered_ports[0]}")
             return filtered_ports[0]
 
+        if self.headless:
+            print(f"\nheadless模式，自动选择第一个端口: {filtered_ports[0]}")
+            return filtered_ports[0]
+
         # 让用户选择端口
         while True:
             try:
@@ -312,6 +2544,16 @@ class MIDISensorController:
 
     def initialize_midi(self):
         """初始化MIDI系统并列出可用设备"""
+        # 内存输出也要用mido生成消息
+        import_mido()
+        if self.output_ports:
+            return self.open_output_ports()
+        if self.null_midi:
+            self.midi_output = MemoryMidiOutput()
+            print("\n使用内存MIDI输出(不连接任何MIDI设备)")
+            self.mark_startup("MIDI初始化")
+            return True
+
         port_name = self.list_and_select_port()
 
         if port_name is None:
@@ -327,226 +2569,1220 @@ class MIDISensorController:
             print("2. 检查设备是否被其他程序占用")
             print("3. 以管理员权限运行此程序")
             print("4. 检查设备驱动程序是否正确安装")
-            input("\n按Enter键继续...")
+            self.wait_for_enter()
             return False
 
+        self.mark_startup("MIDI初始化")
         return True
 
+    def apply_rate_limit(self):
+        """按max_messages_per_second限制端口消息速率；多端口输出时每个端口有自己的令牌桶，发送端不再统一限制"""
+        if isinstance(self.midi_output, MidiFanout):
+            self.output_budget.set_rate(0)
+            self.midi_output.set_rate(self.max_messages_per_second)
+        else:
+            self.output_budget.set_rate(self.max_messages_per_second)
+
+    def open_output_ports(self):
+        """打开[MIDIOutput.*]中配置的全部端口，每个端口由独立的写线程发送"""
+        available_ports = [] if self.null_midi else mido.get_output_names()
+        writers = []
+        for output in self.output_ports:
+            if self.null_midi:
+                port_name, port = "内存", MemoryMidiOutput()
+            else:
+                port_name = self.match_port(output.port, available_ports)
+                if port_name is None:
+                    print(f"错误：MIDI输出 {output.name} 没有与 '{output.port}' 匹配的端口，"
+                          f"可用端口: {', '.join(available_ports)}")
+                    break
+                try:
+                    port = mido.open_output(port_name)
+                except Exception as e:
+                    print(f"无法打开MIDI端口 {port_name}: {e}")
+                    break
+            writers.append(MidiPortWriter(output.name, port, output.channel, output.cc_map, output.queue_size))
+            print(f"MIDI输出 {output.name}: {port_name}")
+        else:
+            self.midi_output = MidiFanout(writers, [output.rate for output in self.output_ports])
+            self.apply_rate_limit()
+            self.midi_output.start()
+            self.mark_startup("MIDI初始化")
+            return True
+
+        for writer in writers:
+            writer.close()
+        self.wait_for_enter()
+        return False
+
     def map_value(self, value, in_min, in_max, out_min, out_max):
         """将值从一个范围映射到另一个范围"""
         return (value - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
 
-    def process_cc1_data(self, new_value):
-        """处理cc1数据，检测极大值点"""
-        # 限制cc1范围在0-cc1_max之间
-        if new_value > self.cc1_max:
-            new_value = self.cc1_max
+    def check_data_timeout(self, source, now_ns):
+        """检查数据源是否超时，并在状态切换时打印提示，返回是否处于超时状态"""
+        if now_ns - source.last_packet_ns > source.data_timeout * 1_000_000_000:
+            if not source.is_data_timeout:  # 刚进入超时状态
+                source.is_data_timeout = True
+                source.timeout_reported = True
+                # 只在进入超时状态时打印一次提示
+                print(f"检测到数据源 {source.name} 数据超时，暂停发送MIDI控制信号")
+        else:
+            if source.is_data_timeout:  # 刚退出超时状态
+                source.is_data_timeout = False
+                # 只在之前确实超时过时打印一次提示，新数据源的第一个数据包不算恢复
+                if source.timeout_reported:
+                    source.timeout_reported = False
+                    print(f"数据源 {source.name} 恢复数据接收，继续发送MIDI控制信号")
+        return source.is_data_timeout
+
+    def build_cc_messages(self, source, index, control, value):
+        """按映射的输出方式生成一次发送所需的消息
+
+        14位CC和NRPN先发MSB再发LSB；与上次发送值的MSB相同时只发LSB，
+        这样分辨率提高到14位，而大部分时候消息数与7位CC相同。
+        NRPN参数号已在各端口实际使用的通道上选中时不再重复发送99/98。
+        多端口输出时某组消息因队列已满被丢弃后，由forget_dropped()让下一次重新完整发送。
+        """
+        channel = source.channel
+        mode = source.cc_modes[index]
+        if mode == "cc7":
+            return [mido.Message('control_change', channel=channel, control=control, value=value)]
+
+        msb = value >> 7
+        lsb = value & 0x7F
+        last_value = source.cc_sent[index]
+        # 保活重发(值未变化)时完整发送MSB和LSB
+        lsb_only = last_value is not None and last_value != value and last_value >> 7 == msb
+        if mode == "cc14":
+            messages = []
+            if not lsb_only:
+                messages.append(mido.Message('control_change', channel=channel, control=control, value=msb))
+            messages.append(mido.Message('control_change', channel=channel, control=control + 32, value=lsb))
+            return messages
+
+        messages = []
+        if any(self.nrpn_selected.get(target) != control for target in self.nrpn_targets(channel)):
+            messages.append(mido.Message('control_change', channel=channel, control=99, value=control >> 7))
+            messages.append(mido.Message('control_change', channel=channel, control=98, value=control & 0x7F))
+            lsb_only = False
+        if not lsb_only:
+            messages.append(mido.Message('control_change', channel=channel, control=6, value=msb))
+        messages.append(mido.Message('control_change', channel=channel, control=38, value=lsb))
+        return messages
+
+    def nrpn_targets(self, channel):
+        """数据源通道对应的各端口上的通道，NRPN参数号按端口实际使用的通道记录"""
+        output_channels = getattr(self.midi_output, "output_channels", None)
+        return output_channels(channel) if output_channels is not None else ((0, channel),)
+
+    def send_cc(self, source, index, control, messages, now_ns, frame):
+        """连续发送一次输出的全部消息，并记录发送时间与frame对应数据包从收包到发送的延迟"""
+        output = self.midi_output
+        send_group = getattr(output, "send_group", None)
+        dropped = None
+        if send_group is not None:
+            # 多端口输出：放入各端口的队列，同一CC未发出的旧值会被覆盖
+            dropped = send_group((source.channel, control), messages)
+        else:
+            send = output.send
+            for msg in messages:
+                send(msg)
+        source.cc_last_send_ns[index] = now_ns
+        if source.cc_modes[index] == "nrpn":
+            for target in self.nrpn_targets(source.channel):
+                self.nrpn_selected[target] = control
+        if dropped:
+            self.forget_dropped(dropped)
+
+        # 每个数据包只统计一次收包到发送的延迟
+        _, packet_ns, filtered_ns = frame
+        if packet_ns != source.latency_packet_ns and self.metrics_enabled:
+            source.latency_packet_ns = packet_ns
+            sent_ns = time.perf_counter_ns()
+            self.metrics.total.record((sent_ns - packet_ns) // 1000)
+            self.metrics.output.record((sent_ns - filtered_ns) // 1000)
+
+    def coalesce_cc(self, source, index, control, value, now_ns, min_interval_ns, frame):
+        """输出合并：决定一个CC的目标值现在是否需要发送
+
+        与上次发送值相差达到min_delta(方向反转时再加hysteresis)才立即发送，14位输出时以hires_step为单位；
+        低于阈值的变化在目标值稳定settle_ms后补发，保证最终值一定到达；
+        值不变时每keepalive_ms重发一次；同时受min_interval_ns和端口消息速率上限约束。
+        返回下一次需要再检查的时间点(ns)，没有待发送内容时返回None。
+        """
+        if value != source.cc_target[index]:
+            source.cc_target[index] = value
+            source.cc_target_ns[index] = now_ns
+
+        last_value = source.cc_sent[index]
+        last_send_ns = source.cc_last_send_ns[index]
+        keepalive = False
+        if last_value is None:
+            delta = 0
+        else:
+            delta = value - last_value
+            step = 1 if source.cc_modes[index] == "cc7" else self.hires_step
+            if delta == 0:
+                if not self.keepalive_ms:
+                    return None
+                keepalive_ns = last_send_ns + self.keepalive_ms * 1_000_000
+                if now_ns < keepalive_ns:
+                    return keepalive_ns
+                keepalive = True
+            else:
+                threshold = self.min_delta * step
+                direction = source.cc_direction[index]
+                if direction and (delta > 0) != (direction > 0):
+                    threshold += self.hysteresis * step
+                if abs(delta) < threshold:
+                    settle_ns = source.cc_target_ns[index] + self.settle_ms * 1_000_000
+                    if now_ns < settle_ns:
+                        self.cc_suppressed += 1
+                        return settle_ns
+
+        due_ns = last_send_ns + min_interval_ns
+        if now_ns < due_ns:
+            return due_ns
+        messages = self.build_cc_messages(source, index, control, value)
+        budget = self.output_budget
+        if not budget.take(now_ns, len(messages)):
+            return budget.next_token_ns(now_ns, len(messages))
+
+        self.send_cc(source, index, control, messages, now_ns, frame)
+        source.cc_sent[index] = value
+        if delta:
+            source.cc_direction[index] = delta
+        if keepalive:
+            self.cc_keepalives += 1
+        return None
+
+    def forget_dropped(self, keys):
+        """端口队列已满时丢弃了这些(通道, 控制器号)的CC组：设备上的MSB和NRPN参数号不再可信，下一次完整发送"""
+        for channel, control in keys:
+            for source in self.sources:
+                if source.channel != channel:
+                    continue
+                for index, mapping in enumerate((source.cc1_mapping, source.cc11_mapping, source.cc_opt_mapping)):
+                    if mapping == control:
+                        source.cc_sent[index] = None
+            for target in self.nrpn_targets(channel):
+                self.nrpn_selected.pop(target, None)
+
+    def emit_midi(self, source, now_ns, min_interval_ns=0):
+        """根据数据源当前的滤波结果发送一轮MIDI控制信号
+
+        min_interval_ns为同一个CC两条消息之间的最小间隔。
+        返回下一次需要再调用的时间点(ns)：某个CC被推迟、暂缓或等待保活重发；
+        没有待发送内容时返回None。
+        """
+        # 只读取一次frame，本轮发送的所有CC都来自同一个数据包
+        frame = source.frame
+        if not self.midi_output or frame is None:
+            return None
 
-        # 指数平滑滤波，使用CC1专用的aef参数
-        new_st = self.aef_cc1 * self.last_cc1 + (1 - self.aef_cc1) * self.last_st
+        next_due_ns = None
+        filtered = frame[0]
+        mappings = (source.cc1_mapping, source.cc11_mapping, source.cc_opt_mapping)
+        modes = source.cc_modes
+        curves = self.curves  # 只读取一次，配置热更新时整体替换
+        targets = []
 
-        # 更新平滑后的值
-        self.last_cc1 = new_value
-        self.last_st = new_st
+        # 通过响应曲线查找表映射到0-127(14位输出时为0-16383)
+        for index, enabled in enumerate((self.cc1_enabled, self.cc11_enabled, self.cc_opt_enabled)):
+            if enabled:
+                curve = curves[index][0] if modes[index] == "cc7" else self.hires_curve(curves, index)
+                targets.append((index, mappings[index], curve.lookup(filtered[index])))
 
-    def process_cc11_data(self, new_value):
-        """处理cc11数据，应用指数平滑滤波"""
-        # 限制cc11范围在0-90之间
-        new_value = max(0, min(90, new_value))
+        for index, control, value in targets:
+            due_ns = self.coalesce_cc(source, index, control, value, now_ns, min_interval_ns, frame)
+            if due_ns is not None:
+                next_due_ns = due_ns if next_due_ns is None else min(next_due_ns, due_ns)
 
-        # 指数平滑滤波，使用CC11专用的aef参数
-        new_st_cc11 = self.aef_cc11 * self.last_cc11 + (1 - self.aef_cc11) * self.last_st_cc11
+        return next_due_ns
 
-        # 更新平滑后的值
-        self.last_cc11 = new_value
-        self.last_st_cc11 = new_st_cc11
+    def emit_gestures(self, source, events=None):
+        """发送数据源的手势事件：峰值为音符(或单次CC)按下，结束为松开，持续晃动为sustain_cc的127/0
+
+        手势事件不参与输出合并和端口速率限制，每个事件都必须到达。
+        """
+        if not self.midi_output:
+            source.gesture_events.clear()
+            return
+        if events is None:
+            queue = source.gesture_events
+            events = [queue.popleft() for _ in range(len(queue))]
+        channel = source.channel
+        messages = []
+        for kind, value in events:
+            if kind == "sustain":
+                if bool(value) == source.gesture_sustain or not self.gesture_sustain_cc:
+                    continue
+                source.gesture_sustain = bool(value)
+                messages.append(mido.Message('control_change', channel=channel, control=self.gesture_sustain_cc,
+                                             value=127 if value else 0))
+                continue
+            if kind == "release":
+                if not source.gesture_velocity:
+                    continue
+                source.gesture_velocity = 0
+            else:
+                if source.gesture_velocity:
+                    # 上一个音符还没有松开(例如结束事件在数据中断时丢失)，先松开
+                    messages.append(self.gesture_message(channel, 0))
+                source.gesture_velocity = value
+            messages.append(self.gesture_message(channel, value))
+        if messages:
+            self.send_events(messages)
+
+    def gesture_message(self, channel, velocity):
+        """力度为0时生成松开的消息"""
+        if self.gesture_output == "cc":
+            return mido.Message('control_change', channel=channel, control=self.gesture_cc, value=velocity)
+        if velocity:
+            return mido.Message('note_on', channel=channel, note=self.gesture_note, velocity=velocity)
+        return mido.Message('note_off', channel=channel, note=self.gesture_note)
+
+    def send_events(self, messages):
+        """发送不可合并、不可丢弃的事件消息(音符、单次CC)"""
+        output = self.midi_output
+        send_events = getattr(output, "send_events", None)
+        if send_events is not None:
+            send_events(messages)
+        else:
+            for msg in messages:
+                output.send(msg)
+        self.gesture_events_sent += len(messages)
+
+    def format_output_stats(self):
+        """返回输出合并的统计文本"""
+        budget = self.output_budget
+        stats = (f"MIDI输出: 发送{budget.sent}条, 保活重发{self.cc_keepalives}条, "
+                 f"低于阈值暂缓{self.cc_suppressed}次, 超出端口速率上限推迟{budget.deferred}次")
+        if self.gestures_enabled:
+            stats += f", 手势事件{self.gesture_events_sent}条"
+        if isinstance(self.midi_output, MidiFanout):
+            stats += "\n" + self.midi_output.format_stats()
+        return stats
+
+    def emit_sources(self, now_ns, min_interval_ns=0, followup_ns=0):
+        """对所有未超时的数据源发送一轮MIDI控制信号
+
+        返回最早需要再次发送的时间点(ns)，后续发送至少间隔followup_ns；没有待发送内容时返回None。
+        端口消息速率受限时每轮从不同的数据源开始，避免排在前面的手机占满额度。
+        """
+        next_due_ns = None
+        sources = self.sources
+        # 只在上一轮有消息被推迟时轮换，额度不再紧张后按原顺序发送
+        deferred = self.output_budget.deferred
+        if deferred != self.emit_deferred and len(sources) > 1:
+            self.emit_offset = (self.emit_offset + 1) % len(sources)
+            sources = sources[self.emit_offset:] + sources[:self.emit_offset]
+        self.emit_deferred = deferred
+        for source in sources:
+            if source.gesture_events:
+                self.emit_gestures(source)
+            # 只有在非超时状态下才发送MIDI信号
+            if self.check_data_timeout(source, now_ns):
+                if source.gesture_velocity or source.gesture_sustain:
+                    # 数据中断时松开仍按下的音符和持续晃动CC
+                    self.emit_gestures(source, [("release", 0), ("sustain", 0)])
+                continue
+            # 发送到MIDI端口的cc1、cc11和cc_opt控制器（根据开关状态）
+            due_ns = self.emit_midi(source, now_ns, min_interval_ns)
+            if due_ns is not None:
+                due_ns = max(due_ns, now_ns + followup_ns)
+                next_due_ns = due_ns if next_due_ns is None else min(next_due_ns, due_ns)
+        return next_due_ns
 
     def send_midi_data(self):
         """以指定频率发送MIDI控制信号"""
         # 初始化上一次发送的值
-        last_cc1_value = None
-        last_cc11_value = None
-        last_cc_opt_value = None
-        
+        for source in self.sources:
+            source.reset_output()
+
+        # 按绝对截止时间调度，处理耗时不会拖慢实际发送频率
+        self.scheduler = DeadlineScheduler(self.send_frequency, self.spin_us * 1000, self.missed_tick_policy)
+        self.scheduler.reset()
+
         while self.running:
             try:
-                # 检查是否超时
-                current_time = time.time()
-                if current_time - self.last_data_time > self.data_timeout:
-                    if not self.is_data_timeout:  # 刚进入超时状态
-                        self.is_data_timeout = True
-                        # 只在进入超时状态时打印一次提示
-                        print("检测到数据超时，暂停发送MIDI控制信号")
-                else:
-                    if self.is_data_timeout:  # 刚退出超时状态
-                        self.is_data_timeout = False
-                        # 只在退出超时状态时打印一次提示
-                        print("恢复数据接收，继续发送MIDI控制信号")
-
-                # 只有在非超时状态下才发送MIDI信号
-                if not self.is_data_timeout:
-                    # 发送到MIDI端口的cc1、cc11和cc_opt控制器（根据开关状态）
-                    if self.midi_output:
-                        # 发送CC1控制器消息（如果启用）
-                        if self.cc1_enabled:
-                            # 将cc1映射到0-127范围
-                            cc1_midi = round(self.map_value(self.last_st, 0, self.cc1_max, 0, 127))
-                            # 限制在有效范围内
-                            cc1_midi = max(0, min(127, cc1_midi))
-                            
-                            # 实现更平滑的输出：使用上一次值和当前值的平均值
-                            if last_cc1_value is not None:
-                                smoothed_cc1 = (last_cc1_value + cc1_midi) // 2
-                            else:
-                                smoothed_cc1 = cc1_midi
-                            
-                            # 只有在值发生变化时才发送MIDI消息
-                            if last_cc1_value != smoothed_cc1:
-                                cc1_msg = mido.Message('control_change', control=self.cc1_mapping, value=smoothed_cc1)
-                                self.midi_output.send(cc1_msg)
-                                last_cc1_value = smoothed_cc1
-
-                        # 发送CC11控制器消息（如果启用）
-                        if self.cc11_enabled:
-                            # 将cc11映射到0-127范围
-                            cc11_midi = round(self.map_value(self.last_st_cc11, 0, 90, 0, 127))
-                            # 限制在有效范围内
-                            cc11_midi = max(0, min(127, cc11_midi))
-                            
-                            # 实现更平滑的输出：使用上一次值和当前值的平均值
-                            if last_cc11_value is not None:
-                                smoothed_cc11 = (last_cc11_value + cc11_midi) // 2
-                            else:
-                                smoothed_cc11 = cc11_midi
-                            
-                            # 只有在值发生变化时才发送MIDI消息
-                            if last_cc11_value != smoothed_cc11:
-                                cc11_msg = mido.Message('control_change', control=self.cc11_mapping, value=smoothed_cc11)
-                                self.midi_output.send(cc11_msg)
-                                last_cc11_value = smoothed_cc11
-
-                        # 发送cc_opt控制器消息（如果启用）
-                        if self.cc_opt_enabled:
-                            # 将cc_opt映射到0-127范围
-                            cc_opt_midi = round(self.map_value(self.cc_opt_value, 0, 90, 0, 127))
-                            # 限制在有效范围内
-                            cc_opt_midi = max(0, min(127, cc_opt_midi))
-                            cc_opt_msg = mido.Message('control_change', control=self.cc_opt_mapping, value=cc_opt_midi)
-                            self.midi_output.send(cc_opt_msg)
-
-                # 根据发送频率计算睡眠时间
-                sleep_time = 1.0 / self.send_frequency
-                time.sleep(sleep_time)
+                self.send_wakeups += 1
+                self.apply_pending_config()
+                if self.shard_table is not None:
+                    self.poll_shards()
+                now_ns = time.perf_counter_ns()
+                self.emit_sources(now_ns)
+
+                # 所有数据源都已超时时不再按节拍空转，等到收到数据包再恢复
+                # (分片模式的数据在共享内存中，需要按节拍读取)
+                if self.idle_mode and self.shard_table is None and self.wait_while_idle(now_ns):
+                    self.scheduler.resume()
+                    continue
+
+                # 等待下一个节拍点
+                self.scheduler.wait()
             except Exception as e:
                 if self.running:  # 只在运行时打印错误
                     print(f"MIDI发送错误: {e}")
 
-    def listen_for_data(self):
-        """监听UDP端口数据"""
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.bind(('0.0.0.0', self.port))
-        print(f"监听端口 {self.port}")
+    def send_midi_on_arrival(self):
+        """事件驱动模式：监听线程更新滤波结果后立即唤醒并发送MIDI控制信号"""
+        for source in self.sources:
+            source.reset_output()
+        min_interval_ns = int(self.min_cc_interval_ms * 1_000_000)
+        # 被暂缓或推迟的CC按发送频率的节拍重新检查，避免空转
+        followup_ns = int(1_000_000_000 / self.send_frequency)
+        next_due_ns = None
+        now_ns = time.perf_counter_ns()
 
         while self.running:
             try:
-                # 设置socket超时，以便能够响应running状态的变化
-                self.sock.settimeout(1.0)
-                data, addr = self.sock.recvfrom(1024)
-                message = data.decode('utf-8').strip()
-
-                # 更新最后接收数据时间
-                self.last_data_time = time.time()
-
-                # 解析数据 "cc1 cc11 cc_opt"
-                parts = message.split(' ')
-                if len(parts) >= 1:
-                    # 根据启用状态处理和显示数据
-                    display_parts = []
-
-                    # 处理cc1数据（如果启用）
-                    if self.cc1_enabled and len(parts) >= 1:
-                        cc1 = float(parts[0])
-                        # 根据配置决定是否进行平滑处理
-                        if self.cc1_smooth:
-                            # 处理cc1数据
-                            self.process_cc1_data(cc1)
-                        else:
-                            # 不进行平滑处理，直接使用原始值
-                            self.last_st = cc1
-                            self.last_cc1 = cc1
-                        display_parts.append(f"cc1={cc1:.1f}")
-
-                    # 更新cc11数据（如果启用）
-                    if self.cc11_enabled and len(parts) >= 2:
-                        cc11 = float(parts[1])
-                        # 根据配置决定是否进行平滑处理
-                        if self.cc11_smooth:
-                            # 处理cc11数据
-                            self.process_cc11_data(cc11)
-                        else:
-                            # 不进行平滑处理，直接使用原始值
-                            self.last_st_cc11 = cc11
-                            self.last_cc11 = cc11
-                        display_parts.append(f"cc11={cc11:.1f}")
-
-                    # 处理cc_opt数据（如果启用）
-                    if self.cc_opt_enabled and len(parts) >= 3:
-                        cc_opt = float(parts[2])
-                        self.cc_opt_value = cc_opt
-                        display_parts.append(f"cc_opt={cc_opt:.1f}")
-
-                    # 根据参数控制是否打印接收到的数据信息
-                    # para_monitor_display支持三种模式: graphic(图形化显示), text(文本显示), false(不显示)
-                    if self.para_monitor_display != "false" and not self.is_data_timeout and display_parts:
-                        if self.para_monitor_display == "graphic":
-                            # 图形化显示模式
-                            cc1_val = float(parts[0]) if len(parts) >= 1 and self.cc1_enabled else 0
-                            cc11_val = float(parts[1]) if len(parts) >= 2 and self.cc11_enabled else 0
-                            if cc1_val > cc11_val:
-                                print(" "*int(cc11_val)+"||"+" "*int(cc1_val-cc11_val)+"@")
-                            else:
-                                print(" "*int(cc1_val)+"@"+" "*int(cc11_val-cc1_val)+"||")
-                        else:
-                            # 文本显示模式（默认）
-                            print("接收到数据: " + ", ".join(display_parts))
-                else:
-                    # 即使关闭了参数监控显示，也显示无效数据格式的错误信息
-                    if self.para_monitor_display:
-                        print(f"无效数据格式: {message}")
+                # 没有新数据时等待唤醒；有被推迟的CC时只等到它的发送时间点
+                wait_timeout = self.event_wait_timeout(next_due_ns, now_ns)
+                with self.data_cond:
+                    if not self.data_pending and self.running:
+                        if wait_timeout is None:
+                            self.idle = True
+                            self.idle_entries += 1
+                        self.data_cond.wait(wait_timeout)
+                        self.idle = False
+                    self.data_pending = False
+                self.send_wakeups += 1
+
+                if self.apply_pending_config():
+                    min_interval_ns = int(self.min_cc_interval_ms * 1_000_000)
+                    followup_ns = int(1_000_000_000 / self.send_frequency)
+                now_ns = time.perf_counter_ns()
+                next_due_ns = self.emit_sources(now_ns, min_interval_ns, followup_ns)
+            except Exception as e:
+                if self.running:  # 只在运行时打印错误
+                    print(f"MIDI发送错误: {e}")
+
+    def next_timeout_ns(self, now_ns):
+        """超时看门狗：返回最早一个数据源进入超时状态的时间点(ns)，所有数据源都已超时时返回None
+
+        已经过了超时时间、但发送线程还没有把它标记为超时(没有打印提示、没有松开音符)的数据源返回now_ns，
+        需要再发送一轮。
+        """
+        next_ns = None
+        for source in self.sources:
+            deadline_ns = source.last_packet_ns + int(source.data_timeout * 1_000_000_000) + 1
+            if deadline_ns <= now_ns:
+                if source.is_data_timeout:
+                    continue
+                deadline_ns = now_ns
+            if next_ns is None or deadline_ns < next_ns:
+                next_ns = deadline_ns
+        return next_ns
+
+    def event_wait_timeout(self, next_due_ns, now_ns):
+        """event模式下发送线程的等待时间(秒)：等到被推迟的CC或最早的数据源超时，None表示一直等到收到数据
+
+        now_ns为上一轮发送使用的时间，超时判断与这一轮发送看到的状态一致。
+        """
+        if self.idle_mode:
+            timeout_ns = self.next_timeout_ns(now_ns)
+            if next_due_ns is None or (timeout_ns is not None and timeout_ns < next_due_ns):
+                next_due_ns = timeout_ns
+            if next_due_ns is None:
+                return None
+        elif next_due_ns is None:
+            return self.data_timeout
+        return max(0, next_due_ns - now_ns) / 1_000_000_000
+
+    def wait_while_idle(self, now_ns):
+        """polled模式：所有数据源都已超时时阻塞到收到数据包、配置修改或stop()，返回是否进行了等待
 
-            except socket.timeout:
-                # socket超时，继续检查running状态
+        now_ns为刚结束的一轮发送使用的时间，超时判断与这一轮发送看到的状态一致。
+        """
+        with self.data_cond:
+            # 先设置idle再检查各数据源的收包时间，与接收线程先更新收包时间再检查idle的顺序相反，
+            # 因此不会出现刚收到数据包却没有被唤醒的情况
+            self.idle = True
+            try:
+                if (self.data_pending or not self.running or self.pending_config is not None
+                        or self.next_timeout_ns(now_ns) is not None):
+                    return False
+                self.idle_entries += 1
+                while not self.data_pending and self.running:
+                    self.data_cond.wait()
+                return True
+            finally:
+                self.idle = False
+                self.data_pending = False
+
+    def format_wakeup_stats(self, advance=False):
+        """返回接收和发送线程每秒唤醒次数的文本，advance为True时以本次为下一段统计的起点"""
+        now_ns = time.perf_counter_ns()
+        start_ns, listen_start, send_start = self.wakeup_snapshot
+        if advance:
+            self.wakeup_snapshot = (now_ns, self.listen_wakeups, self.send_wakeups)
+        seconds = max(1e-9, (now_ns - start_ns) / 1_000_000_000)
+        return (f"唤醒次数: 接收{(self.listen_wakeups - listen_start) / seconds:.1f}次/秒, "
+                f"发送{(self.send_wakeups - send_start) / seconds:.1f}次/秒, 进入空闲{self.idle_entries}次"
+                f"{', 当前空闲' if self.idle else ''}")
+
+    def wake_sender(self):
+        """从其他线程唤醒正在等待的发送线程或asyncio发送协程(stop()、配置热更新)"""
+        loop, event = self.async_loop, self.async_data_event
+        if loop is not None and event is not None:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # 事件循环已经结束
+            return
+        with self.data_cond:
+            self.data_pending = True
+            self.data_cond.notify_all()
+
+    def notify_sender(self):
+        """通知事件驱动模式下的发送线程（或asyncio发送协程）有新的滤波结果"""
+        if self.async_data_event is not None:
+            self.async_data_event.set()
+            return
+        with self.data_cond:
+            self.data_pending = True
+            self.data_cond.notify()
+
+    def handle_samples(self, samples, detect_gestures=True):
+        """将一批 (数据源, 各通道值) 送入滤波器组，缺失的通道值为None
+
+        同一批中每个数据源最多出现一次，多个数据源时只需一次向量化计算。
+        detect_gestures为False表示调用方已经对每个样本做过手势检测。
+        """
+        filter_bank = self.filter_bank
+
+        if len(samples) == 1:
+            source, values = samples[0]
+            filter_bank.update(source.row, values, self.sample_time(source))
+        else:
+            filter_bank.update_rows([source.row for source, _ in samples],
+                                    [values for _, values in samples],
+                                    [self.sample_time(source) for source, _ in samples])
+
+        # 为每个数据源发布新的不可变状态，发送线程通过一次引用读取拿到完整的一帧
+        filtered_ns = time.perf_counter_ns()
+        monitor = self.monitor
+        for source, values in samples:
+            if self.gestures_enabled and detect_gestures:
+                self.detect_gestures(source, values[0])
+            frame = source.frame = SensorFrame(tuple(filter_bank.values(source.row)), source.last_packet_ns, filtered_ns)
+            if self.shard_table is not None:
+                self.shard_table.publish(source.row, source.address, source.packets, frame)
+            if self.metrics_enabled:
+                self.metrics.filter.record((filtered_ns - source.last_packet_ns) // 1000)
+            if monitor is not None:
+                # 只保存最新的数据，由监控线程按固定帧率显示
+                source.monitor_values = values
+                monitor.version += 1
+
+        # event模式下立即唤醒发送线程；空闲等待中的发送线程收到数据后恢复按节拍发送
+        if self.output_mode == "event" or self.idle:
+            self.notify_sender()
+
+    def detect_gestures(self, source, value):
+        """在接收线程中对cc1原始值做手势检测，事件交给发送线程发送"""
+        detector = source.gesture
+        if detector is None:
+            detector = source.gesture = GestureDetector(full_scale=self.cc1_max, **self.gesture_params)
+        events = detector.update(value, self.sample_time(source))
+        if events:
+            source.gesture_events.extend(events)
+
+    @staticmethod
+    def sample_time(source):
+        """数据包的时间(秒)：二进制格式使用手机端的发送时间戳，不受网络抖动影响；文本格式使用接收时间"""
+        if source.last_sender_ts is not None:
+            return source.last_sender_ts / 1_000_000
+        return source.last_packet_ns / 1_000_000_000
+
+    def start_monitor(self):
+        """按para_monitor_display启动参数监控显示线程"""
+        # para_monitor_display支持三种模式: graphic(图形化显示), text(文本显示), false(不显示)
+        if self.para_monitor_display == "false" or self.monitor is not None:
+            return
+        mode = "graphic" if self.para_monitor_display == "graphic" else "text"
+        self.monitor = ConsoleMonitor(self, mode, self.monitor_fps)
+        self.monitor.start()
+
+    def stop_monitor(self):
+        if self.monitor is not None:
+            self.monitor.stop()
+            self.monitor = None
+
+    def open_socket(self, reuse_port=False):
+        """创建UDP socket并一次性设置好选项，同时建立用于stop()唤醒监听线程的socket对
+
+        reuse_port为True时设置SO_REUSEPORT，多个分片工作进程可以监听同一端口，
+        由内核按发送端地址把每台手机的数据包固定分给其中一个进程。
+        """
+        try:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            # 加大接收缓冲区，多台手机同时突发发送时不易丢包
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+            if reuse_port:
+                self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self.sock.bind(('0.0.0.0', self.port))
+            self.sock.setblocking(False)
+        except OSError as e:
+            print(f"无法监听端口 {self.port}: {e}")
+            if self.sock:
+                self.sock.close()
+                self.sock = None
+            return False
+
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+        self.selector.register(self.wakeup_recv, selectors.EVENT_READ)
+        print(f"监听端口 {self.port}")
+        return True
+
+    def decode_packet(self, packet, addr, now_ns):
+        """查找数据包对应的数据源并解析，返回 (source, 各通道值)，数据包应被丢弃时返回None
+
+        now_ns为数据包的接收时间(perf_counter_ns)，回放时为抓包文件中记录的时间。
+        """
+        if self.pending_receiver_config is not None:
+            self.swap_receiver_config()
+
+        # 抓包模式下先原样保存数据报
+        if self.capture:
+            self.capture.write(now_ns, addr, packet)
+
+        # 按发送端IP查找数据源，同一台手机重新建立socket后端口会变化，因此不使用端口区分
+        source = self.source_by_addr.get(addr[0])
+        if source is None:
+            source = self.add_unknown_source(addr[0])
+        if not source:
+            return None
+
+        # 按首字节区分二进制格式与文本格式 "cc1 cc11 cc_opt"
+        packet_format = "binary" if len(packet) and packet[0] == PACKET_MAGIC else "text"
+        if packet_format != source.packet_format:
+            if source.allowed_format != "auto" and source.allowed_format != packet_format:
+                return None
+            source.packet_format = packet_format
+            print(f"数据源 {source.name} 使用{'二进制' if packet_format == 'binary' else '文本'}数据格式")
+
+        try:
+            if packet_format == "binary" and len(packet) > 1 and packet[1] == IMU_PACKET_VERSION:
+                seq, sender_ts, proximity, count = parse_imu_packet(packet)
+                cc1, cc11, cc_opt = self.imu_values(packet, count, proximity)
+            elif packet_format == "binary":
+                seq, sender_ts, cc1, cc11, cc_opt = parse_binary_packet(packet)
+            else:
+                seq, sender_ts, cc1, cc11, cc_opt = parse_text_packet(packet)
+        except (ValueError, UnicodeDecodeError) as e:
+            # 即使关闭了参数监控显示，也显示无效数据格式的错误信息
+            print(f"无效数据格式: {e}")
+            return None
+
+        # 更新最后接收数据时间
+        source.last_packet_ns = now_ns
+        source.packets += 1
+        if seq is not None:
+            if self.jitter_buffer_ms:
+                # 放入抖动缓冲，由play_jitter_buffers()按播放时间送入处理流程；丢包/乱序/重复只由抖动缓冲统计
+                self.record_network_delay(source, sender_ts, now_ns)
+                if source.jitter is None:
+                    source.jitter = JitterBuffer(self.jitter_buffer_ms, self.jitter_buffer_max_ms)
+                source.jitter.push(seq, sender_ts, (cc1, cc11, cc_opt), now_ns)
+                return None
+            if not self.track_sequence(source, seq, sender_ts, now_ns):
+                # 没有抖动缓冲时丢弃重复和迟到的数据包，过期的值不会覆盖较新的值
+                return None
+        return source, (cc1, cc11, cc_opt)
+
+    def play_jitter_buffers(self, now_ns):
+        """把各数据源抖动缓冲中到了播放时间的数据包送入处理流程
+
+        返回最早的下一个播放时间(ns)，没有待播放的数据包时返回None。
+        """
+        next_play_ns = None
+        for source in self.sources:
+            jitter = source.jitter
+            if jitter is None:
                 continue
+            for sender_ts, values, recv_ns in jitter.pop_due(now_ns):
+                # 滤波使用被播放的数据包的时间戳，延迟统计从它的接收时间算起
+                source.last_sender_ts = sender_ts
+                source.last_packet_ns = recv_ns
+                self.handle_samples(((source, values),))
+            due_ns = jitter.next_due_ns()
+            if due_ns is not None and (next_play_ns is None or due_ns < next_play_ns):
+                next_play_ns = due_ns
+        return next_play_ns
+
+    def async_play_jitter_buffers(self):
+        """asyncio运行时：播放到期的数据包，并为下一个数据包设置定时器"""
+        if self.jitter_timer is not None:
+            self.jitter_timer.cancel()
+            self.jitter_timer = None
+        now_ns = time.perf_counter_ns()
+        next_play_ns = self.play_jitter_buffers(now_ns)
+        if next_play_ns is not None and self.running:
+            self.jitter_timer = asyncio.get_running_loop().call_later(
+                max(0, next_play_ns - now_ns) / 1_000_000_000, self.async_play_jitter_buffers)
+
+    def track_sequence(self, source, seq, sender_ts, now_ns):
+        """根据序号统计丢包、乱序和重复，并记录网络单向延迟的变化，重复或过期的数据包返回False"""
+        last_seq = source.last_seq
+        if last_seq is not None:
+            # 序号为32位无符号整数，按模运算处理回绕
+            delta = (seq - last_seq) & 0xFFFFFFFF
+            if delta == 0:
+                source.duplicate_packets += 1
+                return False
+            missing = source.missing_seqs
+            if delta >= 0x80000000 and 0x100000000 - delta <= JitterBuffer.RESET_GAP:
+                # 比已收到的序号更早的数据包，每个序号只计一次：之前计为丢失的改计为乱序，其余的是重复
+                if seq in missing:
+                    missing.discard(seq)
+                    source.lost_packets -= 1
+                    source.reordered_packets += 1
+                else:
+                    source.duplicate_packets += 1
+                return False
+            if delta < 0x80000000:
+                source.lost_packets += delta - 1
+                if delta <= JitterBuffer.RESET_GAP:
+                    missing.update((last_seq + i) & 0xFFFFFFFF for i in range(1, delta))
+                    if len(missing) > JitterBuffer.RESET_GAP:
+                        # 序号相差超过RESET_GAP的数据包不会再被接受，保持计为丢失
+                        source.missing_seqs = {s for s in missing if (seq - s) & 0xFFFFFFFF <= JitterBuffer.RESET_GAP}
+                else:
+                    missing.clear()
+            else:
+                # 序号大幅后退：手机端重新开始发送，从新的序号继续
+                missing.clear()
+        source.last_seq = seq
+        source.last_sender_ts = sender_ts
+        self.record_network_delay(source, sender_ts, now_ns)
+        return True
+
+    def record_network_delay(self, source, sender_ts, now_ns):
+        """记录网络单向延迟的变化"""
+        if self.metrics_enabled:
+            # 两端时钟不同步，以观测到的最小差值为基准记录单向延迟的变化
+            offset_us = now_ns // 1000 - sender_ts
+            if source.min_offset_us is None or offset_us < source.min_offset_us:
+                source.min_offset_us = offset_us
+            self.metrics.network.record(offset_us - source.min_offset_us)
+
+    def receive_sample(self, sample, pending):
+        """接收线程处理一个解码后的样本；drain_latest_only时同一轮中后到的覆盖先到的，只记录到pending中"""
+        if not self.drain_latest_only:
+            self.handle_samples((sample,))
+            return
+        source, values = sample
+        # 手势检测仍然使用每一个样本，被覆盖的样本中的峰值不会丢失
+        if self.gestures_enabled:
+            self.detect_gestures(source, values[0])
+        if source.pending_sample is None:
+            pending.append(source)
+        source.pending_sample = values
+
+    def flush_pending(self, pending):
+        """把本轮各数据源的最新数据一起送入滤波器组"""
+        self.handle_samples([(source, source.pending_sample) for source in pending], detect_gestures=False)
+        for source in pending:
+            source.pending_sample = None
+        pending.clear()
+
+    def listen_for_data(self):
+        """监听UDP端口数据
+
+        每次唤醒时把socket中排队的数据报全部读出，数据读入预先分配的缓冲区，
+        开启drain_latest_only时每个数据源只处理最新的一个数据包。
+        """
+        sock = self.sock
+        buffer = bytearray(2048)
+        view = memoryview(buffer)
+        pending = []  # 本轮有待处理数据的数据源
+        next_play_ns = None  # 抖动缓冲中下一个数据包的播放时间
+
+        while self.running:
+            try:
+                # 阻塞等待数据或stop()的唤醒信号，不再需要超时轮询running状态；
+                # 抖动缓冲中有待播放的数据包时最多等到它的播放时间
+                timeout = None
+                if next_play_ns is not None:
+                    timeout = max(0, next_play_ns - time.perf_counter_ns()) / 1_000_000_000
+                events = self.selector.select(timeout)
+                self.listen_wakeups += 1
+                for key, _ in events:
+                    if key.fileobj is self.wakeup_recv:
+                        try:
+                            self.wakeup_recv.recv(64)
+                        except BlockingIOError:
+                            pass
+                if not self.running:
+                    break
+
+                for _ in range(self.max_drain_packets):
+                    try:
+                        nbytes, addr = sock.recvfrom_into(buffer)
+                    except BlockingIOError:
+                        break
+                    except ConnectionResetError:
+                        # Windows上对端不可达时UDP也会报告此错误，忽略即可
+                        continue
+
+                    packet = view[:nbytes]
+                    try:
+                        sample = self.decode_packet(packet, addr, time.perf_counter_ns())
+                    finally:
+                        packet.release()
+                    if sample:
+                        self.receive_sample(sample, pending)
+
+                if pending:
+                    self.flush_pending(pending)
+
+                if self.jitter_buffer_ms:
+                    next_play_ns = self.play_jitter_buffers(time.perf_counter_ns())
+
             except Exception as e:
                 if self.running:  # 只在运行时打印错误
                     print(f"接收数据错误: {e}")
 
-    def start(self):
-        """启动控制器"""
-        # 注册mDNS服务
-        self.register_mdns_service()
+        view.release()
 
-        if not self.initialize_midi():
-            self.unregister_mdns_service()
+    def open_capture(self):
+        """按命令行参数创建抓包文件"""
+        if not self.capture_path:
+            return True
+        try:
+            self.capture = CaptureRing(self.capture_path, self.capture_size_mb * 1024 * 1024)
+            print(f"抓包模式: 数据报将写入 {self.capture_path} (环形文件, {self.capture_size_mb}MB)")
+            return True
+        except OSError as e:
+            print(f"无法创建抓包文件 {self.capture_path}: {e}")
+            return False
+
+    def close_capture(self):
+        if self.capture:
+            print(f"抓包结束: 共写入{self.capture.records}条记录，"
+                  f"{self.capture.dropped}条因过大被丢弃，文件: {self.capture_path}")
+            self.capture.close()
+            self.capture = None
+
+    def run_replay(self, path, speed=1.0, midi_log=None, play=False):
+        """回放抓包文件：数据报按记录的时间送入与实时接收相同的解析、滤波和发送流程
+
+        回放使用抓包文件中的时间作为虚拟时钟，polled模式按send_frequency模拟发送节拍，
+        因此无论回放速度如何，生成的MIDI序列都相同。speed为回放倍速，0表示尽可能快。
+        midi_log不为空时把生成的MIDI序列写入文本文件；play为True时同时发送到MIDI端口。
+        """
+        output = None
+        if play:
+            if not self.initialize_midi():
+                return False
+            output = self.midi_output
+        else:
+            import_mido()
+        self.midi_output = MidiStreamRecorder(midi_log, lambda: self.replay_clock_ns, output)
+
+        # 回放时间与真实时间无关，不统计延迟
+        self.metrics_enabled = False
+        if speed == 0:
+            self.para_monitor_display = "false"
+        for source in self.sources:
+            source.reset_output()
+
+        event_mode = self.output_mode == "event"
+        period_ns = int(1_000_000_000 / self.send_frequency)
+        min_interval_ns = int(self.min_cc_interval_ms * 1_000_000)
+        first_ns = None
+        next_tick_ns = 0
+        next_due_ns = None
+        next_play_ns = None  # 抖动缓冲中下一个数据包的播放时间
+        packets = 0
+        wall_start_ns = time.perf_counter_ns()
+
+        def advance_to(target_ns):
+            """执行虚拟时间target_ns之前到期的发送"""
+            nonlocal next_tick_ns, next_due_ns
+            if event_mode:
+                while next_due_ns is not None and next_due_ns <= target_ns:
+                    self.replay_clock_ns = next_due_ns
+                    next_due_ns = self.emit_sources(next_due_ns, min_interval_ns, period_ns)
+            else:
+                while next_tick_ns <= target_ns:
+                    self.replay_clock_ns = next_tick_ns
+                    self.emit_sources(next_tick_ns)
+                    next_tick_ns += period_ns
+
+        def play_until(target_ns):
+            """按播放时间依次播放抖动缓冲中虚拟时间target_ns之前到期的数据包"""
+            nonlocal next_play_ns, next_due_ns
+            while next_play_ns is not None and next_play_ns <= target_ns:
+                play_ns = next_play_ns
+                advance_to(play_ns)
+                self.replay_clock_ns = play_ns
+                next_play_ns = self.play_jitter_buffers(play_ns)
+                if event_mode:
+                    due_ns = self.emit_sources(play_ns, min_interval_ns, period_ns)
+                    if due_ns is not None:
+                        next_due_ns = due_ns if next_due_ns is None else min(next_due_ns, due_ns)
+
+        print(f"开始回放 {path}，倍速: {speed if speed > 0 else '尽可能快'}，输出模式: {self.output_mode}")
+        self.start_monitor()
+        try:
+            for recv_ns, addr, packet in iter_capture(path):
+                if first_ns is None:
+                    first_ns = recv_ns
+                now_ns = recv_ns - first_ns
+
+                if speed > 0:
+                    # 按倍速等待到该数据报对应的真实时间
+                    delay_ns = wall_start_ns + now_ns / speed - time.perf_counter_ns()
+                    if delay_ns > 0:
+                        time.sleep(delay_ns / 1_000_000_000)
+
+                play_until(now_ns)
+                advance_to(now_ns)
+                self.replay_clock_ns = now_ns
+                sample = self.decode_packet(packet, addr, now_ns)
+                if sample:
+                    self.handle_samples((sample,))
+                    if event_mode:
+                        due_ns = self.emit_sources(now_ns, min_interval_ns, period_ns)
+                        if due_ns is not None:
+                            next_due_ns = due_ns if next_due_ns is None else min(next_due_ns, due_ns)
+                elif self.jitter_buffer_ms:
+                    # 数据包进入了抖动缓冲，迟到的数据包可能已经到了播放时间
+                    next_play_ns = now_ns
+                    play_until(now_ns)
+                packets += 1
+
+            # 最后一个数据报之后继续运行到数据超时，使缓冲中的数据包播放完、暂缓的输出到达终值
+            if first_ns is not None:
+                end_ns = self.replay_clock_ns + int(self.data_timeout * 1_000_000_000)
+                play_until(end_ns)
+                advance_to(end_ns)
+        except (OSError, ValueError) as e:
+            print(f"回放失败: {e}")
             return False
+        finally:
+            self.stop_monitor()
+            recorder = self.midi_output
+            self.midi_output = recorder.output
+            recorder.output = None
+            recorder.close()
+
+        elapsed = (time.perf_counter_ns() - wall_start_ns) / 1_000_000_000
+        print(f"回放完成: {packets}个数据报，生成{recorder.messages}条MIDI消息，耗时{elapsed:.3f}秒"
+              + (f"，MIDI序列已写入 {midi_log}" if midi_log else ""))
+        print(self.format_output_stats())
+        return True
+
+    def start_metrics(self):
+        """按配置启动控制台定期统计输出和本地纯文本统计接口"""
+        if not self.metrics_enabled:
+            return
+        self.metrics_stop.clear()
+
+        if self.metrics_interval > 0:
+            self.metrics_thread = threading.Thread(target=self.report_metrics)
+            self.metrics_thread.daemon = True
+            self.metrics_thread.start()
+
+        if self.metrics_port:
+            import http.server
+            controller = self
+
+            class MetricsHandler(http.server.BaseHTTPRequestHandler):
+                def do_GET(self):
+                    body = (controller.metrics.format_summary(controller.sources, controller.output_mode) + "\n  "
+                            + controller.format_wakeup_stats() + "\n").encode('utf-8')
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    # 不在控制台打印访问日志
+                    pass
+
+            try:
+                self.metrics_server = http.server.ThreadingHTTPServer(('127.0.0.1', self.metrics_port), MetricsHandler)
+                self.metrics_server.daemon_threads = True
+                threading.Thread(target=self.metrics_server.serve_forever, daemon=True).start()
+                print(f"延迟统计接口: http://127.0.0.1:{self.metrics_port}/")
+            except OSError as e:
+                print(f"无法开启延迟统计接口: {e}")
+                self.metrics_server = None
+
+    def report_metrics(self):
+        """定期在控制台打印延迟统计"""
+        while not self.metrics_stop.wait(self.metrics_interval):
+            print(self.metrics.format_summary(self.sources, self.output_mode))
+            print("  " + self.format_wakeup_stats(advance=True))
+
+    def stop_metrics(self):
+        """停止统计输出线程和统计接口"""
+        self.metrics_stop.set()
+        if self.metrics_thread and self.metrics_thread.is_alive():
+            self.metrics_thread.join(timeout=2.0)
+        self.metrics_thread = None
+        if self.metrics_server:
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
+            self.metrics_server = None
+
+    async def async_send_midi_data(self):
+        """asyncio运行时：按绝对截止时间定时发送MIDI控制信号"""
+        for source in self.sources:
+            source.reset_output()
+
+        # asyncio中不能忙等，否则会阻塞事件循环，因此不使用spin_us
+        self.scheduler = DeadlineScheduler(self.send_frequency, 0, self.missed_tick_policy)
+        self.scheduler.reset()
+
+        while self.running:
+            self.send_wakeups += 1
+            now_ns = time.perf_counter_ns()
+            try:
+                self.apply_pending_config(allow_spin=False)
+                self.emit_sources(now_ns)
+            except Exception as e:
+                print(f"MIDI发送错误: {e}")
+            if self.idle_mode and self.next_timeout_ns(now_ns) is None:
+                # 所有数据源都已超时：等到收到数据包再恢复按节拍发送
+                self.async_data_event.clear()
+                self.idle = True
+                self.idle_entries += 1
+                await self.async_data_event.wait()
+                self.idle = False
+                if not self.running:
+                    break
+                self.scheduler.resume()
+                continue
+            await asyncio.sleep(self.scheduler.time_until_deadline())
+            self.scheduler.advance()
+
+    async def async_send_midi_on_arrival(self):
+        """asyncio运行时的事件驱动模式：收到数据后立即发送MIDI控制信号"""
+        for source in self.sources:
+            source.reset_output()
+        min_interval_ns = int(self.min_cc_interval_ms * 1_000_000)
+        followup_ns = int(1_000_000_000 / self.send_frequency)
+        next_due_ns = None
+        now_ns = time.perf_counter_ns()
+
+        while self.running:
+            wait_timeout = self.event_wait_timeout(next_due_ns, now_ns)
+            if wait_timeout is None:
+                self.idle = True
+                self.idle_entries += 1
+            try:
+                await asyncio.wait_for(self.async_data_event.wait(), wait_timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.idle = False
+            self.async_data_event.clear()
+            self.send_wakeups += 1
+            if not self.running:
+                break
+
+            try:
+                if self.apply_pending_config(allow_spin=False):
+                    min_interval_ns = int(self.min_cc_interval_ms * 1_000_000)
+                    followup_ns = int(1_000_000_000 / self.send_frequency)
+                now_ns = time.perf_counter_ns()
+                next_due_ns = self.emit_sources(now_ns, min_interval_ns, followup_ns)
+            except Exception as e:
+                print(f"MIDI发送错误: {e}")
+                next_due_ns = None
 
+    async def async_main(self):
+        """asyncio运行时主协程：接收、发送和mDNS注册都在同一个事件循环中进行"""
+        loop = self.async_loop = import_asyncio().get_running_loop()
         self.running = True
 
-        # 启动监听线程
-        self.listen_thread = threading.Thread(target=self.listen_for_data)
-        self.listen_thread.daemon = True
-        self.listen_thread.start()
+        transport = None
+        try:
+            # 先开始接收，mDNS在后台线程中注册，MIDI初始化放到线程池中执行，期间到达的数据照常处理
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: create_datagram_protocol(self), local_addr=('0.0.0.0', self.port))
+            print(f"监听端口 {self.port}")
+            self.mark_startup("开始监听")
+            if not self.open_capture():
+                return
+            self.start_mdns()
+            if not await loop.run_in_executor(None, self.initialize_midi):
+                print("控制器启动失败")
+                return
+            self.start_metrics()
+            self.start_monitor()
+            self.start_config_watcher()
+            print(self.format_startup_report())
+            print("控制器已启动(asyncio)，按 Ctrl+C 停止...")
+
+            self.async_data_event = asyncio.Event()
+            if self.output_mode == "event":
+                await self.async_send_midi_on_arrival()
+            else:
+                await self.async_send_midi_data()
+        except OSError as e:
+            print(f"无法监听端口 {self.port}: {e}")
+        finally:
+            self.running = False
+            self.async_data_event = None
+            self.async_loop = None
+            if self.jitter_timer is not None:
+                self.jitter_timer.cancel()
+                self.jitter_timer = None
+            if transport:
+                transport.close()
+
+    def run_asyncio(self):
+        """以asyncio单线程方式运行控制器，阻塞直到按下Ctrl+C"""
+        import_asyncio().run(self.async_main())
+
+    def start_shards(self):
+        """分片模式：启动工作进程，每个进程用SO_REUSEPORT监听同一端口并完成解析和滤波"""
+        import multiprocessing
+        if not hasattr(socket, "SO_REUSEPORT"):
+            print("当前系统不支持SO_REUSEPORT，无法使用分片模式")
+            return False
+        if self.capture_path:
+            print("分片模式不支持抓包")
+            return False
+        if self.output_mode == "event":
+            # 工作进程无法直接唤醒发送线程，按send_frequency读取共享内存中的结果
+            print("分片模式下使用polled输出模式")
+            self.output_mode = "polled"
+        if self.gestures_enabled:
+            # 手势检测需要逐个样本，共享内存中只有最新的滤波结果
+            print("分片模式不支持手势检测，已关闭")
+            self.gestures_enabled = False
+        shards = self.shards or os.cpu_count() or 1
+        rows = self.filter_bank.rows
+
+        self.shard_table = ShardTable(shards, rows)
+        self.shard_stop = multiprocessing.Event()
+        ready = multiprocessing.Queue()
+        for index in range(shards):
+            worker = multiprocessing.Process(
+                target=run_shard_worker, name=f"shard-{index}", daemon=True,
+                args=(index, self.port, self.shard_table.name, shards, rows, ready, self.shard_stop))
+            worker.start()
+            self.shard_workers.append(worker)
+        self.running = True
+
+        for _ in range(shards):
+            try:
+                index, error = ready.get(timeout=10)
+            except Exception:
+                print("分片工作进程启动超时")
+                return False
+            if error:
+                print(f"分片工作进程 {index} 启动失败: {error}")
+                return False
+        print(f"分片模式: {shards}个工作进程监听端口 {self.port}")
+        return True
+
+    def stop_shards(self):
+        if self.shard_stop is not None:
+            self.shard_stop.set()
+        for worker in self.shard_workers:
+            worker.join(timeout=2.0)
+            if worker.is_alive():
+                worker.terminate()
+        self.shard_workers = []
+        self.shard_stop = None
+        if self.shard_table is not None:
+            self.shard_table.close(unlink=True)
+            self.shard_table = None
+
+    def poll_shards(self):
+        """分片模式：从共享内存读取工作进程发布的新滤波结果，更新对应数据源的frame"""
+        table = self.shard_table
+        monitor = self.monitor
+        for slot in range(table.slots):
+            record = table.read(slot)
+            if record is None:
+                continue
+            address, packets, frame = record
+            source = self.source_by_addr.get(address)
+            if source is None:
+                source = self.add_unknown_source(address)
+            if not source:
+                continue
+            source.packets = packets
+            source.last_packet_ns = frame.packet_ns
+            source.frame = frame
+            if self.metrics_enabled:
+                self.metrics.filter.record((frame.filtered_ns - frame.packet_ns) // 1000)
+            if monitor is not None:
+                # 分片模式下参数监控显示的是滤波后的值
+                source.monitor_values = frame.values
+                monitor.version += 1
+
+    def start(self):
+        """启动控制器
+
+        先打开socket并启动监听线程，手机的数据在MIDI初始化期间就开始被接收和滤波；
+        mDNS服务在后台线程中注册，不阻塞启动。失败时由stop()负责清理。
+        """
+        if self.shards != 1:
+            if not self.start_shards():
+                return False
+        else:
+            if not self.open_socket():
+                return False
+
+            if not self.open_capture():
+                return False
+
+            # 启动监听线程
+            self.running = True
+            self.listen_thread = threading.Thread(target=self.listen_for_data)
+            self.listen_thread.daemon = True
+            self.listen_thread.start()
+        self.mark_startup("开始监听")
+
+        # 在后台注册mDNS服务
+        self.start_mdns()
+
+        if not self.initialize_midi():
+            return False
+
+        self.start_metrics()
+        self.start_monitor()
+        self.start_config_watcher()
 
         # 启动MIDI发送线程
-        self.send_thread = threading.Thread(target=self.send_midi_data)
+        if self.output_mode == "event":
+            self.send_thread = threading.Thread(target=self.send_midi_on_arrival)
+        else:
+            self.send_thread = threading.Thread(target=self.send_midi_data)
         self.send_thread.daemon = True
         self.send_thread.start()
 
+        print(self.format_startup_report())
         return True
 
     def stop(self):
         """停止控制器"""
         self.running = False
+        self.stop_config_watcher()
+
+        # 唤醒可能正在等待新数据的发送线程(或asyncio发送协程)
+        self.wake_sender()
+
+        # 唤醒正在等待数据的监听线程
+        if self.wakeup_send:
+            try:
+                self.wakeup_send.send(b'\0')
+            except OSError:
+                pass
 
         # 等待线程结束，但设置超时时间
         if self.listen_thread and self.listen_thread.is_alive():
@@ -555,13 +3791,35 @@ class MIDISensorController:
         if self.send_thread and self.send_thread.is_alive():
             self.send_thread.join(timeout=2.0)
 
+        # 打印发送节拍统计
+        if self.scheduler:
+            print(self.scheduler.format_stats())
+        self.stop_monitor()
+        print(self.format_output_stats())
+        self.stop_metrics()
+        if self.metrics_enabled and self.metrics.total.count:
+            print(self.metrics.format_summary(self.sources, self.output_mode))
+        if self.metrics_enabled:
+            # 退出时打印整个运行期间的平均值
+            self.wakeup_snapshot = (self.wakeup_origin_ns, 0, 0)
+            print(self.format_wakeup_stats())
+
         # 关闭socket
-        if self.sock:
-            try:
-                self.sock.close()
-            except:
-                pass
-            self.sock = None
+        if self.selector:
+            self.selector.close()
+            self.selector = None
+        for sock in (self.sock, self.wakeup_recv, self.wakeup_send):
+            if sock:
+                try:
+                    sock.close()
+                except:
+                    pass
+        self.sock = None
+        self.wakeup_recv = None
+        self.wakeup_send = None
+
+        self.close_capture()
+        self.stop_shards()
 
         # 关闭MIDI输出
         if self.midi_output:
@@ -575,22 +3833,105 @@ class MIDISensorController:
         self.unregister_mdns_service()
 
 
+def run_shard_worker(index, port, table_name, shards, rows, ready, stop):
+    """分片工作进程：接收分给本进程的手机数据包，解析、滤波后把结果发布到共享内存"""
+    import contextlib
+    import signal
+    # Ctrl+C由主进程处理，主进程通过stop通知工作进程退出
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # 配置已经在主进程中打印过
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+        controller = MIDISensorController(port)
+    controller.port = port
+    # 数据源数量上限与主进程一致，共享内存中为每个数据源留有一条记录
+    controller.max_sources = rows
+    controller.filter_bank = controller.build_filter_bank()
+    controller.metrics_enabled = False
+    controller.gestures_enabled = False
+    controller.para_monitor_display = "false"
+    controller.shard_table = ShardTable(shards, rows, table_name, shard=index)
+
+    if not controller.open_socket(reuse_port=True):
+        ready.put((index, f"无法监听端口 {port}"))
+        controller.shard_table.close()
+        return
+    ready.put((index, None))
+    controller.running = True
+
+    def wait_for_stop():
+        stop.wait()
+        controller.running = False
+        controller.wakeup_send.send(b'\0')
+
+    threading.Thread(target=wait_for_stop, daemon=True).start()
+    try:
+        controller.listen_for_data()
+    finally:
+        controller.selector.close()
+        for sock in (controller.sock, controller.wakeup_recv, controller.wakeup_send):
+            sock.close()
+        controller.shard_table.close()
+
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="Phone MIDI Controller")
+    parser.add_argument("port", nargs="?", help="监听端口号，覆盖set.ini中的listen_port")
+    parser.add_argument("--runtime", choices=("threads", "asyncio"), default="threads",
+                        help="运行方式: threads(接收与发送各一个线程，默认) / asyncio(单线程事件循环)")
+    parser.add_argument("--null-midi", action="store_true", help="不打开MIDI端口，消息只记录在内存中(用于测试与基准)")
+    parser.add_argument("--no-mdns", action="store_true", help="不注册mDNS服务")
+    parser.add_argument("--midi-port", metavar="NAME", help="按名称或正则表达式选择MIDI输出端口，覆盖set.ini中的midi_port")
+    parser.add_argument("--headless", action="store_true", help="无人值守启动：不等待任何键盘输入")
+    parser.add_argument("--shards", type=int, help="分片模式的工作进程数，0表示使用全部CPU核心，覆盖set.ini中的shards")
+    parser.add_argument("--capture", metavar="FILE", help="抓包模式：把接收到的原始数据报写入环形抓包文件")
+    parser.add_argument("--capture-mb", type=int, default=64, help="抓包文件大小(MB)，写满后覆盖最早的数据，默认64")
+    parser.add_argument("--replay", metavar="FILE", help="回放模式：把抓包文件送入处理流程，不监听网络")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放倍速，1为实时，0为尽可能快，默认1")
+    parser.add_argument("--midi-log", metavar="FILE", help="回放时把生成的MIDI序列写入文本文件")
+    parser.add_argument("--play", action="store_true", help="回放时同时发送到MIDI端口")
+    return parser.parse_args()
+
+
 def main():
     # 默认端口号
     default_port = 8081
 
+    args = parse_args()
     controller = MIDISensorController(default_port)
 
     # 如果通过命令行指定了端口号，则使用命令行参数覆盖配置文件设置
-    if len(sys.argv) > 1:
+    if args.port is not None:
         try:
-            controller.port = int(sys.argv[1])
+            controller.port = int(args.port)
             print(f"使用命令行指定的端口: {controller.port}")
         except ValueError:
             print(f"命令行端口参数无效，使用配置文件或默认端口: {controller.port}")
 
+    controller.null_midi = args.null_midi
+    controller.mdns_enabled = not args.no_mdns
+    if args.midi_port is not None:
+        controller.midi_port = args.midi_port
+    controller.headless = controller.headless or args.headless
+    if args.shards is not None:
+        controller.shards = max(0, args.shards)
+    controller.capture_path = args.capture
+    controller.capture_size_mb = args.capture_mb
+
+    if args.replay:
+        try:
+            controller.run_replay(args.replay, args.speed, args.midi_log, args.play)
+        except KeyboardInterrupt:
+            print("\n回放已中断")
+        return
+
     try:
-        if controller.start():
+        if args.runtime == "asyncio":
+            if controller.shards != 1:
+                print("asyncio运行方式不支持分片模式，使用单进程接收")
+                controller.shards = 1
+            controller.run_asyncio()
+        elif controller.start():
             print(f"控制器已启动，按 Ctrl+C 停止...")
             # 保持主线程运行
             while True:
@@ -0,0 +1,434 @@
+"""midi_controller_v0_6_1 的单元测试，不需要手机和MIDI设备
+
+用法: python -m pytest -q tests
+"""
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import midi_controller_v0_6_1 as controller_module
+from midi_controller_v0_6_1 import (BINARY_PACKET, PACKET_MAGIC, PACKET_VERSION, GestureDetector, MidiPortWriter,
+                                    MemoryMidiOutput, MIDISensorController, RateBudget, SensorFrame)
+
+pytest.importorskip("mido")
+
+
+def make_controller(**settings):
+    """创建一个使用内存MIDI输出、不启动任何线程的控制器"""
+    controller_module.import_mido()
+    controller = MIDISensorController(18090)
+    for name, value in settings.items():
+        setattr(controller, name, value)
+    controller.midi_output = MemoryMidiOutput()
+    return controller
+
+
+@pytest.mark.parametrize("mode, group_size", [("cc7", 1), ("cc14", 2), ("nrpn", 4)])
+@pytest.mark.parametrize("rate", [5, 30, 60])
+def test_low_rate_budget_sends_whole_groups(mode, group_size, rate):
+    controller = make_controller(output_budget=RateBudget(rate), min_delta=1, settle_ms=0, keepalive_ms=0)
+    source = controller.add_unknown_source("10.0.0.1")
+    source.cc_modes = [mode, mode, mode]
+    frame = SensorFrame((0.0, 0.0, 0.0), 0, 0)
+
+    # 每个tick都变化的值，在2秒内以100Hz尝试发送
+    sent_groups = 0
+    for tick in range(200):
+        now_ns = tick * 10_000_000
+        before = controller.midi_output.count
+        controller.coalesce_cc(source, 0, 1, (tick * 200) % 16000 if mode != "cc7" else tick % 128,
+                               now_ns, 0, frame)
+        if controller.midi_output.count > before:
+            sent_groups += 1
+    # 成组的消息不能因为桶容量不足被永远推迟，发送的消息数接近速率上限
+    assert sent_groups > 0
+    assert controller.midi_output.count <= rate * 2 + RateBudget.MIN_BURST + group_size
+    assert controller.midi_output.count >= rate * 2 * 0.5
+
+
+def test_rate_budget_capacity_fits_largest_group():
+    for rate in (1, 30, 60, 79):
+        budget = RateBudget(rate)
+        assert budget.capacity >= RateBudget.MIN_BURST
+        assert budget.take(0, 4)
+
+
+def binary_packet(seq, cc1):
+    return BINARY_PACKET.pack(PACKET_MAGIC, PACKET_VERSION, 0, seq & 0xFFFFFFFF, seq * 10_000, cc1, 45.0, 0.0)
+
+
+def test_stale_and_duplicate_packets_are_dropped_without_jitter_buffer():
+    controller = make_controller(jitter_buffer_ms=0)
+    addr = ("10.0.0.2", 5000)
+    assert controller.decode_packet(binary_packet(5008, 8.0), addr, 0)[1][0] == 8.0
+    assert controller.decode_packet(binary_packet(5010, 10.0), addr, 1)[1][0] == 10.0
+    # 乱序到达的旧数据包和重复的数据包不能覆盖较新的值
+    assert controller.decode_packet(binary_packet(5009, 9.0), addr, 2) is None
+    assert controller.decode_packet(binary_packet(5010, 10.0), addr, 3) is None
+    assert controller.decode_packet(binary_packet(5012, 12.0), addr, 4)[1][0] == 12.0
+    assert controller.decode_packet(binary_packet(5009, 9.0), addr, 5) is None
+    source = controller.source_by_addr["10.0.0.2"]
+    # 每个序号只计一次：5009先计为丢失，到达后改计为乱序，再次到达计为重复
+    assert (source.lost_packets, source.duplicate_packets, source.reordered_packets) == (1, 2, 1)
+    # 手机端重新开始发送时序号大幅后退，仍然接受
+    assert controller.decode_packet(binary_packet(0, 1.0), addr, 5)[1][0] == 1.0
+    assert controller.decode_packet(binary_packet(1, 2.0), addr, 6)[1][0] == 2.0
+
+
+@pytest.mark.parametrize("output_mode", ["polled", "event"])
+def test_stop_and_reload_wake_idle_asyncio_sender(output_mode):
+    controller = make_controller(port=18091, output_mode=output_mode, idle_mode=True, null_midi=True,
+                                 mdns_enabled=False, hot_reload=False, metrics_enabled=False,
+                                 para_monitor_display="false", headless=True)
+    runner = threading.Thread(target=controller.run_asyncio, daemon=True)
+    runner.start()
+    deadline = time.monotonic() + 5
+    while not controller.idle and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert controller.idle
+
+    # 其他线程中的配置热更新也要唤醒空闲的发送协程
+    controller.pending_config = make_controller()
+    controller.wake_sender()
+    deadline = time.monotonic() + 2
+    while controller.pending_config is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert controller.pending_config is None
+
+    controller.stop()
+    runner.join(2)
+    assert not runner.is_alive()
+
+
+def test_sender_does_not_idle_before_marking_a_source_timed_out(capsys):
+    controller = make_controller(idle_mode=True, gestures_enabled=True)
+    source = controller.add_unknown_source("10.0.0.6")
+    source.last_packet_ns = 5_000_000_000
+    source.is_data_timeout = False
+    source.gesture_velocity = 100  # 仍按下的手势音符
+    deadline_ns = controller.next_timeout_ns(source.last_packet_ns)
+    # 本轮发送时数据源还没有超时
+    assert not controller.check_data_timeout(source, deadline_ns - 1)
+    capsys.readouterr()
+    # 空闲判断时已经过了超时时间：这个数据源还没有被标记为超时，不能进入空闲
+    assert controller.next_timeout_ns(deadline_ns) == deadline_ns
+    assert controller.event_wait_timeout(None, deadline_ns) == 0
+    assert not controller.wait_while_idle(deadline_ns)
+
+    controller.emit_sources(deadline_ns)
+    assert source.is_data_timeout and source.gesture_velocity == 0
+    assert "数据超时" in capsys.readouterr().out
+    assert any(msg.type == "note_off" for _, msg in controller.midi_output.messages)
+    assert controller.next_timeout_ns(deadline_ns) is None
+
+
+def start_gesture(detector, peak):
+    """静止的基线(均值和偏差都为0)之后上升到peak"""
+    for i in range(10):
+        assert detector.update(0.0, i * 0.01) is None
+    assert detector.update(peak / 2, 0.10) is None
+    assert detector.update(peak, 0.11) is None
+
+
+def test_gesture_peak_needs_five_percent_drop_without_noise():
+    detector = GestureDetector(min_level=2.0)
+    start_gesture(detector, 20.0)
+    assert detector.peak_drop(20.0) == pytest.approx(1.0)
+    assert detector.update(19.0, 0.12) is None  # 回落正好5%，还不是峰值
+    events = detector.update(18.9, 0.13)
+    assert events == [("peak", detector.velocity(20.0))]
+
+
+def test_gesture_peak_needs_twice_the_baseline_deviation():
+    detector = GestureDetector(min_level=2.0)
+    start_gesture(detector, 20.0)
+    detector.dev = 1.5  # 手势进行中基线不更新，直接设置噪声幅度
+    assert detector.peak_drop(20.0) == pytest.approx(3.0)
+    assert detector.update(17.5, 0.12) is None
+    assert detector.update(16.9, 0.13)[0][0] == "peak"
+
+
+def test_gestures_see_every_sample_when_draining_latest_only():
+    controller = make_controller(gestures_enabled=True, drain_latest_only=True, jitter_buffer_ms=0)
+    addr = ("10.0.0.3", 5000)
+    # 同一轮中读到的整次晃动只有最后一个样本会进入滤波器，峰值不能因此丢失
+    pending = []
+    for seq, cc1 in enumerate([0.0] * 10 + [10.0, 25.0, 12.0, 0.0]):
+        controller.receive_sample(controller.decode_packet(binary_packet(seq, cc1), addr, seq), pending)
+    controller.flush_pending(pending)
+    source = controller.source_by_addr["10.0.0.3"]
+    assert source.packets == 14 and source.frame is not None
+    assert [kind for kind, _ in source.gesture_events] == ["peak", "release"]
+
+
+def reload_with(controller, monkeypatch, tmp_path, text):
+    """用tmp_path中的set.ini做一次热更新，返回新配置(有错误时为None)"""
+    (tmp_path / "set.ini").write_text(text, encoding="utf-8")
+    monkeypatch.setattr(MIDISensorController, "get_resource_path",
+                        lambda self, relative_path: str(tmp_path / relative_path))
+    return controller.load_reload_candidate()
+
+
+def test_reload_candidate_is_quiet_and_lightweight(monkeypatch, tmp_path, capsys):
+    controller = make_controller()
+    capsys.readouterr()
+    candidate = reload_with(controller, monkeypatch, tmp_path, "[MIDIController]\naef=0.3\n")
+    assert candidate is not None and candidate.aef == 0.3
+    assert candidate.filter_bank is None
+    assert "已加载" not in capsys.readouterr().out
+
+    assert reload_with(controller, monkeypatch, tmp_path, "[MIDIController]\noutput_mode=fast\n") is None
+    assert "output_mode" in capsys.readouterr().out
+
+
+def test_reload_keeps_worker_filter_settings_in_sharded_mode(monkeypatch, tmp_path, capsys):
+    controller = make_controller(shard_table=object())
+    old_aef = controller.aef
+    candidate = reload_with(controller, monkeypatch, tmp_path,
+                            "[MIDIController]\naef=0.37\n[Output]\nkeepalive_ms=250\n")
+    assert "aef" in capsys.readouterr().out
+    controller.pending_config = candidate
+    assert controller.apply_pending_config()
+    # 工作进程的滤波设置需要重启，发送端的设置照常更新
+    assert controller.aef == old_aef
+    assert controller.keepalive_ms == 250
+    assert controller.pending_receiver_config is None
+    controller.shard_table = None
+
+
+def test_receiver_settings_are_swapped_in_on_the_receiver_thread(monkeypatch, tmp_path):
+    controller = make_controller()
+    controller.filter_bank = controller.build_filter_bank()
+    old_max, old_bank = controller.cc1_max, controller.filter_bank
+    # 只有[Output]、没有[MIDIController]节时同样读取
+    candidate = reload_with(controller, monkeypatch, tmp_path,
+                            "[Output]\nkeepalive_ms=250\n[IMU]\ncc1=pitch\n[Sensors]\ncc1_range=0,50\n")
+    assert candidate.keepalive_ms == 250
+    candidate.cc1_max = old_max + 10
+    controller.pending_config = candidate
+    assert controller.apply_pending_config()
+    # 发送线程只换上发送相关的设置，接收线程读取的设置保持不变，直到接收线程处理下一个数据包
+    assert controller.keepalive_ms == 250
+    assert (controller.cc1_max, controller.imu_channels[0]) == (old_max, "shake")
+    assert controller.filter_bank is old_bank
+    controller.decode_packet(binary_packet(1, 10.0), ("10.0.0.10", 5000), 1)
+    assert (controller.cc1_max, controller.imu_channels[0]) == (old_max + 10, "pitch")
+    assert controller.filter_bank is not old_bank and controller.pending_receiver_config is None
+
+
+def test_port_writer_overflow_drops_only_cc_groups():
+    mido = controller_module.import_mido()
+    writer = MidiPortWriter("test", MemoryMidiOutput(), queue_size=2)
+    note_on = mido.Message('note_on', note=60, velocity=100)
+    note_off = mido.Message('note_off', note=60)
+    writer.send_events([note_on])
+    for control in range(5):
+        writer.send_group((0, control), [mido.Message('control_change', control=control, value=1)])
+    writer.send_events([note_off])
+    # 写线程还没有启动，队列只能容纳2组CC；音符事件全部保留
+    assert writer.dropped == 3
+    assert list(writer.events) == [note_on, note_off]
+
+    writer.start()
+    deadline = time.monotonic() + 2
+    while writer.sent < 4 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    writer.close()
+    sent = [msg for _, msg in writer.port.messages]
+    assert sent[:2] == [note_on, note_off]
+    assert [msg.control for msg in sent[2:]] == [3, 4]
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+def test_each_port_writer_has_its_own_rate_budget():
+    mido = controller_module.import_mido()
+    # 时钟停止不前：慢端口只有桶里初始的令牌，不会随时间补充
+    slow = MidiPortWriter("slow", MemoryMidiOutput(), rate=20, clock=lambda: 0)
+    fast = MidiPortWriter("fast", MemoryMidiOutput(), rate=0, clock=lambda: 0)
+    note_on = mido.Message('note_on', note=60, velocity=100)
+    for writer in (slow, fast):
+        writer.start()
+    try:
+        for control in range(10):
+            for writer in (slow, fast):
+                writer.send_group((0, control), [mido.Message('control_change', control=control, value=1)])
+        assert wait_until(lambda: slow.budget.deferred > 0 and fast.sent == 10)
+        for writer in (slow, fast):
+            writer.send_events([note_on])
+        assert wait_until(lambda: slow.sent == slow.budget.capacity + 1 and fast.sent == 11)
+    finally:
+        slow.close()
+        fast.close()
+    # 慢端口用完额度后只推迟CC，音符不受限制；另一个端口不受它的额度影响
+    slow_sent = [msg for _, msg in slow.port.messages]
+    assert note_on in slow_sent
+    assert len(slow_sent) == slow.budget.capacity + 1
+    assert len(slow.pending) == 10 - slow.budget.capacity
+    assert fast.budget.deferred == 0 and note_on in [msg for _, msg in fast.port.messages]
+
+
+def test_jitter_buffer_counts_each_sequence_once():
+    controller = make_controller(jitter_buffer_ms=5, jitter_buffer_max_ms=5, metrics_enabled=False)
+    addr = ("10.0.0.4", 5000)
+    for seq in (0, 1, 3):
+        controller.decode_packet(binary_packet(seq, 1.0), addr, seq * 10_000_000)
+    controller.play_jitter_buffers(100_000_000)
+    # 序号2在播放时被跳过，之后到达只计为迟到；序号3再次到达计为重复
+    controller.decode_packet(binary_packet(2, 1.0), addr, 110_000_000)
+    controller.decode_packet(binary_packet(3, 1.0), addr, 120_000_000)
+    source = controller.source_by_addr["10.0.0.4"]
+    jitter = source.jitter
+    assert (jitter.played, jitter.lost, jitter.late, jitter.duplicates) == (3, 0, 1, 1)
+    assert (source.lost_packets, source.reordered_packets, source.duplicate_packets) == (0, 0, 0)
+
+
+def test_hires_curves_are_built_only_when_needed():
+    controller = make_controller(cc_modes=["cc7", "cc7", "cc7"])
+    controller.curves = controller.build_curves()
+    assert all(curve14 is None for _, curve14 in controller.curves)
+    curve = controller.hires_curve(controller.curves, 0)
+    assert curve is controller.curves[0][1]
+    assert curve.lookup(controller.cc1_max) == 16383
+    controller.cc_modes = ["cc7", "nrpn", "cc7"]
+    assert [curve14 is None for _, curve14 in controller.build_curves()] == [True, False, True]
+
+
+def test_filter_bank_vectorized_path_matches_python(monkeypatch):
+    pytest.importorskip("numpy")
+    import math
+    from midi_controller_v0_6_1 import FilterBank
+
+    def make_bank(rows, channels):
+        kinds = ["none", "smooth", "oneeuro", "oneeuro"] * (channels // 4)
+        return FilterBank(rows, [0.3] * channels, [0.0] * channels, [90.0] * channels, kinds, [True] * channels,
+                          betas=[0.05] * channels, leads=[0.01] * channels)
+
+    # 32个通道时单个数据源的更新也使用NumPy
+    vectorized = make_bank(2, 32)
+    assert vectorized.use_numpy(1)
+    monkeypatch.setattr(FilterBank, "VECTORIZE_MIN_VALUES", math.inf)
+    python = make_bank(2, 32)
+    assert not python.vectorized
+    for step in range(50):
+        values = [float((step * 7 + channel * 13) % 100) for channel in range(32)]
+        vectorized.update(1, values, step * 0.01)
+        python.update(1, values, step * 0.01)
+        assert list(vectorized.values(1)) == pytest.approx(list(python.values(1)))
+
+
+def test_controller_filter_bank_vectorizes_multi_source_batches(monkeypatch):
+    pytest.importorskip("numpy")
+    controller = make_controller(max_sources=8, cc1_filter="oneeuro", cc11_filter="smooth")
+    bank = controller.build_filter_bank()
+    # 8个数据源 x 3个通道一起更新时使用NumPy，单个数据源仍逐通道计算
+    assert bank.use_numpy(8) and not bank.use_numpy(1)
+    monkeypatch.setattr(controller, "vectorize_min_values", float("inf"))
+    reference = controller.build_filter_bank()
+    assert not reference.vectorized
+    rows = list(range(8))
+    for step in range(30):
+        values = [[float((step * 5 + row * 11) % 60), float((step * 3 + row) % 90), float(step % 2)] for row in rows]
+        times = [step * 0.01] * len(rows)
+        if step % 3:
+            bank.update_rows(rows, values, times)
+        else:
+            # 单个数据源的逐通道更新与批量的NumPy更新共用同一份状态
+            for row in rows:
+                bank.update(row, values[row], times[row])
+        reference.update_rows(rows, values, times)
+        for row in rows:
+            assert bank.values(row) == pytest.approx(reference.values(row))
+
+
+def test_resume_message_only_after_a_real_timeout(capsys):
+    controller = make_controller()
+    source = controller.add_unknown_source("10.0.0.5")
+    source.last_packet_ns = 10_000_000_000
+    capsys.readouterr()
+    # 新数据源的第一个数据包不是"恢复"
+    assert not controller.check_data_timeout(source, source.last_packet_ns)
+    assert "恢复数据接收" not in capsys.readouterr().out
+    timeout_ns = int(source.data_timeout * 1_000_000_000)
+    assert controller.check_data_timeout(source, source.last_packet_ns + timeout_ns + 1)
+    assert "数据超时" in capsys.readouterr().out
+    source.last_packet_ns += 2 * timeout_ns
+    assert not controller.check_data_timeout(source, source.last_packet_ns)
+    assert "恢复数据接收" in capsys.readouterr().out
+
+
+def test_dropped_groups_force_full_hires_and_nrpn_resend():
+    from midi_controller_v0_6_1 import MidiFanout
+    controller = make_controller(min_delta=1, settle_ms=0, keepalive_ms=0, hires_step=1)
+    writer = MidiPortWriter("test", MemoryMidiOutput(), queue_size=1)
+    controller.midi_output = MidiFanout([writer])
+    source = controller.add_unknown_source("10.0.0.7")
+    source.cc_modes = ["nrpn", "cc14", "cc7"]
+    frame = SensorFrame((0.0, 0.0, 0.0), 0, 0)
+    controller.coalesce_cc(source, 0, 1, 300, 0, 0, frame)
+    assert source.cc_sent[0] == 300 and controller.nrpn_selected == {(0, source.channel): 1}
+    # 写线程没有启动，队列只能容纳1组：cc11的组挤掉了cc1的NRPN组(参数号选择和MSB)
+    controller.coalesce_cc(source, 1, 11, 1000, 0, 0, frame)
+    assert writer.dropped == 1
+    assert source.cc_sent[0] is None and controller.nrpn_selected == {}
+    # 下一次cc1输出重新发送99/98和MSB，而不是只发送LSB
+    controller.coalesce_cc(source, 0, 1, 301, 1, 0, frame)
+    assert [msg.control for msg in writer.pending[(source.channel, 1)].values()] == [99, 98, 6, 38]
+
+
+def test_nrpn_selection_is_tracked_per_port_channel():
+    from midi_controller_v0_6_1 import MidiFanout
+    controller = make_controller(min_delta=1, settle_ms=0, keepalive_ms=0, hires_step=1)
+    # 两个数据源的通道在端口上都改为通道5
+    writer = MidiPortWriter("test", MemoryMidiOutput(), channel=4)
+    controller.midi_output = MidiFanout([writer])
+    first = controller.add_unknown_source("10.0.0.8")
+    second = controller.add_unknown_source("10.0.0.9")
+    assert first.channel != second.channel
+    frame = SensorFrame((0.0, 0.0, 0.0), 0, 0)
+    for source in (first, second):
+        source.cc_modes = ["nrpn", "cc7", "cc7"]
+    controller.coalesce_cc(first, 0, 1, 300, 0, 0, frame)
+    controller.coalesce_cc(second, 0, 2, 300, 0, 0, frame)
+    # 端口通道5上当前选中的是参数2，第一个数据源再次输出时必须重新选择参数1
+    messages = controller.build_cc_messages(first, 0, 1, 301)
+    assert [msg.control for msg in messages] == [99, 98, 6, 38]
+    # 同一端口通道上没有切换参数时只发送LSB
+    assert [msg.control for msg in controller.build_cc_messages(second, 0, 2, 301)] == [38]
+
+
+def test_sources_rotate_only_after_new_deferrals():
+    controller = make_controller(keepalive_ms=0)
+    for address in ("10.0.0.11", "10.0.0.12"):
+        controller.add_unknown_source(address)
+    controller.output_budget.deferred = 3
+    controller.emit_sources(0)
+    offset = controller.emit_offset
+    assert offset == 1
+    # 之后没有新的推迟：不再轮换
+    controller.emit_sources(1)
+    controller.emit_sources(2)
+    assert controller.emit_offset == offset
+    controller.output_budget.deferred += 1
+    controller.emit_sources(3)
+    assert controller.emit_offset != offset
+
+
+def test_configured_sources_get_distinct_default_channels(monkeypatch, tmp_path):
+    controller = make_controller()
+    candidate = reload_with(controller, monkeypatch, tmp_path,
+                            "[Source.a]\naddress=10.0.1.1\n[Source.b]\naddress=10.0.1.2\nchannel=2\n"
+                            "[Source.c]\naddress=10.0.1.3\n")
+    channels = {source.name: source.channel + 1 for source in candidate.configured_sources}
+    # 未设置channel的数据源跳过其他数据源已经占用的通道
+    assert channels == {"a": 1, "b": 2, "c": 3}